@@ -0,0 +1,51 @@
+# Archive throughput of a directory snapshot, then the time to refresh the zip
+# after one file changes (the unchanged members are copied, not recompressed).
+#
+#   python benchmarks/archive_throughput.py --size-gb 4 --file-mb 16 --formats zip tar.gz
+import argparse
+import os
+import sys
+import tempfile
+
+from common import load_module, make_tree, peak_rss_mb, timed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time directory snapshot exports and incremental zip updates.")
+    parser.add_argument("--root", help="archive this directory instead of generating one")
+    parser.add_argument("--work-dir", help="where the generated tree and archives go (default: a temp dir)")
+    parser.add_argument("--size-gb", type=float, default=4.0, help="total size of the generated tree")
+    parser.add_argument("--file-mb", type=float, default=16.0, help="size of each generated file")
+    parser.add_argument("--formats", nargs="+", default=["zip", "tar.gz"])
+    parser.add_argument("--level", type=int, default=1)
+    parser.add_argument("--workers", type=int, help="compression threads (default: one per CPU)")
+    args = parser.parse_args(argv)
+    ftm = load_module()
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as temp_dir:
+        root = args.root
+        if not root:
+            file_size = int(args.file_mb * (1 << 20))
+            dirs = max(1, round(args.size_gb * (1 << 30) / file_size / 10))
+            root, seconds = timed(make_tree, os.path.join(temp_dir, "tree"), dirs, 10, file_size)
+            print(f"generated {dirs * 10} x {args.file_mb:g} MB in {seconds:.1f}s")
+        items = sorted(os.listdir(root))
+        for fmt in args.formats:
+            out_path = os.path.join(temp_dir, f"snapshot.{fmt}")
+            stats, seconds = timed(ftm.export_directory_archive, root, items, out_path, fmt, args.level, args.workers)
+            print(f"{fmt:>7}: {stats.files} files, {stats.bytes / (1 << 20):.0f} MB in {seconds:.1f}s "
+                  f"= {stats.bytes / (1 << 20) / seconds:.0f} MB/s, archive {os.path.getsize(out_path) / (1 << 20):.0f} MB")
+        if "zip" in args.formats:
+            out_path = os.path.join(temp_dir, "snapshot.zip")
+            if not args.root:
+                # Only a generated tree is touched; a --root tree is re-exported as it is.
+                changed = next(os.path.join(current, name) for current, _, names in os.walk(root) for name in sorted(names))
+                stat = os.stat(changed)
+                os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 10))
+            stats, seconds = timed(ftm.export_directory_archive, root, items, out_path, "zip", args.level, args.workers)
+            print(f" update: {stats.files} recompressed, {stats.reused} reused in {seconds:.1f}s")
+        print(f"peak RSS {peak_rss_mb():.0f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
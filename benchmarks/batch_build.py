@@ -0,0 +1,38 @@
+# Aggregate files/s of `batch` at several worker counts. The jobs cycle through
+# the built-in presets with a {{name}} variable each, like one skeleton per tenant.
+# Point --work-dir at a tmpfs (e.g. /dev/shm) to keep disk I/O out of the numbers.
+#
+#   python benchmarks/batch_build.py --jobs 3200 --workers 1 4 16 --work-dir /dev/shm
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from common import load_module
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time batch builds across process pools of several sizes.")
+    parser.add_argument("--jobs", type=int, default=3200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--work-dir", help="where the trees are built (default: a temp dir)")
+    parser.add_argument("--cached", action="store_true", help="clone from the skeleton cache")
+    args = parser.parse_args(argv)
+    ftm = load_module()
+    presets = sorted(ftm.PRESETS)
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as temp_dir:
+        options = {"cache_dir": os.path.join(temp_dir, "cache"), "hardlink": False} if args.cached else None
+        out_dir = os.path.join(temp_dir, "out")
+        jobs = [ftm.BatchJob(presets[i % len(presets)], os.path.join(out_dir, f"tenant{i:05d}"), {"name": f"tenant{i}"})
+                for i in range(args.jobs)]
+        for workers in args.workers:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            result = ftm.run_batch(jobs, workers, build_options=options)
+            print(f"workers {workers:>3}: {result.jobs - result.failed}/{result.jobs} jobs, {result.files} files, "
+                  f"{result.dirs} dirs in {result.seconds:.2f}s ({result.files / result.seconds:.0f} files/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# Shared helpers for the benchmark scripts in this directory. Each script builds
+# its own input under a temporary directory (or takes --root) and prints the
+# numbers quoted in the commit that introduced the optimization it measures.
+import importlib.util
+import os
+import sys
+import time
+
+MODULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src", "FileTreeManagerv1.2.py")
+
+
+def load_module():
+    # The module name has a dot in it, so it is loaded from its path.
+    spec = importlib.util.spec_from_file_location("FileTreeManager", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_tree(root, dirs, files_per_dir, file_size=0, fanout=10):
+    # `dirs` directories nested `fanout` to a level, each holding `files_per_dir`
+    # files of `file_size` pseudo-random bytes (so compression has work to do).
+    block = os.urandom(min(file_size, 1 << 20)) if file_size else b""
+    made = 0
+    queue = [root]
+    os.makedirs(root, exist_ok=True)
+    while queue and made < dirs:
+        parent = queue.pop(0)
+        for i in range(fanout):
+            if made == dirs:
+                break
+            path = os.path.join(parent, f"dir{i:02d}")
+            os.makedirs(path, exist_ok=True)
+            queue.append(path)
+            made += 1
+            for j in range(files_per_dir):
+                with open(os.path.join(path, f"file{j:04d}.dat"), "wb") as f:
+                    remaining = file_size
+                    while remaining:
+                        f.write(block[:remaining])
+                        remaining -= min(remaining, len(block))
+    return root
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
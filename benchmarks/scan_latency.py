@@ -0,0 +1,50 @@
+# Serial against concurrent scans on a simulated high-latency mount: every
+# listing and stat first sleeps for one round-trip.
+#
+#   python benchmarks/scan_latency.py --dirs 1000 --files 100 --latency-ms 2
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from common import load_module, make_tree, peak_rss_mb, timed
+
+
+def inject_latency(ftm, seconds):
+    def delayed(func):
+        def call(*args):
+            time.sleep(seconds)
+            return func(*args)
+        return call
+
+    ftm._list_children = delayed(ftm._list_children)
+    ftm._dir_identity = delayed(ftm._dir_identity)
+    ftm._stat_entry = delayed(ftm._stat_entry)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time serial and concurrent scans with simulated latency.")
+    parser.add_argument("--root", help="scan this directory instead of generating one")
+    parser.add_argument("--dirs", type=int, default=1000)
+    parser.add_argument("--files", type=int, default=100, help="files per directory")
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args(argv)
+    ftm = load_module()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = args.root or make_tree(os.path.join(temp_dir, "tree"), args.dirs, args.files)
+        inject_latency(ftm, args.latency_ms / 1000)
+        items = sorted(os.listdir(root))
+        serial = None
+        for concurrency in args.concurrency:
+            with open(os.devnull, "w", encoding="utf-8") as out:
+                lines, seconds = timed(ftm.write_tree_text, root, items, out, concurrency=concurrency)
+            serial = serial or seconds
+            print(f"concurrency {concurrency:>3}: {lines} lines in {seconds:.2f}s "
+                  f"({serial / seconds:.1f}x), peak RSS {peak_rss_mb():.0f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
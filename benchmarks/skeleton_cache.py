@@ -0,0 +1,100 @@
+# Plain builds against builds cloned from the skeleton cache, then the clone
+# methods one at a time on large files. Run it once per filesystem to compare
+# them (ext4, xfs, btrfs, tmpfs); every step is followed by a sync.
+#
+#   python benchmarks/skeleton_cache.py --work-dir /mnt/xfs --files 10000 --large 200
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from common import load_module, timed
+
+EXTENSIONS = (".py", ".md", ".json", ".sh", ".txt")
+
+
+def tree_text(files, per_dir):
+    lines = ["big/"]
+    dirs = -(-files // per_dir)
+    for d in range(dirs):
+        lines.append(f"{'└──' if d == dirs - 1 else '├──'} pkg{d}/")
+        count = min(per_dir, files - d * per_dir)
+        for i in range(count):
+            indent = "    " if d == dirs - 1 else "│   "
+            lines.append(f"{indent}{'└──' if i == count - 1 else '├──'} m{i}{EXTENSIONS[i % len(EXTENSIONS)]}")
+    return "\n".join(lines) + "\n"
+
+
+def synced(func, *args, **kwargs):
+    def run():
+        result = func(*args, **kwargs)
+        os.sync()
+        return result
+    return timed(run)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time cached and cloned builds on one filesystem.")
+    parser.add_argument("--work-dir", help="directory on the filesystem under test (default: a temp dir)")
+    parser.add_argument("--files", type=int, default=10000, help="template files in the built tree")
+    parser.add_argument("--per-dir", type=int, default=50)
+    parser.add_argument("--large", type=int, default=200, help="large files cloned one method at a time")
+    parser.add_argument("--large-mb", type=float, default=1.0)
+    args = parser.parse_args(argv)
+    ftm = load_module()
+    paths = ftm.parse_tree(tree_text(args.files, args.per_dir))
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as temp_dir:
+        cache_dir = os.path.join(temp_dir, "cache")
+        out_dir = os.path.join(temp_dir, "out")
+        builds = [
+            ("plain build", ftm.build_structure, {}),
+            ("--cached (cold)", ftm.build_structure_cached, {"cache_dir": cache_dir}),
+            ("--cached (warm)", ftm.build_structure_cached, {"cache_dir": cache_dir}),
+            ("--cached, new variables", ftm.build_structure_cached, {"cache_dir": cache_dir, "variables": {"name": "x"}}),
+            ("--cached --hardlink", ftm.build_structure_cached, {"cache_dir": cache_dir, "hardlink": True}),
+        ]
+        print(f"{args.files} template files under {temp_dir}")
+        for label, build, options in builds:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            os.sync()
+            used, seconds = synced(build, paths, out_dir, **options)
+            methods = ", ".join(f"{m} {n}" for m, n in sorted(used.items())) if used else ""
+            print(f"  {label:<26} {seconds:6.2f}s  {methods}".rstrip())
+        if not args.large:
+            return 0
+        size = int(args.large_mb * (1 << 20))
+        data = os.urandom(size)
+        src_dir = os.path.join(temp_dir, "large")
+        os.makedirs(src_dir)
+        sources = [os.path.join(src_dir, f"f{i}") for i in range(args.large)]
+        for path in sources:
+            with open(path, "wb") as f:
+                f.write(data)
+        os.sync()
+        print(f"{args.large} x {args.large_mb:g} MB files")
+
+        def write_all():
+            for i in range(args.large):
+                with open(os.path.join(out_dir, f"f{i}"), "wb") as f:
+                    f.write(data)
+
+        def clone_all(method):
+            methods = [method, "copy"]
+            for i, src in enumerate(sources):
+                ftm.clone_file(src, os.path.join(out_dir, f"f{i}"), methods)
+            return methods[0]
+
+        runs = [("plain write", write_all)] + [(m, lambda m=m: clone_all(m)) for m in ftm.CLONE_METHODS]
+        for label, run in runs:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            os.makedirs(out_dir)
+            os.sync()
+            used, seconds = synced(run)
+            fallback = f"  (fell back to {used})" if used and used != label else ""
+            print(f"  {label:<26} {seconds:6.3f}s{fallback}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
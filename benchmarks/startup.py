@@ -0,0 +1,57 @@
+# Startup cost in fresh interpreters: the time to import the module, the largest
+# imports it still makes (-X importtime), and, where a display is available, the
+# GUI's own time to first paint against STARTUP_BUDGET_MS.
+#
+#   python benchmarks/startup.py --runs 15
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from common import MODULE_PATH
+
+# The marker separates the interpreter's and this harness's own imports from the module's.
+MARKER = "-- module --"
+IMPORT_ONLY = ("import sys, time, importlib.util; "
+               "spec = importlib.util.spec_from_file_location('FileTreeManager', sys.argv[1]); "
+               f"print({MARKER!r}, file=sys.stderr, flush=True); start = time.perf_counter(); "
+               "spec.loader.exec_module(importlib.util.module_from_spec(spec)); "
+               "print((time.perf_counter() - start) * 1000)")
+DEFERRED = ("tkinter", "zipfile", "tarfile", "hashlib", "tempfile", "csv", "socket", "inspect", "argparse",
+            "concurrent.futures", "shutil", "lzma", "bz2", "zlib", "struct", "copy")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time module import and GUI startup.")
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--top", type=int, default=10, help="largest imports to list")
+    args = parser.parse_args(argv)
+    command = [sys.executable, "-c", IMPORT_ONLY, MODULE_PATH]
+    runs = [float(subprocess.run(command, capture_output=True, text=True, check=True).stdout) for _ in range(args.runs)]
+    print(f"module import: median {statistics.median(runs):.1f} ms, min {min(runs):.1f} ms ({args.runs} runs)")
+
+    report = subprocess.run([sys.executable, "-X", "importtime"] + command[1:], capture_output=True, text=True).stderr
+    imports = []
+    for line in report.partition(MARKER)[2].strip().splitlines():
+        _, cumulative, name = (field.strip() for field in line.split("|"))
+        imports.append((int(cumulative), name))
+    names = {name for _, name in imports}
+    print("largest imports made by the module (cumulative, -X importtime):")
+    for cumulative, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:7.1f} ms  {name}")
+    eager = [name for name in DEFERRED if name in names]
+    print(f"deferred modules imported eagerly: {', '.join(eager) or 'none'}")
+
+    if not os.environ.get("DISPLAY") and sys.platform.startswith("linux"):
+        print("no display: skipping time to first paint")
+        return 0
+    env = dict(os.environ, FILETREE_STARTUP_BENCHMARK="1")
+    for _ in range(min(args.runs, 5)):
+        result = subprocess.run([sys.executable, MODULE_PATH], env=env, capture_output=True, text=True)
+        print(f"  {result.stderr.strip()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,36 @@
-import tkinter as tk
-from tkinter import filedialog, messagebox, scrolledtext, ttk
+import time
+_STARTUP_BEGIN = time.perf_counter()
 import os
-import zipfile
-import tempfile
+import sys
+import json
+import heapq
+import bisect
+import fnmatch
+import itertools
+import re
+import errno
+import threading
+from array import array
+from collections import Counter, OrderedDict, deque, namedtuple
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+# Archive, compression, caching, server and process-pool modules are imported
+# where they are used so the GUI reaches its first paint sooner. tkinter is loaded by _import_tk,
+# so the command line, server and client never import it and run without Tk.
+tk = filedialog = messagebox = scrolledtext = ttk = tkfont = None
+_STARTUP_IMPORTED = time.perf_counter()
+
+
+def _import_tk():
+    global tk, filedialog, messagebox, scrolledtext, ttk, tkfont, _STARTUP_IMPORTED
+    if tk is None:
+        import tkinter as tk
+        from tkinter import filedialog, messagebox, scrolledtext, ttk
+        import tkinter.font as tkfont
+        _STARTUP_IMPORTED = time.perf_counter()
+STARTUP_BUDGET_MS = 250
 
 # --- File Templates ---
 TEMPLATES = {
@@ -203,389 +231,3920 @@ PRESETS = {
     └── conftest.py"""
 }
 
-class FileTreeManagerGUI:
-    def __init__(self, master):
-        self.master = master
-        master.title("FileTree Manager")
-        master.geometry("900x800")
-        master.resizable(True, True)
+# --- Tree Scanner ---
+TreeEntry = namedtuple("TreeEntry", "path rel name depth is_dir is_last size mtime blocks error")
+SCAN_FORMATS = ("json", "ndjson", "csv")
+SCAN_FIELDS = ("path", "type", "size", "mtime", "depth", "error")
+SYMLINK_POLICIES = ("once", "show", "never")
+TREE_WRITE_BUFFER = 1024 * 1024
+TREE_WRITE_BATCH = 4096
 
-        # Dark mode state
-        self.dark_mode = False
-        self.bg_light = "SystemButtonFace"
-        self.fg_light = "#000000"
-        self.bg_dark = "#2e2e2e"
-        self.fg_dark = "#ffffff"
 
-        # Configure grid weights
-        master.grid_rowconfigure(0, weight=0)  # Menu bar
-        master.grid_rowconfigure(1, weight=0)  # Input frame
-        master.grid_rowconfigure(2, weight=0)  # Listbox label
-        master.grid_rowconfigure(3, weight=1)  # Listbox
-        master.grid_rowconfigure(4, weight=0)  # Tabbed interface
-        master.grid_rowconfigure(5, weight=0)  # Output label
-        master.grid_rowconfigure(6, weight=1)  # Output area
-        master.grid_rowconfigure(7, weight=0)  # Status bar
-        master.grid_columnconfigure(0, weight=1)
-        master.grid_columnconfigure(1, weight=0)
+def _with_last(items):
+    last = len(items) - 1
+    return ((item, i == last) for i, item in enumerate(items))
 
-        # Menu bar
-        self.menu_bar = tk.Menu(master)
-        master.config(menu=self.menu_bar)
-        presets_menu = tk.Menu(self.menu_bar, tearoff=0)
-        self.menu_bar.add_cascade(label="Presets", menu=presets_menu)
-        for preset_name in PRESETS:
-            presets_menu.add_command(
-                label=preset_name,
-                command=lambda name=preset_name: self._load_preset(name)
-            )
-        self.menu_bar.add_command(label="Toggle Dark Mode", command=self._toggle_dark_mode)
-        self.menu_bar.add_command(label="Save Preset", command=self._save_preset)
-        self.menu_bar.add_command(label="Load Preset", command=self._load_preset_file)
 
-        # Input Frame (Directory Selection)
-        self.input_frame = tk.LabelFrame(master, text="Select Root Directory", padx=10, pady=10)
-        self.input_frame.grid(row=1, column=0, padx=10, pady=10, sticky="ew", columnspan=2)
-        self.input_frame.grid_columnconfigure(0, weight=1)
-        self.input_frame.grid_columnconfigure(1, weight=0)
+def _is_ignored(name, ignore):
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in ignore)
 
-        self.directory_label = tk.Label(self.input_frame, text="Selected Directory:")
-        self.directory_label.grid(row=0, column=0, sticky="w", pady=5)
-        self.directory_entry = tk.Entry(self.input_frame, width=70)
-        self.directory_entry.grid(row=1, column=0, sticky="ew", padx=5, pady=5)
-        self.directory_entry.insert(0, os.path.expanduser("~") if os.name == 'posix' else os.getcwd())
-        self.browse_button = tk.Button(self.input_frame, text="Browse", command=self._browse_directory)
-        self.browse_button.grid(row=1, column=1, sticky="e", padx=5, pady=5)
 
-        # Items to Include Listbox
-        self.include_label = tk.Label(master, text="Items to Include (Select multiple with Ctrl/Shift):")
-        self.include_label.grid(row=2, column=0, sticky="nw", padx=10, pady=(0, 5))
-        self.file_listbox = tk.Listbox(master, selectmode=tk.MULTIPLE, height=10)
-        self.file_listbox.grid(row=3, column=0, sticky="nsew", padx=10, pady=(0, 10))
-        self.listbox_scrollbar = tk.Scrollbar(master, command=self.file_listbox.yview)
-        self.listbox_scrollbar.grid(row=3, column=1, sticky="ns", pady=(0, 10))
-        self.file_listbox['yscrollcommand'] = self.listbox_scrollbar.set
+def _list_children(dir_path, ignore=None, symlinks="once"):
+    with os.scandir(dir_path) as it:
+        entries = [e for e in it if not _is_ignored(e.name, ignore)] if ignore else list(it)
+    if symlinks == "never":
+        entries = [e for e in entries if not e.is_symlink()]
+    child_dirs = sorted((e for e in entries if e.is_dir()), key=lambda e: e.name)
+    child_files = sorted((e for e in entries if e.is_file()), key=lambda e: e.name)
+    return [(e.path, e.name, True, e) for e in child_dirs] + [(e.path, e.name, False, e) for e in child_files]
 
-        # Tabbed Interface
-        self.notebook = ttk.Notebook(master)
-        self.notebook.grid(row=4, column=0, columnspan=2, padx=10, pady=10, sticky="nsew")
 
-        # Tree Generation Tab
-        self.tree_tab = tk.Frame(self.notebook)
-        self.notebook.add(self.tree_tab, text="Generate Tree")
-        self.generate_button = tk.Button(self.tree_tab, text="Generate Tree Diagram", command=self._generate_tree)
-        self.generate_button.pack(pady=10)
+def _dir_identity(path, dir_entry=None):
+    try:
+        st = dir_entry.stat() if dir_entry is not None else os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
 
-        # Tree Editing/Building Tab
-        self.build_tab = tk.Frame(self.notebook)
-        self.notebook.add(self.build_tab, text="Edit & Build Tree")
-        self.build_tab.grid_rowconfigure(0, weight=0)
-        self.build_tab.grid_rowconfigure(1, weight=1)
-        self.build_tab.grid_rowconfigure(2, weight=0)
-        self.build_tab.grid_rowconfigure(3, weight=1)
-        self.build_tab.grid_rowconfigure(4, weight=0)
-        self.build_tab.grid_columnconfigure(0, weight=1)
 
-        tk.Label(self.build_tab, text="Edit Directory Tree:").grid(row=0, column=0, sticky="w", padx=5, pady=5)
-        self.text_input = scrolledtext.ScrolledText(self.build_tab, width=80, height=15, undo=True)
-        self.text_input.grid(row=1, column=0, padx=10, pady=5, sticky="nsew")
-        self.text_input.tag_config("dir", foreground="blue", font=("TkDefaultFont", 9, "bold"))
-        self.text_input.tag_config("file", foreground="green")
-        self.text_input.bind("<KeyRelease>", lambda e: [self._update_preview(), self._highlight_tree_text()])
+def _real_roots(root_dir, selected_items):
+    # Resolved paths of the selected directories that are not links themselves.
+    roots = []
+    for name in selected_items:
+        path = os.path.join(root_dir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            roots.append(os.path.realpath(path))
+    return roots
 
-        tk.Label(self.build_tab, text="Live Preview:").grid(row=2, column=0, sticky="w", padx=5, pady=5)
-        self.preview = scrolledtext.ScrolledText(self.build_tab, width=80, height=10, state="normal")
-        self.preview.grid(row=3, column=0, padx=10, pady=5, sticky="nsew")
 
-        self.btn_frame = tk.Frame(self.build_tab)
-        self.btn_frame.grid(row=4, column=0, pady=10)
-        tk.Button(self.btn_frame, text="Build Structure", command=self._build_structure).grid(row=0, column=0, padx=5)
-        tk.Button(self.btn_frame, text="Export Tree as Zip", command=self._export_zip).grid(row=0, column=1, padx=5)
-        tk.Button(self.btn_frame, text="Copy Tree", command=self._copy_tree).grid(row=0, column=2, padx=5)
-        tk.Button(self.btn_frame, text="Undo", command=self.text_input.edit_undo).grid(row=0, column=3, padx=5)
-        tk.Button(self.btn_frame, text="Redo", command=self.text_input.edit_redo).grid(row=0, column=4, padx=5)
+def _listed_in_place(path, real_roots, ignore=None):
+    # True when a linked directory resolves into one of the real roots, below no
+    # ignored name, so the walk will list it under its own path.
+    target = os.path.realpath(path)
+    for root in real_roots:
+        if target == root or target.startswith(root.rstrip(os.sep) + os.sep):
+            rel = os.path.relpath(target, root)
+            parts = [] if rel == os.curdir else rel.split(os.sep)
+            return not (ignore and any(_is_ignored(part, ignore) for part in parts))
+    return False
 
-        # Output Area
-        self.output_label = tk.Label(master, text="Output Log:")
-        self.output_label.grid(row=5, column=0, sticky="nw", padx=10, pady=(10, 0))
-        self.output_text = scrolledtext.ScrolledText(master, wrap=tk.WORD, height=15, width=100)
-        self.output_text.grid(row=6, column=0, sticky="nsew", padx=10, pady=(5, 10), columnspan=2)
-        self.output_scrollbar = tk.Scrollbar(master, command=self.output_text.yview)
-        self.output_scrollbar.grid(row=6, column=2, sticky="ns", pady=(5, 10))
-        self.output_text['yscrollcommand'] = self.output_scrollbar.set
 
-        # Status Bar
-        self.status_var = tk.StringVar(value="Ready")
-        self.status_bar = tk.Label(master, textvariable=self.status_var, bd=1, relief=tk.SUNKEN, anchor="w")
-        self.status_bar.grid(row=7, column=0, columnspan=3, sticky="ew", padx=10, pady=5)
+def _stat_entry(path, dir_entry=None):
+    try:
+        st = dir_entry.stat() if dir_entry is not None else os.stat(path)
+    except OSError:
+        return None, None, None
+    return st.st_size, st.st_mtime, getattr(st, "st_blocks", None)
 
-        # Configure output text tags
-        self.output_text.tag_config("dir", foreground="blue", font=("TkDefaultFont", 9, "bold"))
-        self.output_text.tag_config("file", foreground="green")
-        self.output_text.tag_config("error", foreground="red", font=("TkDefaultFont", 9, "bold"))
-        self.output_text.tag_config("info", foreground="gray")
 
-        self._log_message("Welcome to FileTree Manager. Select a directory to load its contents.\n", "info")
+def scan_tree(root_dir, selected_items, with_stat=False, ignore=None, max_depth=None,
+              symlinks="once", one_file_system=False, profiler=None):
+    # Walks the selected top-level items of root_dir depth-first, directories before
+    # files, yielding one TreeEntry per line of the rendered tree. Memory is bounded
+    # by the open directory listings, not by the size of the tree. Names matching an
+    # ignore pattern are skipped; max_depth limits how many levels are shown.
+    #
+    # Every expanded directory is recorded by (st_dev, st_ino), so symlink cycles and
+    # bind-mount loops are listed once and then cut. A link to a directory that the
+    # walk also reaches by its real path is never expanded, so the contents appear
+    # under the real path. symlinks="show" lists links without descending into them,
+    # "never" leaves them out entirely.
+    #
+    # A ScanProfiler swaps in timed versions of the listing and stat helpers; without
+    # one the walk runs the plain helpers with no per-entry checks.
+    if symlinks not in SYMLINK_POLICIES:
+        raise ValueError(f"Unknown symlink policy: {symlinks}")
+    if ignore:
+        selected_items = [name for name in selected_items if not _is_ignored(name, ignore)]
+    if symlinks == "never":
+        selected_items = [name for name in selected_items if not os.path.islink(os.path.join(root_dir, name))]
+    list_children, stat_entry, dir_identity = _list_children, _stat_entry, _dir_identity
+    if profiler is not None:
+        profiler.start(root_dir)
+        list_children, stat_entry, dir_identity = profiler.list_children, profiler.stat_entry, profiler.dir_identity
+    root_identity = _dir_identity(root_dir)
+    visited = {root_identity}
+    real_roots = _real_roots(root_dir, selected_items) if symlinks == "once" else ()
+    selected = sorted(selected_items, key=lambda x: (not os.path.isdir(os.path.join(root_dir, x)), x.lower()))
+    top = [(os.path.join(root_dir, name), name, os.path.isdir(os.path.join(root_dir, name)), None)
+           for name in selected]
+    stack = [(_with_last(top), "")]
+    while stack:
+        children, parent_rel = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            continue
+        (path, name, is_dir, dir_entry), is_last = child
+        depth = len(stack) - 1
+        rel = f"{parent_rel}/{name}" if parent_rel else name
+        size = mtime = blocks = None
+        if with_stat:
+            size, mtime, blocks = stat_entry(path, dir_entry)
+        yield TreeEntry(path, rel, name, depth, is_dir, is_last, size, mtime, blocks, None)
+        if not is_dir or (max_depth is not None and depth + 1 >= max_depth):
+            continue
+        if symlinks != "never" and (dir_entry.is_symlink() if dir_entry is not None else os.path.islink(path)):
+            if symlinks == "show":
+                continue
+            if _listed_in_place(path, real_roots, ignore):
+                yield TreeEntry(path, rel, name, depth, True, is_last, None, None, None, "Already listed")
+                continue
+        identity = dir_identity(path, dir_entry)
+        if identity is not None:
+            if identity in visited:
+                yield TreeEntry(path, rel, name, depth, True, is_last, None, None, None, "Already listed")
+                continue
+            if one_file_system and root_identity is not None and identity[0] != root_identity[0]:
+                yield TreeEntry(path, rel, name, depth, True, is_last, None, None, None, "Other file system")
+                continue
+            visited.add(identity)
+        try:
+            listing = list_children(path, ignore, symlinks)
+        except PermissionError:
+            yield TreeEntry(path, rel, name, depth, True, is_last, None, None, None, "Permission Denied")
+            continue
+        except Exception as e:
+            yield TreeEntry(path, rel, name, depth, True, is_last, None, None, None, f"Error: {e}")
+            continue
+        stack.append((_with_last(listing), rel))
 
-    def _log_message(self, message, tag="normal"):
-        self.output_text.insert(tk.END, message, tag)
-        self.output_text.see(tk.END)
 
-    def _toggle_dark_mode(self):
-        self.dark_mode = not self.dark_mode
-        bg = self.bg_dark if self.dark_mode else self.bg_light
-        fg = self.fg_dark if self.dark_mode else self.fg_light
-        self.master.configure(bg=bg)
-        for widget in [self.input_frame, self.directory_label, self.directory_entry, self.browse_button,
-                       self.include_label, self.file_listbox, self.output_label, self.output_text,
-                       self.generate_button, self.tree_tab, self.build_tab, self.btn_frame, self.preview,
-                       self.status_bar]:
-            try:
-                widget.configure(bg=bg, fg=fg, insertbackground=fg)
-            except:
-                pass
-        self.text_input.configure(bg=bg, fg=fg, insertbackground=fg)
-        self.notebook.configure(style="TNotebook")
-        self.status_var.set("Dark mode " + ("enabled" if self.dark_mode else "disabled"))
+def iter_tree_lines(entries, annotate=None):
+    prefixes = [""]
+    for entry in entries:
+        del prefixes[entry.depth + 1:]
+        indent_str = prefixes[entry.depth] + ("└── " if entry.is_last else "├── ")
+        if entry.error:
+            yield f"{indent_str}    <{entry.error}>"
+            continue
+        suffix = annotate(entry) if annotate else ""
+        if entry.is_dir:
+            yield f"{indent_str}{entry.name}/{suffix}"
+            prefixes.append(prefixes[entry.depth] + ("    " if entry.is_last else "│   "))
+        else:
+            yield f"{indent_str}{entry.name}{suffix}"
 
-    def _highlight_tree_text(self):
-        self.text_input.tag_remove("dir", "1.0", tk.END)
-        self.text_input.tag_remove("file", "1.0", tk.END)
-        lines = self.text_input.get("1.0", tk.END).splitlines()
-        for i, line in enumerate(lines, 1):
-            clean = line.lstrip("│├└─ ")
-            if clean.endswith("/"):
-                self.text_input.tag_add("dir", f"{i}.0", f"{i}.end")
-            elif clean.strip():
-                self.text_input.tag_add("file", f"{i}.0", f"{i}.end")
-        self.status_var.set(f"Highlighted {len(lines)} lines in tree")
 
-    def _copy_tree(self):
-        tree_text = self.text_input.get("1.0", tk.END).strip()
-        self.master.clipboard_clear()
-        self.master.clipboard_append(tree_text)
-        self._log_message("Tree copied to clipboard.\n", "info")
-        self.status_var.set("Tree copied to clipboard")
+def write_tree_text(root_dir, selected_items, fp, **scan_options):
+    # Writes the diagram as the walk produces it, TREE_WRITE_BATCH lines per
+    # write, so memory stays flat however large the tree is. Returns the line count.
+    fp.write(f"{os.path.basename(root_dir)}/\n")
+    count = 1
+    batch = []
+    for line in iter_tree_lines(scan_entries(root_dir, selected_items, **scan_options)):
+        batch.append(line)
+        if len(batch) == TREE_WRITE_BATCH:
+            count += len(batch)
+            batch.append("")
+            fp.write("\n".join(batch))
+            batch.clear()
+    if batch:
+        count += len(batch)
+        batch.append("")
+        fp.write("\n".join(batch))
+    return count
 
-    def _browse_directory(self):
-        initial_dir = self.directory_entry.get() if os.path.isdir(self.directory_entry.get()) else os.getcwd()
-        selected_directory = filedialog.askdirectory(parent=self.master, initialdir=initial_dir, title="Select Directory")
-        if selected_directory:
-            self.directory_entry.delete(0, tk.END)
-            self.directory_entry.insert(0, selected_directory)
-            self._log_message(f"Selected root: {selected_directory}\n", "info")
-            self._populate_listbox(selected_directory)
-        else:
-            self._log_message("Directory selection cancelled.\n", "info")
-            self.status_var.set("Directory selection cancelled")
 
-    def _populate_listbox(self, directory_path):
-        self.file_listbox.delete(0, tk.END)
-        try:
-            items = sorted(os.listdir(directory_path))
-            for item in items:
-                full_path = os.path.join(directory_path, item)
-                self.file_listbox.insert(tk.END, f"{item}/" if os.path.isdir(full_path) else item)
-            for i in range(self.file_listbox.size()):
-                self.file_listbox.selection_set(i)
-            self._log_message(f"Loaded {len(items)} items from '{os.path.basename(directory_path)}'.\n", "info")
-            self.status_var.set(f"Loaded {len(items)} items")
-        except PermissionError:
-            self._log_message(f"ERROR: Permission denied to access '{directory_path}'.\n", "error")
-            messagebox.showerror("Permission Error", f"Permission denied to access '{directory_path}'.")
-            self.status_var.set("Permission error")
-        except Exception as e:
-            self._log_message(f"ERROR: Failed to load directory contents: {e}\n", "error")
-            messagebox.showerror("Error", f"Failed to load directory contents: {e}")
-            self.status_var.set("Error loading directory")
+def _entry_record(entry):
+    if entry.error:
+        return {"path": entry.rel, "type": "error", "size": None, "mtime": None,
+                "depth": entry.depth, "error": entry.error}
+    return {"path": entry.rel, "type": "dir" if entry.is_dir else "file", "size": entry.size,
+            "mtime": entry.mtime, "depth": entry.depth}
 
-    def _generate_tree(self):
-        self.output_text.delete(1.0, tk.END)
-        directory_path = self.directory_entry.get().strip()
-        if not directory_path or not os.path.isdir(directory_path):
-            messagebox.showerror("Error", "Please select a valid root directory.")
-            self._log_message(f"ERROR: Invalid root directory: {directory_path}\n", "error")
-            self.status_var.set("Invalid directory")
-            return
-        selected_indices = self.file_listbox.curselection()
-        selected_items = [self.file_listbox.get(i).strip('/') for i in selected_indices] if selected_indices else []
-        if not selected_items:
-            messagebox.showwarning("Warning", "No items selected. The tree will be empty except for the root.")
-            self._log_message("WARNING: No items selected for tree generation.\n", "info")
-            self.status_var.set("No items selected")
-        self._log_message(f"Generating tree for selected items in: {directory_path}\n", "info")
-        tree_string = self._build_filtered_tree_string(directory_path, selected_items)
-        self.output_text.insert(tk.END, tree_string)
-        self.text_input.delete(1.0, tk.END)
-        self.text_input.insert(tk.END, tree_string)
-        self._update_preview()
-        self._highlight_tree_text()
-        self._log_message("\nTree generation complete.\n", "info")
-        self.status_var.set("Tree generated")
 
-    def _build_filtered_tree_string(self, root_dir, selected_top_level_items):
-        tree_lines = [f"{os.path.basename(root_dir)}/"]
-        sorted_selected_items = sorted(selected_top_level_items, 
-                                      key=lambda x: (not os.path.isdir(os.path.join(root_dir, x)), x.lower()))
-        for i, item_name in enumerate(sorted_selected_items):
-            full_item_path = os.path.join(root_dir, item_name)
-            is_last_item = (i == len(sorted_selected_items) - 1)
-            self._recursive_add_to_tree(tree_lines, full_item_path, 0, [], is_last_item)
-        return "\n".join(tree_lines)
-
-    def _recursive_add_to_tree(self, tree_lines, current_path, level, parent_vertical_lines, is_last_sibling):
-        indent_parts = ["    " if is_parent_last else "│   " for is_parent_last in parent_vertical_lines]
-        current_prefix = '└── ' if is_last_sibling else '├── '
-        indent_str = "".join(indent_parts) + current_prefix
-        item_name = os.path.basename(current_path)
-        if os.path.isdir(current_path):
-            tree_lines.append(f"{indent_str}{item_name}/")
-            new_parent_vertical_lines = list(parent_vertical_lines)
-            new_parent_vertical_lines.append(is_last_sibling)
-            try:
-                children = sorted(os.listdir(current_path))
-                child_dirs = sorted([d for d in children if os.path.isdir(os.path.join(current_path, d))])
-                child_files = sorted([f for f in children if os.path.isfile(os.path.join(current_path, f))])
-                all_children_sorted = child_dirs + child_files
-                for i, child_name in enumerate(all_children_sorted):
-                    child_path = os.path.join(current_path, child_name)
-                    is_last_child_sibling = (i == len(all_children_sorted) - 1)
-                    self._recursive_add_to_tree(tree_lines, child_path, level + 1, new_parent_vertical_lines, is_last_child_sibling)
-            except PermissionError:
-                tree_lines.append(f"{indent_str}    <Permission Denied>")
-            except Exception as e:
-                tree_lines.append(f"{indent_str}    <Error: {e}>")
+def _write_nested_json(root_dir, entries, fp):
+    # Nested JSON is written incrementally: only the chain of open directories is
+    # kept, closing brackets are emitted as the walk climbs back up.
+    root_name = os.path.basename(os.path.abspath(root_dir))
+    fp.write(json.dumps({"path": "", "name": root_name, "type": "dir", "depth": -1})[:-1] + ', "children": [')
+    need_comma = [False]
+    count = 0
+    for entry in entries:
+        level = entry.depth + 1 if entry.error else entry.depth
+        while len(need_comma) > level + 1:
+            need_comma.pop()
+            fp.write("]}")
+        if need_comma[-1]:
+            fp.write(", ")
+        need_comma[-1] = True
+        record = _entry_record(entry)
+        if entry.is_dir and not entry.error:
+            fp.write(json.dumps(record)[:-1] + ', "children": [')
+            need_comma.append(False)
         else:
-            tree_lines.append(f"{indent_str}{item_name}")
+            fp.write(json.dumps(record))
+        count += 1
+    fp.write("]}" * len(need_comma) + "\n")
+    return count
 
-    def _parse_tree(self, tree_text):
-        lines = tree_text.strip().splitlines()
-        path_stack = []
-        paths = []
-        for line in lines:
-            clean = line.lstrip("│├└─ ")
-            indent = len(line) - len(clean)
-            level = indent // 4
-            while len(path_stack) > level:
-                path_stack.pop()
-            is_dir = clean.endswith("/")
-            name = clean.rstrip("/") if is_dir else clean
-            path_stack.append(name)
-            full_path = os.path.join(*path_stack)
-            paths.append((full_path, is_dir))
-        return paths
 
-    def _update_preview(self, event=None):
-        try:
-            paths = self._parse_tree(self.text_input.get("1.0", tk.END))
-            self.preview.delete("1.0", tk.END)
-            for path, is_dir in paths:
-                tag = "[DIR]" if is_dir else "[FILE]"
-                self.preview.insert(tk.END, f"{tag} {path}\n")
-            self.status_var.set(f"Preview updated with {len(paths)} items")
-        except:
-            self.preview.delete("1.0", tk.END)
-            self.preview.insert(tk.END, "⚠️ Invalid tree format")
-            self.status_var.set("Invalid tree format")
+def write_scan(root_dir, selected_items, fp, fmt, **scan_options):
+    import csv
+    entries = scan_entries(root_dir, selected_items, with_stat=True, **scan_options)
+    if fmt == "json":
+        return _write_nested_json(root_dir, entries, fp)
+    count = 0
+    if fmt == "ndjson":
+        for entry in entries:
+            fp.write(json.dumps(_entry_record(entry)) + "\n")
+            count += 1
+    elif fmt == "csv":
+        writer = csv.DictWriter(fp, fieldnames=SCAN_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for entry in entries:
+            writer.writerow(_entry_record(entry))
+            count += 1
+    else:
+        raise ValueError(f"Unknown scan format: {fmt}")
+    return count
 
-    def _build_structure(self):
-        tree_text = self.text_input.get("1.0", tk.END)
-        if not tree_text.strip():
-            messagebox.showwarning("Input Needed", "Please paste or generate a directory tree.")
-            self.status_var.set("No tree input")
-            return
-        dest_dir = filedialog.askdirectory(title="Choose Destination Folder")
-        if not dest_dir:
-            self.status_var.set("Build cancelled")
-            return
+
+# --- Scan Profiler ---
+class ScanProfiler:
+    # Per-directory timings for scan_tree(profiler=...): how long listing took,
+    # how many entries it returned, and the time spent on stat calls for entries
+    # inside it. Aimed at finding slow directories on network filesystems.
+    def __init__(self):
+        self.root = None
+        self.dirs = {}
+        self.seconds = 0.0
+        self._started = None
+
+    def start(self, root_dir):
+        self.root = os.path.abspath(root_dir)
+        self._started = time.perf_counter()
+
+    def _record(self, dir_path):
+        record = self.dirs.get(dir_path)
+        if record is None:
+            # [listing seconds, entries, stat seconds, stat calls]
+            record = self.dirs[dir_path] = [0.0, 0, 0.0, 0]
+        return record
+
+    def list_children(self, dir_path, ignore=None, symlinks="once"):
+        start = time.perf_counter()
+        listing = []
         try:
-            paths = self._parse_tree(tree_text)
-            for path, is_dir in paths:
-                full_path = os.path.join(dest_dir, path)
-                if is_dir:
-                    os.makedirs(full_path, exist_ok=True)
-                else:
-                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
-                    ext = os.path.splitext(full_path)[1]
-                    content = TEMPLATES.get(ext, "")
-                    with open(full_path, "w", encoding="utf-8") as f:
-                        f.write(content)
-            messagebox.showinfo("🎉 Success", "Structure created successfully!")
-            self._log_message("Structure created successfully.\n", "info")
-            self.status_var.set("Structure built successfully")
-        except Exception as e:
-            self._log_message(f"ERROR: Failed to build structure: {e}\n", "error")
-            messagebox.showerror("Error", str(e))
-            self.status_var.set("Build error")
+            listing = _list_children(dir_path, ignore, symlinks)
+            return listing
+        finally:
+            record = self._record(dir_path)
+            record[0] += time.perf_counter() - start
+            record[1] += len(listing)
+            self.seconds = time.perf_counter() - self._started
 
-    def _export_zip(self):
-        tree_text = self.text_input.get("1.0", tk.END)
-        if not tree_text.strip():
-            messagebox.showwarning("Input Needed", "Please paste or generate a directory tree.")
-            self.status_var.set("No tree input")
-            return
-        zip_path = filedialog.asksaveasfilename(defaultextension=".zip")
-        if not zip_path:
-            self.status_var.set("Export cancelled")
-            return
+    def _timed_stat(self, func, path, dir_entry):
+        start = time.perf_counter()
         try:
-            with tempfile.TemporaryDirectory() as temp_dir:
-                paths = self._parse_tree(tree_text)
-                for path, is_dir in paths:
-                    full_path = os.path.join(temp_dir, path)
-                    if is_dir:
-                        os.makedirs(full_path, exist_ok=True)
-                    else:
-                        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-                        ext = os.path.splitext(full_path)[1]
-                        content = TEMPLATES.get(ext, "")
-                        with open(full_path, "w", encoding="utf-8") as f:
-                            f.write(content)
-                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for root_dir, _, files in os.walk(temp_dir):
-                        for file in files:
-                            file_path = os.path.join(root_dir, file)
-                            arcname = os.path.relpath(file_path, start=temp_dir)
-                            zipf.write(file_path, arcname)
-            messagebox.showinfo("📦 Exported", f"Tree structure zipped to:\n{zip_path}")
-            self._log_message(f"Tree structure zipped to: {zip_path}\n", "info")
-            self.status_var.set("Tree exported as zip")
-        except Exception as e:
-            self._log_message(f"ERROR: Failed to export zip: {e}\n", "error")
-            messagebox.showerror("Error", str(e))
-            self.status_var.set("Export error")
+            return func(path, dir_entry)
+        finally:
+            record = self._record(os.path.dirname(path))
+            record[2] += time.perf_counter() - start
+            record[3] += 1
 
-    def _save_preset(self):
-        content = self.text_input.get("1.0", tk.END)
-        file = filedialog.asksaveasfilename(defaultextension=".tree")
-        if file:
-            with open(file, "w", encoding="utf-8") as f:
-                f.write(content)
-            self._log_message(f"Preset saved to: {file}\n", "info")
-            self.status_var.set("Preset saved")
+    def stat_entry(self, path, dir_entry=None):
+        return self._timed_stat(_stat_entry, path, dir_entry)
 
-    def _load_preset_file(self):
-        file = filedialog.askopenfilename(filetypes=[("Tree Files", "*.tree")])
-        if file:
-            with open(file, "r", encoding="utf-8") as f:
-                self.text_input.delete("1.0", tk.END)
-                self.text_input.insert(tk.END, f.read())
-            self._update_preview()
-            self._highlight_tree_text()
-            self._log_message(f"Preset loaded from: {file}\n", "info")
-            self.status_var.set("Preset loaded")
+    def dir_identity(self, path, dir_entry=None):
+        return self._timed_stat(_dir_identity, path, dir_entry)
 
-    def _load_preset(self, preset_name):
-        tree_text = PRESETS.get(preset_name, "")
-        if tree_text:
-            self.text_input.delete("1.0", tk.END)
-            self.text_input.insert(tk.END, tree_text)
-            self._update_preview()
-            self._highlight_tree_text()
-            self._log_message(f"Loaded preset: {preset_name}\n", "info")
-            self.status_var.set(f"Loaded preset: {preset_name}")
+    def _rel(self, dir_path):
+        rel = os.path.relpath(dir_path, self.root) if self.root else dir_path
+        return "." if rel == os.curdir else rel.replace(os.sep, "/")
+
+    def slowest(self, count=20):
+        # (total seconds, listing seconds, stat seconds, entries, relative path), slowest first.
+        return heapq.nlargest(count, ((r[0] + r[2], r[0], r[2], r[1], self._rel(path))
+                                      for path, r in self.dirs.items()))
+
+    def format_report(self, count=20):
+        listed = sum(r[0] for r in self.dirs.values())
+        stats = sum(r[2] for r in self.dirs.values())
+        report = [f"Slowest {count} of {len(self.dirs)} directories "
+                  f"(listing {listed * 1000:.1f} ms, stat {stats * 1000:.1f} ms, walk {self.seconds * 1000:.1f} ms):",
+                  f"{'total ms':>10} {'list ms':>10} {'stat ms':>10} {'entries':>8}  path"]
+        for total, listing, stat, entries, rel in self.slowest(count):
+            report.append(f"{total * 1000:>10.2f} {listing * 1000:>10.2f} {stat * 1000:>10.2f} {entries:>8}  {rel}")
+        return "\n".join(report)
+
+    def write_collapsed(self, fp):
+        # One "root;dir;subdir microseconds" line per directory, using its own
+        # listing and stat time; flame graph tools add children into parents.
+        root_name = os.path.basename(self.root) if self.root else "."
+        for path, record in sorted(self.dirs.items()):
+            rel = self._rel(path)
+            frames = [root_name] if rel == "." else [root_name] + rel.split("/")
+            micros = round((record[0] + record[2]) * 1e6)
+            if micros:
+                fp.write(";".join(frame.replace(";", "_") for frame in frames) + f" {micros}\n")
+
+
+# --- Async Scanner ---
+ASYNC_SCAN_CONCURRENCY = 16
+ASYNC_SCAN_LOOKAHEAD = 4
+ASYNC_SCAN_HELD_ENTRIES = 32768
+
+
+def _scan_dir_job(path, dir_entry, ignore, symlinks, with_stat):
+    # Everything a walk needs from one directory, fetched on a worker thread so a
+    # slow mount pays its round-trips in parallel: identity, listing, child stats.
+    identity = _dir_identity(path, dir_entry)
+    try:
+        listing = _list_children(path, ignore, symlinks)
+    except Exception as e:
+        return identity, e, None
+    stats = [_stat_entry(child[0], child[3]) for child in listing] if with_stat else None
+    return identity, listing, stats
+
+
+async def scan_tree_batches(root_dir, selected_items, with_stat=False, ignore=None, max_depth=None,
+                            symlinks="once", one_file_system=False, concurrency=ASYNC_SCAN_CONCURRENCY):
+    # Same entries in the same order as scan_tree, but the listings of directories
+    # the walk is about to reach are fetched ahead on a pool of `concurrency`
+    # threads, nearest first. At most ASYNC_SCAN_LOOKAHEAD * concurrency listings
+    # run at once, and no more start while finished ones hold
+    # ASYNC_SCAN_HELD_ENTRIES children the walk has not reached, so memory stays
+    # bounded as in scan_tree. Entries come in lists, one per stretch of the walk
+    # that did not have to wait.
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    if symlinks not in SYMLINK_POLICIES:
+        raise ValueError(f"Unknown symlink policy: {symlinks}")
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    if ignore:
+        selected_items = [name for name in selected_items if not _is_ignored(name, ignore)]
+    if symlinks == "never":
+        selected_items = [name for name in selected_items if not os.path.islink(os.path.join(root_dir, name))]
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="scan")
+    window = ASYNC_SCAN_LOOKAHEAD * concurrency
+    # Slots are [job, path, dir_entry, held]: job is None until started and False
+    # once the walk is done with the directory; held counts the children of a
+    # finished listing until the walk takes them.
+    waiting = deque()
+    running = held = 0
+
+    def finished(slot, job):
+        nonlocal running, held
+        running -= 1
+        if slot[0] is not False and not job.cancelled():
+            listing = job.result()[1]
+            slot[3] = len(listing) if isinstance(listing, list) else 0
+            held += slot[3]
+        fill()
+
+    def start(slot):
+        nonlocal running
+        slot[0] = loop.run_in_executor(pool, _scan_dir_job, slot[1], slot[2], ignore, symlinks, with_stat)
+        slot[0].add_done_callback(lambda job: finished(slot, job))
+        running += 1
+
+    def fill():
+        while running < window and held < ASYNC_SCAN_HELD_ENTRIES and waiting:
+            slot = waiting.popleft()
+            if slot[0] is None:
+                start(slot)
+
+    def prefetch(children, depth):
+        # One slot per child directory the walk will try to expand. The newest
+        # listing's children are the next to be walked, so they go first.
+        if max_depth is not None and depth + 1 >= max_depth:
+            return [None] * len(children)
+        slots = [[None, path, dir_entry, 0]
+                 if is_dir and not (symlinks == "show" and (dir_entry.is_symlink() if dir_entry is not None
+                                                            else os.path.islink(path))) else None
+                 for path, name, is_dir, dir_entry in children]
+        waiting.extendleft(reversed([slot for slot in slots if slot is not None]))
+        fill()
+        return slots
+
+    try:
+        root_identity = await loop.run_in_executor(pool, _dir_identity, root_dir)
+        visited = {root_identity}
+        real_roots = _real_roots(root_dir, selected_items) if symlinks == "once" else ()
+        selected = sorted(selected_items, key=lambda x: (not os.path.isdir(os.path.join(root_dir, x)), x.lower()))
+        top = [(os.path.join(root_dir, name), name, os.path.isdir(os.path.join(root_dir, name)), None)
+               for name in selected]
+        top_stats = [None] * len(top)
+        if with_stat:
+            top_stats = await asyncio.gather(*(loop.run_in_executor(pool, _stat_entry, child[0]) for child in top))
+        stack = [(_with_last(list(zip(top, top_stats, prefetch(top, 0)))), "")]
+        batch = []
+        while stack:
+            children, parent_rel = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                continue
+            ((path, name, is_dir, dir_entry), stat, slot), is_last = child
+            depth = len(stack) - 1
+            rel = f"{parent_rel}/{name}" if parent_rel else name
+            size, mtime, blocks = stat if with_stat else (None, None, None)
+            batch.append(TreeEntry(path, rel, name, depth, is_dir, is_last, size, mtime, blocks, None))
+            if slot is None:
+                continue
+            job = slot[0]
+            if real_roots and ((dir_entry.is_symlink() if dir_entry is not None else os.path.islink(path))
+                               and _listed_in_place(path, real_roots, ignore)):
+                slot[0] = False
+                held -= slot[3]
+                if job is not None:
+                    job.cancel()
+                batch.append(TreeEntry(path, rel, name, depth, True, is_last, None, None, None, "Already listed"))
+                continue
+            if job is None:
+                start(slot)
+                job = slot[0]
+            if not job.done():
+                yield batch
+                batch = []
+            identity, listing, stats = await job
+            slot[0] = False
+            held -= slot[3]
+            fill()
+            if identity is not None:
+                if identity in visited:
+                    batch.append(TreeEntry(path, rel, name, depth, True, is_last, None, None, None, "Already listed"))
+                    continue
+                if one_file_system and root_identity is not None and identity[0] != root_identity[0]:
+                    batch.append(TreeEntry(path, rel, name, depth, True, is_last, None, None, None,
+                                           "Other file system"))
+                    continue
+                visited.add(identity)
+            if isinstance(listing, PermissionError):
+                batch.append(TreeEntry(path, rel, name, depth, True, is_last, None, None, None, "Permission Denied"))
+                continue
+            if isinstance(listing, Exception):
+                batch.append(TreeEntry(path, rel, name, depth, True, is_last, None, None, None, f"Error: {listing}"))
+                continue
+            stack.append((_with_last(list(zip(listing, stats or [None] * len(listing), prefetch(listing, depth + 1)))),
+                          rel))
+        if batch:
+            yield batch
+    finally:
+        # Stopping early drops listings that have not started yet.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_scan_concurrent(root_dir, selected_items, with_stat=False, **scan_options):
+    # scan_tree_batches for synchronous callers, driven on a private event loop.
+    import asyncio
+    loop = asyncio.new_event_loop()
+    batches = scan_tree_batches(root_dir, selected_items, with_stat, **scan_options)
+    try:
+        while True:
+            try:
+                yield from loop.run_until_complete(batches.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(batches.aclose())
+        loop.close()
+
+
+class AsyncLoopThread:
+    # An asyncio event loop on a daemon thread, started on first use. Tk cannot run
+    # a coroutine on its own mainloop, so the GUI submits it here and polls the
+    # returned concurrent.futures.Future with after().
+    def __init__(self):
+        self.loop = None
+
+    def submit(self, coro):
+        import asyncio
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self.loop.run_forever, name="asyncio", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+# --- Size Rollups ---
+class SizeNode:
+    # A cut-off message such as "Permission Denied" goes in note. error stays None,
+    # so iter_tree_lines renders the node's own line and then the note beneath it.
+    __slots__ = ("name", "rel", "depth", "is_dir", "is_last", "note", "bytes", "disk", "files", "dirs", "children")
+    error = None
+
+    def __init__(self, name, rel, depth, is_dir, is_last=True):
+        self.name = name
+        self.rel = rel
+        self.depth = depth
+        self.is_dir = is_dir
+        self.is_last = is_last
+        self.note = None
+        self.bytes = 0
+        self.disk = 0
+        self.files = 0 if is_dir else 1
+        self.dirs = 0
+        self.children = [] if is_dir else None
+
+
+def _close_size_node(parent, node):
+    parent.bytes += node.bytes
+    parent.disk += node.disk
+    parent.files += node.files
+    parent.dirs += node.dirs + node.is_dir
+
+
+def rollup_sizes(root_dir, entries):
+    # Folds a with_stat scan into per-directory totals bottom-up: a directory is
+    # added to its parent when the walk leaves it, so no second pass is needed.
+    root = SizeNode(os.path.basename(os.path.abspath(root_dir)), "", -1, True)
+    stack = [root]
+    for entry in entries:
+        if entry.error:
+            stack[-1].note = entry.error
+            continue
+        while len(stack) > entry.depth + 1:
+            node = stack.pop()
+            _close_size_node(stack[-1], node)
+        node = SizeNode(entry.name, entry.rel, entry.depth, entry.is_dir, entry.is_last)
+        node.disk = entry.blocks * 512 if entry.blocks is not None else (entry.size or 0)
+        stack[-1].children.append(node)
+        if entry.is_dir:
+            stack.append(node)
+        else:
+            node.bytes = entry.size or 0
+            _close_size_node(stack[-1], node)
+    while len(stack) > 1:
+        node = stack.pop()
+        _close_size_node(stack[-1], node)
+    return root
+
+
+def iter_rollup_entries(root, sort_by_size=False):
+    def ordered(node):
+        children = sorted(node.children, key=lambda n: n.bytes, reverse=True) if sort_by_size else node.children
+        return _with_last(children)
+
+    stack = [ordered(root)]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+            continue
+        node, node.is_last = child
+        yield node
+        if node.note:
+            yield TreeEntry(None, node.rel, node.name, node.depth, True, node.is_last, None, None, None, node.note)
+        elif node.is_dir:
+            stack.append(ordered(node))
+
+
+def largest_subtrees(root, count=10):
+    def iter_dirs():
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for child in node.children:
+                if child.is_dir:
+                    yield child
+                    stack.append(child)
+
+    return heapq.nlargest(count, iter_dirs(), key=lambda n: n.bytes)
+
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if num_bytes < 1024 or unit == "TB":
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
+def size_annotation(node):
+    if node.is_dir:
+        return f"  [{format_size(node.bytes)}, {node.files} files, {node.dirs} dirs]"
+    return f"  [{format_size(node.bytes)}]"
+
+
+def render_sized_tree(root, sort_by_size=False):
+    tree_lines = [f"{root.name}/{size_annotation(root)}"]
+    tree_lines.extend(iter_tree_lines(iter_rollup_entries(root, sort_by_size), annotate=size_annotation))
+    return "\n".join(tree_lines)
+
+
+def format_largest_report(root, count=10):
+    report = [f"Top {count} largest subtrees:"]
+    for node in largest_subtrees(root, count):
+        report.append(f"{format_size(node.bytes):>10}  {node.files:>8} files  {node.dirs:>6} dirs  {node.rel}/")
+    return "\n".join(report)
+
+
+# --- Git Index Source ---
+SCAN_SOURCES = ("filesystem", "git", "git+untracked")
+GIT_MODE_DIR = 0o040000
+GIT_MODE_GITLINK = 0o160000
+
+
+def find_git_worktree(path):
+    current = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(current, ".git")
+        if os.path.isdir(dot_git):
+            return current, dot_git
+        if os.path.isfile(dot_git):
+            with open(dot_git, "r", encoding="utf-8") as f:
+                line = f.read().strip()
+            if line.startswith("gitdir:"):
+                return current, os.path.normpath(os.path.join(current, line[len("gitdir:"):].strip()))
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None, None
+        current = parent
+
+
+def _git_hash_size(git_dir):
+    try:
+        with open(os.path.join(git_dir, "config"), "r", encoding="utf-8", errors="replace") as f:
+            config = f.read()
+    except OSError:
+        return 20
+    return 32 if re.search(r"^\s*objectformat\s*=\s*sha256\s*$", config, re.IGNORECASE | re.MULTILINE) else 20
+
+
+def _read_git_varint(data, pos):
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, pos
+
+
+def read_git_index(git_dir):
+    # Reads the tracked paths straight from .git/index (versions 2-4), returning
+    # (path, mode, size, mtime) in index order. No git binary is involved.
+    import struct
+    with open(os.path.join(git_dir, "index"), "rb") as f:
+        data = f.read()
+    signature, version, count = struct.unpack_from(">4sLL", data, 0)
+    if signature != b"DIRC" or version not in (2, 3, 4):
+        raise ValueError(f"Unsupported git index (signature {signature!r}, version {version})")
+    hash_size = _git_hash_size(git_dir)
+    # mtime (s, ns), mode and size out of the stat block, then the flags after the object id
+    header = struct.Struct(f">8xLL8xL8xL{hash_size}xH")
+    offset = 12
+    previous = b""
+    entries = []
+    for _ in range(count):
+        mtime_s, mtime_ns, mode, size, flags = header.unpack_from(data, offset)
+        pos = offset + header.size
+        if version >= 3 and flags & 0x4000:
+            pos += 2
+        if version == 4:
+            strip, pos = _read_git_varint(data, pos)
+            end = data.index(b"\0", pos)
+            name = previous[:len(previous) - strip] + data[pos:end]
+            offset = end + 1
+        else:
+            end = data.index(b"\0", pos)
+            name = data[pos:end]
+            offset += (end - offset + 8) & ~7
+        if name == previous and entries:
+            continue  # unmerged paths appear once per conflict stage
+        previous = name
+        entries.append((name.decode("utf-8", "surrogateescape"), mode, size, mtime_s + mtime_ns / 1e9))
+    return entries
+
+
+def _gitignore_regex(pattern):
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif c == "*":
+            out.append("[^/]*")
+            i += 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[" and pattern.find("]", i + 2) != -1:
+            j = pattern.find("]", i + 2)
+            members = pattern[i + 1:j].replace("\\", "\\\\")
+            out.append("[" + ("^" + members[1:] if members.startswith("!") else members) + "]")
+            i = j + 1
+        elif c == "\\" and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return re.compile("".join(out) + r"\Z")
+
+
+def _load_gitignore(path, base):
+    rules = []
+    try:
+        with open(path, "r", encoding="utf-8", errors="surrogateescape") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return rules
+    for line in lines:
+        line = line.rstrip(" ")
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        if line:
+            rules.append((_gitignore_regex(line.lstrip("/")), negate, dir_only, anchored, base))
+    return rules
+
+
+def _is_git_ignored(rel, is_dir, rules):
+    ignored = False
+    name = rel.rsplit("/", 1)[-1]
+    for regex, negate, dir_only, anchored, base in rules:
+        if dir_only and not is_dir:
+            continue
+        if base:
+            if not rel.startswith(base + "/"):
+                continue
+            target = rel[len(base) + 1:] if anchored else name
+        else:
+            target = rel if anchored else name
+        if regex.match(target):
+            ignored = not negate
+    return ignored
+
+
+def _iter_untracked(worktree, git_dir, scan_rel, selected_items, tracked):
+    # Walks the scan root the way git does for untracked files: symlinks are not
+    # followed, .git is skipped and directories excluded by .gitignore are pruned.
+    rules = _load_gitignore(os.path.join(git_dir, "info", "exclude"), "")
+    parts = scan_rel.split("/") if scan_rel else []
+    for depth in range(len(parts) + 1):
+        base = "/".join(parts[:depth])
+        rules = rules + _load_gitignore(os.path.join(worktree, base, ".gitignore"), base)
+    selected = set(selected_items)
+    root_dir = os.path.join(worktree, scan_rel)
+    stack = [(root_dir, "", rules)]
+    while stack:
+        dir_path, rel_dir, dir_rules = stack.pop()
+        if rel_dir:
+            dir_rules = dir_rules + _load_gitignore(os.path.join(dir_path, ".gitignore"),
+                                                    f"{scan_rel}/{rel_dir}" if scan_rel else rel_dir)
+        try:
+            with os.scandir(dir_path) as it:
+                children = list(it)
+        except OSError:
+            continue
+        for child in children:
+            if child.name == ".git" or (not rel_dir and child.name not in selected):
+                continue
+            rel = f"{rel_dir}/{child.name}" if rel_dir else child.name
+            repo_rel = f"{scan_rel}/{rel}" if scan_rel else rel
+            is_dir = child.is_dir(follow_symlinks=False)
+            if _is_git_ignored(repo_rel, is_dir, dir_rules):
+                continue
+            if is_dir:
+                stack.append((child.path, rel, dir_rules))
+            elif rel not in tracked:
+                try:
+                    st = child.stat(follow_symlinks=False)
+                    yield rel, st.st_size, st.st_mtime
+                except OSError:
+                    yield rel, None, None
+
+
+def _dir_node(tree, rel_dir):
+    node = tree
+    if rel_dir:
+        for part in rel_dir.split("/"):
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+    return node
+
+
+def _add_path(tree, rel, leaf, cache):
+    # cache holds the last (parent path, parent node); sorted input hits it almost always.
+    parent, _, name = rel.rpartition("/")
+    if cache[0] != parent:
+        cache[0], cache[1] = parent, _dir_node(tree, parent)
+    node = cache[1]
+    if leaf is None:
+        node.setdefault(name, {})
+    else:
+        node[name] = leaf
+
+
+def iter_path_tree(root_dir, tree, selected_items, with_stat=False, ignore=None, max_depth=None):
+    # Emits a nested {name: subtree-dict | (size, mtime)} mapping as TreeEntry
+    # values in the same order and shape scan_tree produces for the filesystem.
+    def ordered(node):
+        names = [n for n in node if not (ignore and _is_ignored(n, ignore))]
+        dirs = sorted(n for n in names if isinstance(node[n], dict))
+        files = sorted(n for n in names if not isinstance(node[n], dict))
+        return _with_last([(n, node[n]) for n in dirs + files])
+
+    top = [n for n in selected_items if n in tree and not (ignore and _is_ignored(n, ignore))]
+    top.sort(key=lambda n: (not isinstance(tree[n], dict), n.lower()))
+    root_prefix = os.path.join(root_dir, "")
+    stack = [(_with_last([(n, tree[n]) for n in top]), "")]
+    while stack:
+        children, parent_rel = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            continue
+        (name, node), is_last = child
+        depth = len(stack) - 1
+        rel = f"{parent_rel}/{name}" if parent_rel else name
+        is_dir = isinstance(node, dict)
+        size, mtime = node if with_stat and not is_dir else (None, None)
+        path = root_prefix + (rel if os.sep == "/" else rel.replace("/", os.sep))
+        yield TreeEntry(path, rel, name, depth, is_dir, is_last, size, mtime, None, None)
+        if is_dir and (max_depth is None or depth + 1 < max_depth):
+            stack.append((ordered(node), rel))
+
+
+def scan_git_index(root_dir, selected_items, with_stat=False, include_untracked=False, ignore=None, max_depth=None):
+    worktree, git_dir = find_git_worktree(root_dir)
+    if worktree is None:
+        raise ValueError(f"Not inside a git working tree: {root_dir}")
+    scan_rel = os.path.relpath(os.path.abspath(root_dir), worktree).replace(os.sep, "/")
+    scan_rel = "" if scan_rel == "." else scan_rel
+    prefix = scan_rel + "/" if scan_rel else ""
+    tree = {}
+    tracked = set()
+    cache = [None, None]
+    for path, mode, size, mtime in read_git_index(git_dir):
+        if prefix and not path.startswith(prefix):
+            continue
+        rel = path[len(prefix):].rstrip("/")
+        is_dir = mode & 0o170000 in (GIT_MODE_DIR, GIT_MODE_GITLINK)
+        _add_path(tree, rel, None if is_dir else (size, mtime), cache)
+        if include_untracked:
+            tracked.add(rel)
+    if include_untracked:
+        for rel, size, mtime in _iter_untracked(worktree, git_dir, scan_rel, selected_items, tracked):
+            _add_path(tree, rel, (size, mtime), cache)
+    return iter_path_tree(root_dir, tree, selected_items, with_stat, ignore, max_depth)
+
+
+def scan_entries(root_dir, selected_items, source="filesystem", with_stat=False, concurrency=None, **scan_options):
+    if source == "filesystem":
+        if concurrency and concurrency > 1:
+            if scan_options.pop("profiler", None) is not None:
+                raise ValueError("Scan profiling times the serial walk; use a concurrency of 1")
+            return iter_scan_concurrent(root_dir, selected_items, with_stat, concurrency=concurrency, **scan_options)
+        return scan_tree(root_dir, selected_items, with_stat, **scan_options)
+    if source not in SCAN_SOURCES:
+        raise ValueError(f"Unknown scan source: {source}")
+    if scan_options.get("profiler") is not None:
+        raise ValueError("Scan profiling needs the filesystem source")
+    return scan_git_index(root_dir, selected_items, with_stat, source == "git+untracked",
+                          scan_options.get("ignore"), scan_options.get("max_depth"))
+
+
+# --- Tree Search ---
+SEARCH_MODES = ("substring", "glob", "fuzzy")
+SEARCH_DISPLAY_LIMIT = 2000
+
+
+def _glob_line_pattern(pattern):
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        j = pattern.find("]", i + 2) if c == "[" else -1
+        if c == "*":
+            out.append("[^\n]*")
+        elif c == "?":
+            out.append("[^\n]")
+        elif j != -1:
+            members = pattern[i + 1:j].replace("\\", "\\\\")
+            out.append("[^\n" + members[1:] + "]" if members.startswith("!") else "[" + members + "]")
+            i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class TreeSearchIndex:
+    # Compact index over a rendered tree: all names live in one newline-joined
+    # string with an offsets array, plus parent and depth arrays. Queries run as
+    # C-level str.find / regex scans over that string and map hits back to
+    # entries with bisect; full-path queries (containing "/") use a path string
+    # built on first use.
+    def __init__(self, root_label=""):
+        self.root_label = root_label
+        self.depths = array("H")
+        self.parents = array("l")
+        self.is_dir = bytearray()
+        self._pending = []
+        self._stack = []
+        self.names = "\n"
+        self.offsets = array("q", [1])
+        self.lower_names = "\n"
+        self.lower_offsets = self.offsets
+        self._paths = None
+
+    def __len__(self):
+        return len(self.depths)
+
+    def add(self, name, depth, is_dir):
+        del self._stack[depth:]
+        self.parents.append(self._stack[-1] if self._stack else -1)
+        self._stack.append(len(self.depths))
+        self.depths.append(depth)
+        self.is_dir.append(is_dir)
+        self._pending.append(name)
+
+    def record(self, entries):
+        for entry in entries:
+            if not entry.error:
+                self.add(entry.name, entry.depth, entry.is_dir)
+            yield entry
+        self.finish()
+
+    def finish(self):
+        # Names are stored as "\nname0\nname1\n...", offsets[i] being where name i starts.
+        if self._pending:
+            names = self.names.split("\n")[1:-1] + self._pending
+            self.names = "\n" + "\n".join(names) + "\n"
+            self.offsets = array("q", itertools.accumulate((len(n) + 1 for n in names), initial=1))
+            self.lower_names = self.names.lower()
+            if len(self.lower_names) == len(self.names):
+                self.lower_offsets = self.offsets
+            else:
+                lowered = self.lower_names.split("\n")[1:-1]
+                self.lower_offsets = array("q", itertools.accumulate((len(n) + 1 for n in lowered), initial=1))
+        self._pending = []
+        self._stack = []
+        self._paths = None
+
+    @classmethod
+    def from_tree_text(cls, tree_text):
+        lines = tree_text.strip("\n").splitlines()
+        index = cls(lines[0] if lines else "")
+        for line in lines[1:]:
+            clean = line.lstrip("│├└─ ")
+            if not clean or clean.startswith("<"):
+                continue
+            index.add(clean.rstrip("/"), max((len(line) - len(clean)) // 4 - 1, 0), clean.endswith("/"))
+        index.finish()
+        return index
+
+    def name(self, i):
+        return self.names[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def path(self, i):
+        parts = []
+        while i >= 0:
+            parts.append(self.name(i))
+            i = self.parents[i]
+        return "/".join(reversed(parts))
+
+    def _path_table(self):
+        if self._paths is None:
+            paths = []
+            for i in range(len(self.depths)):
+                parent = self.parents[i]
+                paths.append(f"{paths[parent]}/{self.name(i)}" if parent >= 0 else self.name(i))
+            text = ("\n" + "\n".join(paths) + "\n").lower()
+            self._paths = (text, array("q", itertools.accumulate((len(p) + 1 for p in paths), initial=1)))
+        return self._paths
+
+    def _find_literal(self, text, offsets, needle, limit, check=None):
+        hits = []
+        pos = text.find(needle)
+        while pos != -1 and len(hits) < limit:
+            i = bisect.bisect_right(offsets, pos) - 1
+            if check is None or check(text[offsets[i]:offsets[i + 1] - 1]):
+                hits.append(i)
+            pos = text.find(needle, offsets[i + 1])
+        return hits
+
+    def _find_regex(self, text, offsets, regex, limit, shift=0):
+        hits = []
+        pos = 0
+        while len(hits) < limit:
+            match = regex.search(text, pos)
+            if match is None:
+                break
+            i = bisect.bisect_right(offsets, match.start() + shift) - 1
+            hits.append(i)
+            pos = offsets[i + 1] - shift
+        return hits
+
+    def search(self, query, mode="substring", limit=None):
+        # Returns entry ids in tree order, at most limit of them.
+        query = query.lower()
+        limit = limit or len(self.depths)
+        if not query:
+            return []
+        if "/" in query:
+            text, offsets = self._path_table()
+        else:
+            text, offsets = self.lower_names, self.lower_offsets
+        if mode == "substring":
+            return self._find_literal(text, offsets, query, limit)
+        if mode == "glob":
+            literals = [part for part in re.split(r"\*|\?|\[[^\]]*\]", query) if part]
+            if literals and query[0] in "*?[":
+                # Scan for the longest literal piece, then confirm each candidate name.
+                matcher = re.compile(fnmatch.translate(query)).match
+                return self._find_literal(text, offsets, max(literals, key=len), limit, matcher)
+            # A leading "\n" gives the regex engine a literal prefix to jump between names.
+            line_regex = re.compile("\n" + _glob_line_pattern(query) + "(?=\n)")
+            return self._find_regex(text, offsets, line_regex, limit, shift=1)
+        if mode == "fuzzy":
+            # Characters in order, with negated classes so the scan never backtracks.
+            chars = [re.escape(c) for c in query]
+            pattern = chars[0] + "".join(f"[^\n{c}]*{c}" for c in chars[1:])
+            return self._find_regex(text, offsets, re.compile(pattern), limit)
+        raise ValueError(f"Unknown search mode: {mode}")
+
+    def iter_filtered_entries(self, hits):
+        # Matches plus all their ancestors, in tree order, with is_last recomputed
+        # among the entries that remain visible.
+        visible = set()
+        for i in hits:
+            while i >= 0 and i not in visible:
+                visible.add(i)
+                i = self.parents[i]
+        shown = sorted(visible)
+        last = bytearray(len(shown))
+        seen_parents = set()
+        for k in range(len(shown) - 1, -1, -1):
+            parent = self.parents[shown[k]]
+            if parent not in seen_parents:
+                last[k] = 1
+                seen_parents.add(parent)
+        for k, i in enumerate(shown):
+            yield TreeEntry(None, None, self.name(i), self.depths[i], bool(self.is_dir[i]), bool(last[k]),
+                            None, None, None, None)
+
+    def render_filtered(self, query, mode="substring", limit=None):
+        hits = self.search(query, mode, limit)
+        tree_lines = [self.root_label]
+        tree_lines.extend(iter_tree_lines(self.iter_filtered_entries(hits)))
+        return "\n".join(tree_lines), len(hits)
+
+
+# --- Tree Parser ---
+def parse_tree(tree_text):
+    lines = tree_text.strip().splitlines()
+    path_stack = []
+    paths = []
+    for line in lines:
+        clean = line.lstrip("│├└─ ")
+        indent = len(line) - len(clean)
+        level = indent // 4
+        while len(path_stack) > level:
+            path_stack.pop()
+        is_dir = clean.endswith("/")
+        name = clean.rstrip("/") if is_dir else clean
+        path_stack.append(name)
+        full_path = os.path.join(*path_stack)
+        paths.append((full_path, is_dir))
+    return paths
+
+
+# --- Tree Validator ---
+TreeProblem = namedtuple("TreeProblem", "line kind message")
+TREE_NAME_MAX = 255
+TREE_PATH_MAX = 4096
+TREE_PROBLEM_REPORT_LIMIT = 50
+if os.name == "nt":
+    # Control characters, plus the characters Windows does not allow in names.
+    _ILLEGAL_NAME_CHARS = re.compile(r'[\x00-\x1f<>:"|?*]')
+    _PATH_SEPARATORS = re.compile(r"[\\/]")
+else:
+    _ILLEGAL_NAME_CHARS = re.compile(r"[\x00-\x1f]")
+    _PATH_SEPARATORS = re.compile("/")
+
+
+class TreeValidationError(ValueError):
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__(format_tree_problems(problems))
+
+
+def validate_tree(tree_text, name_max=TREE_NAME_MAX, path_max=TREE_PATH_MAX):
+    # Reads the diagram exactly as parse_tree does, in one pass, and returns every
+    # problem found with its 1-based line number in tree_text: duplicate paths,
+    # file/directory collisions, entries under a file, paths escaping the
+    # destination, illegal characters, bad indentation and over-long names.
+    problems = []
+    report = problems.append
+    stripped = tree_text.strip()
+    first_line = tree_text.count("\n", 0, tree_text.find(stripped)) + 1 if stripped else 1
+    stack = []  # (path, is_dir, line) of the current ancestors
+    seen = {}
+    windows = os.name == "nt"
+    for number, line in enumerate(stripped.splitlines(), first_line):
+        clean = line.lstrip("│├└─ ")
+        indent = len(line) - len(clean)
+        level = indent // 4
+        if not clean or clean.isspace():
+            report(TreeProblem(number, "empty", "Line has no name"))
+            continue
+        if clean[0] == "\t":
+            report(TreeProblem(number, "indent", "Tab in indentation; use spaces or tree characters"))
+        elif indent % 4:
+            report(TreeProblem(number, "indent", f"Indentation of {indent} is not a multiple of 4"))
+        is_dir = clean.endswith("/")
+        name = clean.rstrip("/") if is_dir else clean
+        if not name:
+            report(TreeProblem(number, "empty", "Line has no name"))
+            continue
+        if level > len(stack):
+            # The line above sits at len(stack) - 1, so this one is that many levels below it.
+            report(TreeProblem(number, "indent", f"Indented {level - len(stack) + 1} levels below the line above; "
+                                                 "expected at most 1"))
+            level = len(stack)
+        del stack[level:]
+        if stack and not stack[-1][1]:
+            report(TreeProblem(number, "parent-file", f"Listed under '{stack[-1][0]}', which is a file "
+                                                      f"(line {stack[-1][2]})"))
+        # The cheap tests below only gate the exact ones, which few names reach.
+        if name[0] in "/\\." or ".." in name or name[1:2] == ":":
+            if os.path.isabs(name) or os.path.splitdrive(name)[0]:
+                report(TreeProblem(number, "escape", f"'{name}' is an absolute path"))
+            elif name == "." or ".." in _PATH_SEPARATORS.split(name):
+                report(TreeProblem(number, "escape", f"'{name}' points outside its parent directory"))
+        bad = (windows or not name.isprintable()) and _ILLEGAL_NAME_CHARS.search(name)
+        if bad:
+            report(TreeProblem(number, "illegal-char", f"Illegal character {bad.group()!r} in '{name}'"))
+        elif name[-1].isspace() or name[0].isspace():
+            report(TreeProblem(number, "illegal-char", f"'{name}' starts or ends with whitespace"))
+        path = f"{stack[-1][0]}/{name}" if stack else name
+        if len(name) * 4 > name_max and len(name.encode("utf-8", "surrogateescape")) > name_max:
+            report(TreeProblem(number, "too-long", f"Name is longer than {name_max} bytes"))
+        if len(path) * 4 > path_max and len(path.encode("utf-8", "surrogateescape")) > path_max:
+            report(TreeProblem(number, "too-long", f"Path is longer than {path_max} bytes"))
+        previous = seen.get(path)
+        if previous is None:
+            seen[path] = (number, is_dir)
+        elif previous[1] == is_dir:
+            report(TreeProblem(number, "duplicate", f"'{path}' is already listed on line {previous[0]}"))
+        else:
+            kind = "directory" if previous[1] else "file"
+            report(TreeProblem(number, "collision", f"'{path}' is listed as a {kind} on line {previous[0]}"))
+        stack.append((path, is_dir, number))
+    return problems
+
+
+def format_tree_problems(problems, limit=TREE_PROBLEM_REPORT_LIMIT):
+    lines = [f"Line {problem.line}: {problem.message} [{problem.kind}]" for problem in problems[:limit]]
+    if len(problems) > limit:
+        lines.append(f"... and {len(problems) - limit} more problem(s)")
+    return "\n".join(lines)
+
+
+# --- Structure Builder ---
+VARIABLE_PATTERN = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+def expand_variables(text, variables):
+    # Replaces {{name}} placeholders; unknown names are left as they are.
+    if not variables or "{{" not in text:
+        return text
+    return VARIABLE_PATTERN.sub(lambda m: str(variables.get(m.group(1), m.group(0))), text)
+
+
+def expand_paths(paths, variables=None):
+    # Expands {{name}} in every path before anything is written, and refuses the
+    # whole tree if a path, as given or as expanded, would land outside the
+    # destination.
+    expanded = []
+    for path, is_dir in paths:
+        original = path
+        path = expand_variables(path, variables)
+        if ".." in path or path[:1] in "/\\" or path[1:2] == ":":
+            if os.path.isabs(path) or os.path.splitdrive(path)[0] or ".." in re.split(r"[\\/]", path):
+                raise ValueError(f"'{original}' would be created outside the destination as '{path}'")
+        expanded.append((path, is_dir))
+    return expanded
+
+
+def _unlink_existing(path):
+    # Files are replaced, never rewritten in place: a previous --hardlink build
+    # shares its inodes with the skeleton cache, and truncating one would empty
+    # the cached copy too.
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def build_structure(paths, dest_dir, variables=None):
+    for path, is_dir in expand_paths(paths, variables):
+        full_path = os.path.join(dest_dir, path)
+        if is_dir:
+            os.makedirs(full_path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            ext = os.path.splitext(full_path)[1]
+            content = expand_variables(TEMPLATES.get(ext, ""), variables)
+            _unlink_existing(full_path)
+            with open(full_path, "w", encoding="utf-8") as f:
+                f.write(content)
+
+
+# --- Preset Registry ---
+# Packaged PRESETS plus *.tree files from the user preset directory. Parsed
+# trees are cached on disk one file per preset, as a newline-joined path string
+# and a byte of is_dir flags per path, and re-parsed only when the source's
+# mtime or size (or the packaged text) changes.
+_CONFIG_HOME = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+_CACHE_HOME = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+PRESET_DIR = os.path.join(_CONFIG_HOME, "filetree", "presets")
+PRESET_CACHE_DIR = os.path.join(_CACHE_HOME, "filetree", "parsed")
+_PRESET_CACHE_VERSION = 2
+PRESET_MEMORY_CACHE_SIZE = 128
+
+
+def _pack_paths(paths):
+    return "\n".join(path for path, _ in paths), bytes(is_dir for _, is_dir in paths)
+
+
+def _unpack_paths(packed):
+    text, flags = packed
+    return list(zip(text.split("\n"), map(bool, flags))) if flags else []
+
+
+class PresetRegistry:
+    def __init__(self, preset_dir=PRESET_DIR, cache_dir=PRESET_CACHE_DIR, memory_size=PRESET_MEMORY_CACHE_SIZE):
+        self.preset_dir = preset_dir
+        self.cache_dir = cache_dir
+        self.memory_size = memory_size
+        self._files = None
+        self._dir_mtime = None
+        # Least recently used first; the server reads sources from many threads.
+        self._parsed = OrderedDict()
+        self._parsed_lock = threading.Lock()
+        # Bumped on every rescan, so any number of readers can tell whether the
+        # list changed since they last looked.
+        self.generation = 0
+
+    def refresh(self):
+        # Rescans the preset directory only when its mtime changed; returns
+        # whether the list of user presets may have changed.
+        try:
+            mtime = os.stat(self.preset_dir).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self._files is not None and mtime == self._dir_mtime:
+            return False
+        self._dir_mtime = mtime
+        self.generation += 1
+        files = {}
+        if mtime is not None:
+            for entry in sorted(os.scandir(self.preset_dir), key=lambda e: e.name.lower()):
+                if entry.name.endswith(".tree") and entry.is_file():
+                    files[entry.name[:-len(".tree")]] = entry.path
+        self._files = files
+        return True
+
+    def packaged_names(self):
+        return list(PRESETS)
+
+    def user_names(self):
+        # User presets override packaged ones with the same name.
+        self.refresh()
+        return list(self._files)
+
+    def __contains__(self, name):
+        self.refresh()
+        return name in self._files or name in PRESETS
+
+    def text(self, name):
+        self.refresh()
+        if name in self._files:
+            with open(self._files[name], "r", encoding="utf-8") as f:
+                return f.read()
+        return PRESETS[name]
+
+    def parsed(self, name):
+        # (paths, problems) of a preset; problems as validate_tree reports them.
+        self.refresh()
+        if name in self._files:
+            return self.file_parsed(self._files[name])
+        import zlib
+        text = PRESETS[name]
+        return self._cached_parse(("preset", name), (len(text), zlib.crc32(text.encode("utf-8"))), lambda: text)
+
+    def file_parsed(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+
+        def read():
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+
+        return self._cached_parse(("file", path), (st.st_mtime_ns, st.st_size), read)
+
+    def paths(self, name):
+        return self.parsed(name)[0]
+
+    def file_paths(self, path):
+        return self.file_parsed(path)[0]
+
+    def _cached_parse(self, key, stamp, read_text):
+        import marshal
+        with self._parsed_lock:
+            cached = self._parsed.get(key)
+            if cached is not None and cached[0] == stamp:
+                self._parsed.move_to_end(key)
+                return cached[1]
+        import hashlib
+        cache_path = os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode("utf-8")).hexdigest())
+        result = None
+        try:
+            with open(cache_path, "rb") as f:
+                version, cached_stamp, packed, problems = marshal.load(f)
+            if version == _PRESET_CACHE_VERSION and tuple(cached_stamp) == stamp:
+                result = _unpack_paths(packed), [TreeProblem(*problem) for problem in problems]
+        except (OSError, ValueError, EOFError, TypeError):
+            pass
+        if result is None:
+            # Validation reads the text once more, but only when the source changes.
+            text = read_text()
+            result = parse_tree(text), validate_tree(text)
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as f:
+                    marshal.dump((_PRESET_CACHE_VERSION, stamp, _pack_paths(result[0]),
+                                  [tuple(problem) for problem in result[1]]), f)
+                os.replace(temp_path, cache_path)
+            except OSError:
+                pass
+        with self._parsed_lock:
+            self._parsed[key] = (stamp, result)
+            self._parsed.move_to_end(key)
+            while len(self._parsed) > self.memory_size:
+                self._parsed.popitem(last=False)
+        return result
+
+
+PRESET_REGISTRY = PresetRegistry()
+
+
+def load_tree(source):
+    # Preset names and .tree files both come back parsed and validated through the
+    # registry cache, as (paths, problems).
+    if source in PRESET_REGISTRY:
+        return PRESET_REGISTRY.parsed(source)
+    return PRESET_REGISTRY.file_parsed(source)
+
+
+def load_tree_paths(source):
+    return load_tree(source)[0]
+
+
+def load_checked_paths(source):
+    paths, problems = load_tree(source)
+    if problems:
+        raise TreeValidationError(problems)
+    return paths
+
+
+# --- Skeleton Cache ---
+# Trees are materialized once, with their {{name}} placeholders unexpanded, under
+# a content-addressed key. Builds expand names as they clone files from there.
+SKELETON_CACHE_DIR = os.path.join(_CACHE_HOME, "filetree", "skeletons")
+SKELETON_CACHE_LIMIT = 64
+CLONE_METHODS = ("reflink", "hardlink", "copy_file_range", "copy")
+FICLONE = 0x40049409
+_CLONE_UNSUPPORTED = {errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.ENOSYS, errno.EPERM}
+_skeleton_keys = OrderedDict()
+
+
+def _skeleton_key(paths):
+    # The key covers the raw paths and the templates they use. Batch workers and
+    # the GUI's parse memo hand over the same list repeatedly, so recent keys are
+    # remembered by list identity instead of being hashed again.
+    import hashlib
+    known = _skeleton_keys.get(id(paths))
+    if known is not None and known[0] is paths:
+        _skeleton_keys.move_to_end(id(paths))
+        return known[1]
+    digest = hashlib.sha256()
+    exts = set()
+    for path, is_dir in paths:
+        if not is_dir:
+            exts.add(os.path.splitext(path)[1])
+        digest.update(f"{int(is_dir)}\0{path}\0".encode("utf-8", "surrogateescape"))
+    for ext in sorted(exts):
+        digest.update(f"{ext}\0{TEMPLATES.get(ext, '')}\0".encode("utf-8"))
+    _skeleton_keys[id(paths)] = (paths, digest.hexdigest())
+    if len(_skeleton_keys) > SKELETON_CACHE_LIMIT:
+        _skeleton_keys.popitem(last=False)
+    return digest.hexdigest()
+
+
+def _evict_skeletons(cache_dir, keep):
+    # Least recently used skeletons go first; builds touch the one they use.
+    import shutil
+    skeletons = [e for e in os.scandir(cache_dir) if e.is_dir() and not e.name.startswith(".")]
+    if len(skeletons) <= SKELETON_CACHE_LIMIT:
+        return
+    skeletons.sort(key=lambda e: e.stat().st_mtime)
+    for entry in skeletons[:len(skeletons) - SKELETON_CACHE_LIMIT]:
+        if entry.path != keep:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def materialize_skeleton(paths, cache_dir=SKELETON_CACHE_DIR):
+    # Returns the skeleton directory of an unexpanded tree, creating it on first
+    # use. Concurrent builders may both stage the same key; the loser of the
+    # rename discards its copy.
+    import shutil
+    import tempfile
+    skeleton = os.path.join(cache_dir, _skeleton_key(paths))
+    if os.path.isdir(skeleton):
+        os.utime(skeleton)
+        return skeleton
+    os.makedirs(cache_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=cache_dir)
+    try:
+        build_structure(paths, staging)
+        os.rename(staging, skeleton)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(skeleton):
+            raise
+    _evict_skeletons(cache_dir, skeleton)
+    return skeleton
+
+
+def clone_file(src, dst, methods):
+    # Tries each method in order and drops the ones the filesystem refuses, so
+    # the rest of the build goes straight to the first that works.
+    import shutil
+    for method in list(methods):
+        # Also clears what a refused method left behind.
+        _unlink_existing(dst)
+        try:
+            if method == "hardlink":
+                os.link(src, dst)
+            elif method == "copy":
+                shutil.copyfile(src, dst)
+            else:
+                with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                    if method == "reflink":
+                        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                    else:
+                        while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+                            pass
+            return method
+        except OSError as e:
+            if method == "copy" or e.errno not in _CLONE_UNSUPPORTED:
+                raise
+            methods.remove(method)
+
+
+def build_structure_cached(paths, dest_dir, variables=None, cache_dir=None, hardlink=False):
+    # Same result as build_structure, returned with a Counter of how each file
+    # was produced. Every file is cloned from the skeleton: by reflink where the
+    # filesystem shares extents, otherwise by copy_file_range. Hardlinked files
+    # share their inode with the cache, so they are opt-in.
+    expanded = expand_paths(paths, variables)
+    skeleton = materialize_skeleton(paths, cache_dir or SKELETON_CACHE_DIR)
+    methods = [m for m in CLONE_METHODS if (m != "reflink" or fcntl is not None and sys.platform.startswith("linux"))
+               and (m != "hardlink" or hardlink) and (m != "copy_file_range" or hasattr(os, "copy_file_range"))]
+    used = Counter()
+    for (raw_path, is_dir), (path, _) in zip(paths, expanded):
+        full_path = os.path.join(dest_dir, path)
+        if is_dir:
+            os.makedirs(full_path, exist_ok=True)
+            continue
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        ext = os.path.splitext(path)[1]
+        template = TEMPLATES.get(ext, "")
+        if ext != os.path.splitext(raw_path)[1] or (variables and "{{" in template):
+            # The cached copy holds another template, or this one unexpanded.
+            _unlink_existing(full_path)
+            with open(full_path, "w", encoding="utf-8") as f:
+                f.write(expand_variables(template, variables))
+            used["written"] += 1
+        else:
+            used[clone_file(os.path.join(skeleton, raw_path), full_path, methods)] += 1
+    return used
+
+
+# --- Batch Builder ---
+BatchJob = namedtuple("BatchJob", "source dest variables")
+BatchResult = namedtuple("BatchResult", "jobs failed files dirs seconds")
+BATCH_CHUNK_SIZE = 64
+
+_batch_trees = {}
+_batch_build_options = None
+
+
+def load_manifest(manifest_path):
+    # A JSON array or NDJSON of {"tree": preset name or .tree file, "dest": dir,
+    # "variables": {...}}. Relative paths resolve against the manifest's folder.
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        records = json.loads(text)
+    else:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    for number, record in enumerate(records, 1):
+        if not isinstance(record, dict) or "tree" not in record or "dest" not in record:
+            raise ValueError(f"Manifest entry {number} needs 'tree' and 'dest'")
+        source = record["tree"]
+        if source not in PRESET_REGISTRY:
+            source = os.path.join(base, source)
+        jobs.append(BatchJob(source, os.path.join(base, record["dest"]), record.get("variables") or {}))
+    return jobs
+
+
+def _init_batch_worker(trees, build_options=None):
+    global _batch_trees, _batch_build_options
+    _batch_trees = trees
+    _batch_build_options = build_options
+
+
+def _run_batch_job(source, dest, variables):
+    paths = _batch_trees[source]
+    if _batch_build_options is None:
+        build_structure(paths, dest, variables)
+    else:
+        build_structure_cached(paths, dest, variables, **_batch_build_options)
+    files = sum(1 for _, is_dir in paths if not is_dir)
+    return files, len(paths) - files
+
+
+def _run_batch_chunk(jobs):
+    # Jobs travel in chunks to keep pool round trips down; each still fails alone.
+    results = []
+    for job in jobs:
+        try:
+            results.append((_run_batch_job(*job), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+
+def run_batch(jobs, workers=None, progress=None, build_options=None):
+    # Each distinct tree is parsed once here and handed to the workers when they
+    # start, so jobs only carry their destination and variables. A failing job
+    # is reported through progress(done, total, job, error) and does not stop the rest.
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    start = time.perf_counter()
+    trees, errors = {}, {}
+    for source in dict.fromkeys(job.source for job in jobs):
+        try:
+            trees[source] = load_checked_paths(source)
+        except Exception as e:
+            errors[source] = e
+    files = dirs = failed = done = 0
+
+    def finish(job, counts, error):
+        nonlocal files, dirs, failed, done
+        done += 1
+        if error is None:
+            files += counts[0]
+            dirs += counts[1]
+        else:
+            failed += 1
+        if progress:
+            progress(done, len(jobs), job, error)
+
+    runnable = []
+    for job in jobs:
+        if job.source in errors:
+            finish(job, None, errors[job.source])
+        else:
+            runnable.append(job)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_batch_worker(trees, build_options)
+        for job in runnable:
+            finish(job, *_run_batch_chunk([job])[0])
+    elif runnable:
+        size = max(1, min(BATCH_CHUNK_SIZE, len(runnable) // (workers * 4)))
+        chunks = [runnable[i:i + size] for i in range(0, len(runnable), size)]
+        with ProcessPoolExecutor(workers, initializer=_init_batch_worker,
+                                 initargs=(trees, build_options)) as pool:
+            futures = {pool.submit(_run_batch_chunk, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                error = future.exception()
+                results = [(None, error)] * len(chunk) if error else future.result()
+                for job, (counts, job_error) in zip(chunk, results):
+                    finish(job, counts, job_error)
+    return BatchResult(len(jobs), failed, files, dirs, time.perf_counter() - start)
+
+
+# --- Fingerprints ---
+FINGERPRINT_MODES = ("names", "stat", "content")
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class FingerprintNode:
+    __slots__ = ("name", "is_dir", "digest", "children", "error")
+
+    def __init__(self, name, is_dir, digest=""):
+        self.name = name
+        self.is_dir = is_dir
+        self.digest = digest
+        self.children = {} if is_dir else None
+        self.error = None
+
+
+def _hash_file(path):
+    import hashlib
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _seal_digests(root):
+    # Post-order pass: a directory digest covers the sorted (name, type, digest)
+    # of its children, so equal digests mean equal subtrees.
+    import hashlib
+    stack = [(root, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children.values() if child.is_dir)
+            continue
+        h = hashlib.sha256()
+        for name in sorted(node.children):
+            child = node.children[name]
+            h.update(f"{name}\0{'d' if child.is_dir else 'f'}\0{child.digest}\n".encode("utf-8", "surrogateescape"))
+        if node.error:
+            h.update(f"!{node.error}\n".encode("utf-8", "surrogateescape"))
+        node.digest = h.hexdigest()
+    return root
+
+
+def compute_fingerprints(root_dir, selected_items, mode="names", workers=None):
+    from concurrent.futures import ThreadPoolExecutor
+    if mode not in FINGERPRINT_MODES:
+        raise ValueError(f"Unknown fingerprint mode: {mode}")
+    root = FingerprintNode(os.path.basename(os.path.abspath(root_dir)), True)
+    stack = [root]
+    pending = []
+    executor = ThreadPoolExecutor(max_workers=workers) if mode == "content" else None
+    try:
+        for entry in scan_tree(root_dir, selected_items, with_stat=(mode == "stat")):
+            if entry.error:
+                stack[-1].error = entry.error
+                continue
+            del stack[entry.depth + 1:]
+            node = FingerprintNode(entry.name, entry.is_dir)
+            stack[-1].children[entry.name] = node
+            if entry.is_dir:
+                stack.append(node)
+            elif mode == "stat":
+                node.digest = f"{entry.size}:{entry.mtime}"
+            elif mode == "content" and os.path.isfile(entry.path):
+                pending.append((node, executor.submit(_hash_file, entry.path)))
+        for node, future in pending:
+            try:
+                node.digest = future.result()
+            except OSError as e:
+                node.digest = f"<Error: {e}>"
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return _seal_digests(root)
+
+
+def fingerprints_from_tree_text(tree_text):
+    root = FingerprintNode("", True)
+    for path, is_dir in parse_tree(tree_text):
+        parent = root
+        # A "<...>" line is the walker's note on the directory above it, and its
+        # message may itself contain slashes.
+        head, _, note = f"/{path.replace(os.sep, '/')}".partition("/<")
+        if note.endswith(">"):
+            for part in filter(None, head.split("/")):
+                parent = parent.children.setdefault(part, FingerprintNode(part, True))
+            parent.error = note[:-1]
+            continue
+        parts = path.replace(os.sep, "/").split("/")
+        for part in parts[:-1]:
+            parent = parent.children.setdefault(part, FingerprintNode(part, True))
+        if parts[-1] not in parent.children:
+            parent.children[parts[-1]] = FingerprintNode(parts[-1], is_dir)
+    # A diagram starts with its root line ("project/"), which stands for the scanned root itself.
+    if len(root.children) == 1:
+        only = next(iter(root.children.values()))
+        if only.is_dir:
+            root = only
+    return _seal_digests(root)
+
+
+def compare_fingerprints(old, new, prefix=""):
+    # Yields (status, path) for every difference, descending only into
+    # directories whose digests differ.
+    if old.digest == new.digest:
+        return
+    stack = [(iter(sorted(old.children.keys() | new.children.keys())), old, new, prefix)]
+    while stack:
+        names, a, b, base = stack[-1]
+        name = next(names, None)
+        if name is None:
+            stack.pop()
+            continue
+        path = f"{base}/{name}" if base else name
+        child_a = a.children.get(name)
+        child_b = b.children.get(name)
+        if child_b is None:
+            yield "removed", path
+        elif child_a is None:
+            yield "added", path
+        elif child_a.digest == child_b.digest and child_a.is_dir == child_b.is_dir:
+            continue
+        elif child_a.is_dir and child_b.is_dir:
+            stack.append((iter(sorted(child_a.children.keys() | child_b.children.keys())), child_a, child_b, path))
+        else:
+            yield "changed", path
+
+
+def _fingerprint_to_list(node):
+    if node.is_dir:
+        return [node.name, node.digest, [_fingerprint_to_list(c) for c in node.children.values()], node.error]
+    return [node.name, node.digest]
+
+
+def _fingerprint_from_list(data):
+    node = FingerprintNode(data[0], len(data) > 2, data[1])
+    if node.is_dir:
+        node.error = data[3]
+        for child in data[2]:
+            node.children[child[0]] = _fingerprint_from_list(child)
+    return node
+
+
+def save_fingerprints(root, mode, fp):
+    json.dump({"format": "filetree-fingerprints", "version": 1, "mode": mode,
+               "root": _fingerprint_to_list(root)}, fp, separators=(",", ":"))
+
+
+def load_fingerprints(fp):
+    data = json.load(fp)
+    if data.get("format") != "filetree-fingerprints":
+        raise ValueError("Not a fingerprint snapshot")
+    return _fingerprint_from_list(data["root"]), data["mode"]
+
+
+def load_fingerprint_source(source, mode="names", workers=None):
+    # A source is a directory to scan, a saved fingerprint snapshot or a .tree diagram.
+    if os.path.isdir(source):
+        return compute_fingerprints(source, sorted(os.listdir(source)), mode, workers), mode
+    if source.endswith(".tree"):
+        with open(source, "r", encoding="utf-8") as f:
+            return fingerprints_from_tree_text(f.read()), "names"
+    with open(source, "r", encoding="utf-8") as f:
+        return load_fingerprints(f)
+
+
+def compare_sources(old_source, new_source, mode="names", workers=None):
+    old, old_mode = load_fingerprint_source(old_source, mode, workers)
+    new, new_mode = load_fingerprint_source(new_source, old_mode, workers)
+    if old_mode != new_mode:
+        old, old_mode = load_fingerprint_source(old_source, new_mode, workers)
+    if old_mode != new_mode:
+        raise ValueError(f"Cannot compare '{old_mode}' fingerprints with '{new_mode}' fingerprints")
+    return compare_fingerprints(old, new)
+
+
+# --- Snapshot Store ---
+_DATA_HOME = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+SNAPSHOT_DB = os.path.join(_DATA_HOME, "filetree", "snapshots.db")
+SnapshotInfo = namedtuple("SnapshotInfo", "id label root mode created entries")
+DiffEntry = namedtuple("DiffEntry", "status path is_dir old_path")
+DIFF_STATUSES = ("added", "removed", "moved", "type-changed", "changed")
+
+_SNAPSHOT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS snapshots (id INTEGER PRIMARY KEY, label TEXT, root TEXT NOT NULL, mode TEXT NOT NULL,
+                                      created REAL NOT NULL, entries INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS nodes (snapshot INTEGER NOT NULL, id INTEGER NOT NULL, parent INTEGER, name INTEGER NOT NULL,
+                                  is_dir INTEGER NOT NULL, digest, error TEXT,
+                                  PRIMARY KEY (snapshot, id)) WITHOUT ROWID;
+"""
+
+
+class SnapshotStore:
+    # Fingerprint trees of many scans in one SQLite file. Every path component is
+    # interned once in `names`, and a node row is just (parent, name id, type,
+    # digest), so a snapshot costs a few integers per entry. Directory digests are
+    # stored as 32-byte blobs; file digests (mode dependent) as text or NULL.
+    def __init__(self, path=SNAPSHOT_DB):
+        import sqlite3
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_SNAPSHOT_SCHEMA)
+        self._name_ids = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def _intern(self, names):
+        if self._name_ids is None:
+            self._name_ids = {name: name_id for name_id, name in self.db.execute("SELECT id, name FROM names")}
+        new = sorted(set(names) - self._name_ids.keys())
+        if new:
+            first = (self.db.execute("SELECT COALESCE(MAX(id), 0) FROM names").fetchone()[0]) + 1
+            self.db.executemany("INSERT INTO names (id, name) VALUES (?, ?)", enumerate(new, first))
+            self._name_ids.update(zip(new, itertools.count(first)))
+        return self._name_ids
+
+    def save(self, root, root_dir, mode, label=None):
+        rows = []
+        stack = [(root, None)]
+        while stack:
+            node, parent = stack.pop()
+            node_id = len(rows)
+            if node.is_dir:
+                digest = bytes.fromhex(node.digest)
+                stack.extend((child, node_id) for child in reversed(list(node.children.values())))
+            else:
+                digest = node.digest or None
+            rows.append((node_id, parent, node.name, node.is_dir, digest, node.error))
+        with self.db:
+            name_ids = self._intern(row[2] for row in rows)
+            snapshot_id = self.db.execute(
+                "INSERT INTO snapshots (label, root, mode, created, entries) VALUES (?, ?, ?, ?, ?)",
+                (label, os.path.abspath(root_dir), mode, time.time(), len(rows) - 1)).lastrowid
+            self.db.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                ((snapshot_id, node_id, parent, name_ids[name], is_dir, digest, error)
+                                 for node_id, parent, name, is_dir, digest, error in rows))
+        return snapshot_id
+
+    def snapshots(self, root_dir=None):
+        query = "SELECT id, label, root, mode, created, entries FROM snapshots"
+        params = ()
+        if root_dir is not None:
+            query += " WHERE root = ?"
+            params = (os.path.abspath(root_dir),)
+        return [SnapshotInfo(*row) for row in self.db.execute(query + " ORDER BY id", params)]
+
+    def find(self, ref):
+        # A snapshot id, or the newest snapshot with that label.
+        row = None
+        if str(ref).isdigit():
+            row = self.db.execute("SELECT id, label, root, mode, created, entries FROM snapshots WHERE id = ?",
+                                  (int(ref),)).fetchone()
+        if row is None:
+            row = self.db.execute("SELECT id, label, root, mode, created, entries FROM snapshots "
+                                  "WHERE label = ? ORDER BY id DESC LIMIT 1", (str(ref),)).fetchone()
+        if row is None:
+            raise KeyError(f"No snapshot '{ref}' in {self.path}")
+        return SnapshotInfo(*row)
+
+    def load(self, ref):
+        info = self.find(ref)
+        nodes = []
+        for node_id, parent, name, is_dir, digest, error in self.db.execute(
+                "SELECT n.id, n.parent, names.name, n.is_dir, n.digest, n.error FROM nodes n "
+                "JOIN names ON names.id = n.name WHERE n.snapshot = ? ORDER BY n.id", (info.id,)):
+            # Rows are in preorder, so a parent is always built before its children.
+            node = FingerprintNode(name, bool(is_dir), digest.hex() if is_dir else digest or "")
+            node.error = error
+            if parent is not None:
+                nodes[parent].children[name] = node
+            nodes.append(node)
+        return nodes[0], info
+
+
+def diff_trees(old, new):
+    # Structural diff of two fingerprint trees, sorted by path. Like
+    # compare_fingerprints it only descends where digests differ, so the work is
+    # proportional to the changed part of the tree. A whole subtree that appeared
+    # or vanished is reported once, at its top. A removed and an added entry with
+    # the same content (files also need the same name) become one "moved" entry
+    # when that pairing is unambiguous.
+    changes, removed, added = [], [], []
+    if old.digest != new.digest:
+        stack = [(iter(sorted(old.children.keys() | new.children.keys())), old, new, "")]
+    else:
+        stack = []
+    while stack:
+        names, a, b, base = stack[-1]
+        name = next(names, None)
+        if name is None:
+            stack.pop()
+            continue
+        path = f"{base}/{name}" if base else name
+        child_a = a.children.get(name)
+        child_b = b.children.get(name)
+        if child_b is None:
+            removed.append((path, child_a))
+        elif child_a is None:
+            added.append((path, child_b))
+        elif child_a.is_dir != child_b.is_dir:
+            changes.append(DiffEntry("type-changed", path, child_b.is_dir, None))
+        elif child_a.digest == child_b.digest:
+            continue
+        elif child_a.is_dir:
+            stack.append((iter(sorted(child_a.children.keys() | child_b.children.keys())), child_a, child_b, path))
+        else:
+            changes.append(DiffEntry("changed", path, False, None))
+
+    def content_key(node):
+        return (True, None, node.digest) if node.is_dir else (False, node.name, node.digest)
+
+    removed_keys = Counter(content_key(node) for path, node in removed)
+    added_keys = Counter(content_key(node) for path, node in added)
+    moved_from = {content_key(node): path for path, node in removed
+                  if removed_keys[content_key(node)] == 1 and added_keys[content_key(node)] == 1}
+    for path, node in added:
+        old_path = moved_from.pop(content_key(node), None)
+        changes.append(DiffEntry("added" if old_path is None else "moved", path, node.is_dir, old_path))
+    moved = {change.old_path for change in changes if change.status == "moved"}
+    changes.extend(DiffEntry("removed", path, node.is_dir, None) for path, node in removed if path not in moved)
+    changes.sort(key=lambda change: change.path.split("/"))
+    return changes
+
+
+def _diff_annotation(change, moved_to=False):
+    if change.status == "moved":
+        return f"  [moved to {change.path}]" if moved_to else f"  [moved from {change.old_path}]"
+    if change.status == "type-changed":
+        return "  [now a directory]" if change.is_dir else "  [now a file]"
+    return f"  [{change.status}]"
+
+
+def iter_diff_tree_lines(root_name, changes):
+    # The changed paths as an annotated tree, with their ancestors for context.
+    # A move shows up twice: at its old place and at its new one.
+    tree = {}
+    notes = {}
+    placed = [(change.path, change.is_dir, _diff_annotation(change)) for change in changes]
+    placed += [(change.old_path, change.is_dir, _diff_annotation(change, moved_to=True))
+               for change in changes if change.status == "moved"]
+    for path, is_dir, note in placed:
+        parent = tree
+        parts = path.split("/")
+        for part in parts[:-1]:
+            parent = parent.setdefault((part, True), {})
+        parent.setdefault((parts[-1], is_dir), {})
+        notes[path] = note
+
+    def ordered(subtree):
+        # Directories first, then files, each by name, as in a scan.
+        return _with_last(sorted(subtree.items(), key=lambda item: (not item[0][1], item[0][0])))
+
+    yield f"{root_name}/"
+    stack = [(ordered(tree), "")]
+    entries = []
+    while stack:
+        children, parent_rel = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            continue
+        ((name, is_dir), subtree), is_last = child
+        rel = f"{parent_rel}/{name}" if parent_rel else name
+        entries.append(TreeEntry(rel, rel, name, len(stack) - 1, is_dir, is_last, None, None, None, None))
+        if subtree:
+            stack.append((ordered(subtree), rel))
+    yield from iter_tree_lines(entries, annotate=lambda entry: notes.get(entry.rel, ""))
+
+
+def _diff_record(change):
+    record = {"status": change.status, "path": change.path, "type": "dir" if change.is_dir else "file"}
+    if change.old_path is not None:
+        record["from"] = change.old_path
+    return record
+
+
+def load_diff_source(source, mode="names", workers=None, db_path=SNAPSHOT_DB):
+    # Returns (tree, mode, root name). Existing paths go through
+    # load_fingerprint_source; anything else names a stored snapshot.
+    if os.path.exists(source):
+        root, mode = load_fingerprint_source(source, mode, workers)
+        return root, mode, os.path.basename(os.path.abspath(source))
+    with SnapshotStore(db_path) as store:
+        root, info = store.load(source)
+    return root, info.mode, os.path.basename(info.root)
+
+
+def diff_sources(old_source, new_source, mode="names", workers=None, db_path=SNAPSHOT_DB):
+    old, old_mode, old_name = load_diff_source(old_source, mode, workers, db_path)
+    new, new_mode, new_name = load_diff_source(new_source, old_mode, workers, db_path)
+    if old_mode != new_mode:
+        old, old_mode, old_name = load_diff_source(old_source, new_mode, workers, db_path)
+    if old_mode != new_mode:
+        raise ValueError(f"Cannot compare '{old_mode}' fingerprints with '{new_mode}' fingerprints")
+    return new_name, diff_trees(old, new)
+
+
+# --- Archive Export ---
+ARCHIVE_FORMATS = ("zip", "tar", "tar.gz", "tar.xz")
+ArchiveStats = namedtuple("ArchiveStats", "files reused bytes")
+COMPRESS_CHUNK_SIZE = 1024 * 1024
+DEFLATE_WINDOW = 32 * 1024
+
+
+def _deflate_block(data, history, level, last):
+    # Raw deflate of one block, primed with the previous 32 KiB so the blocks
+    # concatenate into a single valid stream (the pigz approach).
+    import zlib
+    if history:
+        comp = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=history)
+    else:
+        comp = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return comp.compress(data) + comp.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _xz_block(data, level):
+    # Each block becomes its own xz stream; concatenated streams are valid .xz.
+    import lzma
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+
+class _OrderedPool:
+    # Compression jobs run on a thread pool (zlib and lzma release the GIL) while
+    # their callbacks fire strictly in submission order, so output stays sequential.
+    def __init__(self, workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+        workers = workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.limit = 2 * workers
+        self.queue = deque()
+        self.in_flight = 0
+
+    def push(self, callback, fn=None, *args):
+        future = self.executor.submit(fn, *args) if fn else None
+        self.queue.append((future, callback))
+        if future is not None:
+            self.in_flight += 1
+        while self.in_flight >= self.limit:
+            self._pop()
+
+    def _pop(self):
+        future, callback = self.queue.popleft()
+        if future is None:
+            callback(None)
+        else:
+            self.in_flight -= 1
+            callback(future.result())
+
+    def flush(self):
+        while self.queue:
+            self._pop()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+
+class ParallelCompressedStream:
+    # Write-only file object producing a gzip or xz stream from blocks compressed
+    # concurrently. Memory is bounded by the number of blocks in flight.
+    def __init__(self, fileobj, codec, level=6, workers=None):
+        self.fileobj = fileobj
+        self.codec = codec
+        self.level = level
+        self.pool = _OrderedPool(workers)
+        self.chunk_size = COMPRESS_CHUNK_SIZE * (4 if codec == "xz" else 1)
+        self.buffer = bytearray()
+        self.history = b""
+        self.crc = 0
+        self.size = 0
+        if codec == "gz":
+            import struct
+            fileobj.write(b"\x1f\x8b\x08\x00" + struct.pack("<I", int(time.time())) + b"\x00\xff")
+
+    def write(self, data):
+        import zlib
+        self.buffer += data
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        while len(self.buffer) > self.chunk_size:
+            block = bytes(self.buffer[:self.chunk_size])
+            del self.buffer[:self.chunk_size]
+            self._submit(block, False)
+        return len(data)
+
+    def _submit(self, block, last):
+        if self.codec == "xz":
+            self.pool.push(self.fileobj.write, _xz_block, block, self.level)
+        else:
+            self.pool.push(self.fileobj.write, _deflate_block, block, self.history, self.level, last)
+            self.history = block[-DEFLATE_WINDOW:]
+
+    def close(self):
+        if self.codec == "gz" or self.buffer or not self.size:
+            self._submit(bytes(self.buffer), True)
+        self.buffer.clear()
+        self.pool.close()
+        if self.codec == "gz":
+            import struct
+            self.fileobj.write(struct.pack("<II", self.crc & 0xFFFFFFFF, self.size & 0xFFFFFFFF))
+
+
+def _queue_zip_member(zf, pool, path, zinfo, level):
+    import zipfile
+    import zlib
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = 0
+    zinfo.compress_size = 0
+    zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+
+    def start(_):
+        zinfo.header_offset = zf.fp.tell()
+        zf.fp.write(zinfo.FileHeader(zip64))
+
+    def data(block):
+        zf.fp.write(block)
+        zinfo.compress_size += len(block)
+
+    pool.push(start)
+    crc = size = 0
+    history = b""
+    with open(path, "rb") as f:
+        block = f.read(COMPRESS_CHUNK_SIZE)
+        while True:
+            following = f.read(COMPRESS_CHUNK_SIZE) if len(block) == COMPRESS_CHUNK_SIZE else b""
+            last = not following
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            pool.push(data, _deflate_block, block, history, level, last)
+            if last:
+                break
+            history = block[-DEFLATE_WINDOW:]
+            block = following
+
+    def finish(_):
+        # Same idea as zipfile's own writer: patch the local header once sizes are known.
+        zinfo.CRC = crc
+        zinfo.file_size = size
+        end = zf.fp.tell()
+        zf.fp.seek(zinfo.header_offset)
+        zf.fp.write(zinfo.FileHeader(zip64))
+        zf.fp.seek(end)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        zf.start_dir = end
+
+    pool.push(finish)
+    return size
+
+
+def _same_zip_stat(old, new):
+    # Zip timestamps have two-second resolution.
+    return (old.file_size == new.file_size and old.date_time[:5] == new.date_time[:5]
+            and old.date_time[5] // 2 == new.date_time[5] // 2)
+
+
+def _strip_zip64_extra(extra):
+    # FileHeader() appends its own zip64 field, so drop the one read from the old archive.
+    import struct
+    kept = []
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, length = struct.unpack("<HH", extra[offset:offset + 4])
+        if header_id != 1:
+            kept.append(extra[offset:offset + 4 + length])
+        offset += 4 + length
+    return b"".join(kept)
+
+
+def _queue_zip_copy(zf, pool, old_zf, old_info):
+    # Copies an unchanged member's compressed bytes from the previous archive as-is.
+    import copy
+    import struct
+    import zipfile
+    zinfo = copy.copy(old_info)
+    zinfo.flag_bits &= ~0x08
+    zinfo.extra = _strip_zip64_extra(zinfo.extra)
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+
+    def copy_member(_):
+        old_zf.fp.seek(old_info.header_offset)
+        header = struct.unpack(zipfile.structFileHeader, old_zf.fp.read(zipfile.sizeFileHeader))
+        old_zf.fp.seek(header[10] + header[11], os.SEEK_CUR)
+        zinfo.header_offset = zf.fp.tell()
+        zf.fp.write(zinfo.FileHeader(zip64))
+        remaining = zinfo.compress_size
+        while remaining:
+            block = old_zf.fp.read(min(remaining, COMPRESS_CHUNK_SIZE))
+            if not block:
+                raise zipfile.BadZipFile(f"Truncated member in previous archive: {zinfo.filename}")
+            zf.fp.write(block)
+            remaining -= len(block)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        zf.start_dir = zf.fp.tell()
+
+    pool.push(copy_member)
+
+
+def _zip_link_info(path, arcname):
+    # Zip has no link type; Info-ZIP stores the mode in external_attr and the target
+    # as the member's data.
+    import zipfile
+    st = os.lstat(path)
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[:6])
+    zinfo.create_system = 3
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    return zinfo, os.readlink(path)
+
+
+def _write_zip(out_path, members, level, workers, previous=None):
+    import zipfile
+    pool = _OrderedPool(workers)
+    files = reused = total = 0
+    with zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        try:
+            for path, arcname in members:
+                if os.path.islink(path):
+                    zinfo, target = _zip_link_info(path, arcname)
+                    pool.push(lambda _, z=zinfo, t=target: zf.writestr(z, t, zipfile.ZIP_STORED))
+                    continue
+                zinfo = zipfile.ZipInfo.from_file(path, arcname)
+                if zinfo.is_dir():
+                    pool.push(lambda _, p=path, a=arcname: zf.write(p, a))
+                    continue
+                old_info = previous.NameToInfo.get(zinfo.filename) if previous else None
+                if old_info is not None and _same_zip_stat(old_info, zinfo):
+                    _queue_zip_copy(zf, pool, previous, old_info)
+                    reused += 1
+                else:
+                    total += _queue_zip_member(zf, pool, path, zinfo, level)
+                    files += 1
+        finally:
+            pool.close()
+    return ArchiveStats(files, reused, total)
+
+
+def _write_tar(out_path, members, fmt, level, workers):
+    import tarfile
+    files = total = 0
+    with open(out_path, "wb") as raw:
+        stream = raw if fmt == "tar" else ParallelCompressedStream(raw, fmt.rsplit(".", 1)[1], level, workers)
+        with tarfile.open(fileobj=stream, mode="w|") as tar:
+            for path, arcname in members:
+                tarinfo = tar.gettarinfo(path, arcname)
+                if tarinfo.isreg():
+                    with open(path, "rb") as f:
+                        tar.addfile(tarinfo, f)
+                    files += 1
+                    total += tarinfo.size
+                else:
+                    tar.addfile(tarinfo)
+        if stream is not raw:
+            stream.close()
+    return ArchiveStats(files, 0, total)
+
+
+def write_archive(out_path, members, fmt="zip", level=6, workers=None, update=False):
+    # members yields (filesystem path, archive name) pairs, parents before children.
+    # With update, an existing zip at out_path is rewritten reusing the compressed
+    # data of members whose size and mtime are unchanged.
+    import zipfile
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format: {fmt}")
+    if fmt != "zip":
+        return _write_tar(out_path, members, fmt, level, workers)
+    if not (update and zipfile.is_zipfile(out_path)):
+        return _write_zip(out_path, members, level, workers)
+    temp_path = f"{out_path}.partial"
+    try:
+        with zipfile.ZipFile(out_path, "r") as previous:
+            stats = _write_zip(temp_path, members, level, workers, previous)
+        os.replace(temp_path, out_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return stats
+
+
+def iter_dir_members(base_dir):
+    for current, dirs, files in os.walk(base_dir):
+        dirs.sort()
+        rel = os.path.relpath(current, base_dir)
+        if rel != ".":
+            yield current, rel
+        for name in sorted(files):
+            yield os.path.join(current, name), os.path.join(rel, name) if rel != "." else name
+
+
+def export_tree_archive(paths, out_path, fmt="zip", level=6, workers=None):
+    import tempfile
+    with tempfile.TemporaryDirectory() as temp_dir:
+        build_structure(paths, temp_dir)
+        return write_archive(out_path, iter_dir_members(temp_dir), fmt, level, workers)
+
+
+def iter_scan_members(root_dir, selected_items, **scan_options):
+    # Links are archived as links, never followed, so each file is stored once under
+    # its real path.
+    if scan_options.get("symlinks") != "never":
+        scan_options["symlinks"] = "show"
+    root_name = os.path.basename(os.path.abspath(root_dir))
+    yield root_dir, root_name
+    for entry in scan_entries(root_dir, selected_items, **scan_options):
+        if not entry.error and (entry.is_dir or os.path.isfile(entry.path) or os.path.islink(entry.path)):
+            yield entry.path, f"{root_name}/{entry.rel}"
+
+
+def export_directory_archive(root_dir, selected_items, out_path, fmt="zip", level=6, workers=None, **scan_options):
+    # Archives the real contents of the scanned items. File data is streamed in
+    # COMPRESS_CHUNK_SIZE blocks; an existing zip is updated incrementally.
+    members = iter_scan_members(root_dir, selected_items, **scan_options)
+    return write_archive(out_path, members, fmt, level, workers, update=True)
+
+
+# --- Tree Server ---
+SERVER_SOCKET = os.path.join(os.environ.get("TMPDIR", "/tmp"), f"filetree-{getattr(os, 'getuid', lambda: 0)()}.sock")
+JSONRPC_PARSE_ERROR = -32700
+JSONRPC_INVALID_REQUEST = -32600
+JSONRPC_METHOD_NOT_FOUND = -32601
+JSONRPC_INVALID_PARAMS = -32602
+JSONRPC_SERVER_ERROR = -32000
+
+
+class LRUCache:
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+def _path_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return -1
+
+
+class TreeServer:
+    # JSON-RPC 2.0 over a Unix-domain socket, one message per line. Connections are
+    # served from a thread pool. Scans stay cached until the mtime of a directory
+    # they listed (or, for sized scans, of any entry) changes; presets and .tree
+    # files come parsed from the preset registry.
+    def __init__(self, socket_path=SERVER_SOCKET, workers=None, cache_size=32):
+        from concurrent.futures import ThreadPoolExecutor
+        self.socket_path = socket_path
+        self.scans = LRUCache(cache_size)
+        self.parsed = LRUCache(cache_size * 4)
+        self.pool = ThreadPoolExecutor(workers or min(32, (os.cpu_count() or 1) + 4))
+        self.methods = {"generate": self.generate, "parse": self.parse, "lint": self.lint, "build": self.build,
+                        "export": self.export, "stats": self.stats, "shutdown": self.shutdown}
+        self._stopping = threading.Event()
+
+    def serve_forever(self):
+        import socket
+        if not hasattr(socket, "AF_UNIX"):
+            raise OSError("Unix-domain sockets are not available on this platform")
+        if os.path.exists(self.socket_path):
+            try:
+                call_server("stats", socket_path=self.socket_path, timeout=1)
+            except OSError:
+                os.unlink(self.socket_path)
+            else:
+                raise OSError(f"A server is already listening on {self.socket_path}")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.socket_path)
+            os.chmod(self.socket_path, 0o600)
+            listener.listen(64)
+            listener.settimeout(0.5)
+            while not self._stopping.is_set():
+                try:
+                    conn, _ = listener.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                self.pool.submit(self._serve_connection, conn)
+        finally:
+            listener.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.pool.shutdown(wait=True)
+
+    def _serve_connection(self, conn):
+        with conn, conn.makefile("rb") as reader, conn.makefile("wb") as writer:
+            for line in reader:
+                if not line.strip():
+                    continue
+                response = self.handle_message(line)
+                if response is not None:
+                    writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+                    writer.flush()
+
+    def handle_message(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            return _rpc_error(None, JSONRPC_PARSE_ERROR, f"Parse error: {e}")
+        if isinstance(message, list):
+            if not message:
+                return _rpc_error(None, JSONRPC_INVALID_REQUEST, "Invalid request: empty batch")
+            responses = [r for r in map(self.dispatch, message) if r is not None]
+            return responses or None
+        return self.dispatch(message)
+
+    def dispatch(self, request):
+        import inspect
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return _rpc_error(None, JSONRPC_INVALID_REQUEST, "Invalid request")
+        # A request without an id is a notification: it is carried out, but nothing
+        # is sent back, not even an error.
+        notification = "id" not in request
+        request_id = request.get("id")
+
+        def fail(code, message):
+            return None if notification else _rpc_error(request_id, code, message)
+
+        method = self.methods.get(request["method"])
+        if method is None:
+            return fail(JSONRPC_METHOD_NOT_FOUND, f"Unknown method: {request['method']}")
+        params = request.get("params") or {}
+        try:
+            if not isinstance(params, dict):
+                raise TypeError("params must be an object")
+            inspect.signature(method).bind(**params)
+        except TypeError as e:
+            return fail(JSONRPC_INVALID_PARAMS, str(e))
+        try:
+            result = method(**params)
+        except Exception as e:
+            return fail(JSONRPC_SERVER_ERROR, f"{type(e).__name__}: {e}")
+        if notification:
+            return None
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    def _scan(self, root, items, with_stat, **scan_options):
+        root = os.path.abspath(root)
+        items = tuple(items) if items is not None else tuple(sorted(os.listdir(root)))
+        key = (root, items, with_stat, json.dumps(scan_options, sort_keys=True))
+        cached = self.scans.get(key)
+        if cached is not None:
+            stamp_paths, stamps, entries, renders = cached
+            if all(_path_mtime(path) == stamp for path, stamp in zip(stamp_paths, stamps)):
+                return root, entries, renders
+        entries = list(scan_entries(root, list(items), with_stat=with_stat, **scan_options))
+        stamp_paths = [root]
+        stamp_paths.extend(e.path for e in entries if not e.error and (with_stat or e.is_dir))
+        if scan_options.get("source", "filesystem") != "filesystem":
+            git_dir = find_git_worktree(root)[1]
+            if git_dir:
+                stamp_paths.append(os.path.join(git_dir, "index"))
+        renders = {}
+        self.scans.put(key, (stamp_paths, array("q", map(_path_mtime, stamp_paths)), entries, renders))
+        return root, entries, renders
+
+    def _parsed(self, tree=None, source=None, checked=False):
+        # Returns (paths, problems). Presets and .tree files are cached, already
+        # validated, by the preset registry, which also notices when they change.
+        # Raw tree text is cached here and only validated once something asks.
+        if tree is None:
+            if source is None:
+                raise ValueError("Pass either tree text or a source")
+            return load_tree(source)
+        entry = self.parsed.get(tree)
+        if entry is None:
+            entry = [parse_tree(tree), None]
+            self.parsed.put(tree, entry)
+        if checked and entry[1] is None:
+            entry[1] = validate_tree(tree)
+        return entry[0], entry[1]
+
+    def generate(self, root, items=None, sizes=False, sort_size=False, top=0, ignore=None, max_depth=None,
+                 symlinks="once", one_file_system=False, scan_source="filesystem"):
+        root, entries, renders = self._scan(root, items, sizes, ignore=ignore, max_depth=max_depth,
+                                            symlinks=symlinks, one_file_system=one_file_system, source=scan_source)
+        # Rendered text is kept alongside the scan, so it is dropped with it.
+        text = renders.get((sort_size, top))
+        if text is None:
+            if sizes:
+                size_root = rollup_sizes(root, entries)
+                text = render_sized_tree(size_root, sort_size)
+                if top:
+                    text += "\n\n" + format_largest_report(size_root, top)
+            else:
+                text = "\n".join(itertools.chain([f"{os.path.basename(root)}/"], iter_tree_lines(entries)))
+            renders[(sort_size, top)] = text
+        return text
+
+    def parse(self, tree=None, source=None):
+        return self._parsed(tree, source)[0]
+
+    def lint(self, tree=None, source=None):
+        return [problem._asdict() for problem in self._parsed(tree, source, checked=True)[1]]
+
+    def build(self, dest, tree=None, source=None, variables=None, cached=False, hardlink=False):
+        paths, problems = self._parsed(tree, source, checked=True)
+        if problems:
+            raise TreeValidationError(problems)
+        if cached:
+            return {"created": len(paths), "methods": build_structure_cached(paths, dest, variables, hardlink=hardlink)}
+        build_structure(paths, dest, variables)
+        return {"created": len(paths)}
+
+    def export(self, source, output, format="zip", level=6, workers=None, ignore=None, max_depth=None,
+               symlinks="once", one_file_system=False, scan_source="filesystem"):
+        if os.path.isdir(source):
+            stats = export_directory_archive(source, sorted(os.listdir(source)), output, format, level, workers,
+                                             ignore=ignore, max_depth=max_depth, symlinks=symlinks,
+                                             one_file_system=one_file_system, source=scan_source)
+        else:
+            stats = export_tree_archive(self._parsed(source=source)[0], output, format, level, workers)
+        return stats._asdict()
+
+    def stats(self):
+        return {"scans": len(self.scans), "scan_hits": self.scans.hits, "scan_misses": self.scans.misses,
+                "parsed": len(self.parsed), "parse_hits": self.parsed.hits, "parse_misses": self.parsed.misses}
+
+    def shutdown(self):
+        self._stopping.set()
+        return "stopping"
+
+
+def _rpc_error(request_id, code, message):
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+
+def call_server(method, params=None, socket_path=SERVER_SOCKET, timeout=None):
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        request = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params or {}}
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError("Server closed the connection without replying")
+    response = json.loads(line)
+    if "error" in response:
+        raise RuntimeError(response["error"]["message"])
+    return response["result"]
+
+
+# --- Tree Viewer ---
+TREE_PREFIX_CHARS = "│├└─ "
+
+
+class LineStore:
+    # Lines of a rendered tree held as one newline-joined string plus an offsets
+    # array, so a multi-million-line tree costs its text and 8 bytes per line.
+    def __init__(self, lines=()):
+        lines = list(lines)
+        self.text = "\n".join(lines) + "\n"
+        self.offsets = array("q", itertools.accumulate((len(line) + 1 for line in lines), initial=0))
+        self._end_patterns = {}
+
+    @classmethod
+    def from_text(cls, text):
+        text = text.strip("\n")
+        return cls(text.split("\n") if text else ())
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def line(self, i):
+        return self.text[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def join(self, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        return self.text[self.offsets[start]:self.offsets[stop] - 1] if start < stop else ""
+
+    def lines(self, start, stop):
+        return self.join(start, stop).split("\n") if start < min(stop, len(self)) else []
+
+    def name_column(self, i):
+        line = self.line(i)
+        return len(line) - len(line.lstrip(TREE_PREFIX_CHARS))
+
+    def subtree_end(self, i):
+        # Lines below i belong to its subtree while their name starts right of
+        # i's; the first line with fewer than column + 1 prefix characters ends it.
+        column = self.name_column(i)
+        if column == 0:
+            return len(self)
+        pattern = self._end_patterns.get(column)
+        if pattern is None:
+            pattern = self._end_patterns[column] = re.compile(f"\n(?![{TREE_PREFIX_CHARS}]{{{column + 1}}})")
+        match = pattern.search(self.text, self.offsets[i + 1] - 1)
+        return bisect.bisect_right(self.offsets, match.start() + 1) - 1
+
+    def subtree_text(self, i):
+        # The subtree rooted at line i, re-indented so line i becomes the root.
+        end = self.subtree_end(i)
+        column = self.name_column(i)
+        if column == 0:
+            return self.join(i, end)
+        return "\n".join(line[column:] for line in self.lines(i, end))
+
+
+class VirtualTreeView:
+    # Read-only view over a LineStore. The Text widget only ever holds the visible
+    # rows plus MARGIN lines either side; scrolling past them re-renders the window.
+    # It wraps its Frame rather than subclassing it, so defining the class does not
+    # need tkinter.
+    MARGIN = 100
+
+    def __init__(self, master, height=15, **kwargs):
+        self.frame = tk.Frame(master, **kwargs)
+        self.store = LineStore()
+        self.top = 0
+        self.selected = None
+        self.window = (0, 0)
+        self.text = tk.Text(self.frame, height=height, wrap=tk.NONE, state=tk.DISABLED, cursor="arrow")
+        self.linespace = self._measure_linespace()
+        self.scrollbar = tk.Scrollbar(self.frame, command=self._on_scrollbar)
+        self.xscrollbar = tk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self.text.xview)
+        self.text["xscrollcommand"] = self.xscrollbar.set
+        self.text.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.xscrollbar.grid(row=1, column=0, sticky="ew")
+        self.frame.grid_rowconfigure(0, weight=1)
+        self.frame.grid_columnconfigure(0, weight=1)
+        self.text.tag_config("dir", foreground="blue", font=("TkDefaultFont", 9, "bold"))
+        self.text.tag_config("file", foreground="green")
+        self.text.tag_config("error", foreground="red")
+        self.text.tag_config("selected", background="#cde4ff")
+        self.text.bind("<MouseWheel>", lambda e: self._scroll_by(-3 if e.delta > 0 else 3, "units"))
+        self.text.bind("<Button-4>", lambda e: self._scroll_by(-3, "units"))
+        self.text.bind("<Button-5>", lambda e: self._scroll_by(3, "units"))
+        self.text.bind("<Up>", lambda e: self._scroll_by(-1, "units"))
+        self.text.bind("<Down>", lambda e: self._scroll_by(1, "units"))
+        self.text.bind("<Prior>", lambda e: self._scroll_by(-1, "pages"))
+        self.text.bind("<Next>", lambda e: self._scroll_by(1, "pages"))
+        self.text.bind("<Home>", lambda e: self.scroll_to(0) or "break")
+        self.text.bind("<End>", lambda e: self.scroll_to(len(self.store)) or "break")
+        self.text.bind("<Button-1>", self._on_click)
+        self.text.bind("<Configure>", lambda e: self.scroll_to(self.top))
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def set_store(self, store):
+        self.store = store
+        self.top = 0
+        self.selected = None
+        self.window = (0, 0)
+        self.scroll_to(0)
+
+    def set_font(self, font):
+        self.text.configure(font=font)
+        self.linespace = self._measure_linespace()
+        self.window = (0, 0)
+        self.scroll_to(self.top)
+
+    def _measure_linespace(self):
+        # Measured once per font; rows() runs on every scroll step.
+        return max(tkfont.Font(font=self.text.cget("font")).metrics("linespace"), 1)
+
+    def rows(self):
+        height = self.text.winfo_height()
+        if height <= 1:
+            return int(self.text.cget("height"))
+        return max(height // self.linespace, 1)
+
+    def scroll_to(self, top):
+        rows = self.rows()
+        self.top = max(0, min(top, len(self.store) - rows))
+        start, end = self.window
+        if not (start <= self.top and self.top + rows <= end) or end == 0:
+            self._render(rows)
+        self.text.yview(f"{self.top - self.window[0] + 1}.0")
+        total = max(len(self.store), 1)
+        self.scrollbar.set(self.top / total, min((self.top + rows) / total, 1.0))
+
+    def _scroll_by(self, amount, what):
+        self.scroll_to(self.top + amount * (self.rows() if what == "pages" else 1))
+        return "break"
+
+    def _on_scrollbar(self, action, amount, what=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.store)))
+        else:
+            self._scroll_by(int(amount), what)
+
+    def _render(self, rows):
+        start = max(0, self.top - self.MARGIN)
+        end = min(len(self.store), self.top + rows + self.MARGIN)
+        self.window = (start, end)
+        self.text.configure(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", self.store.join(start, end))
+        for row, line in enumerate(self.store.lines(start, end), 1):
+            clean = line.lstrip(TREE_PREFIX_CHARS)
+            tag = "error" if clean.startswith("<") else "dir" if "/" in clean else "file"
+            self.text.tag_add(tag, f"{row}.0", f"{row}.end")
+        if self.selected is not None and start <= self.selected < end:
+            row = self.selected - start + 1
+            self.text.tag_add("selected", f"{row}.0", f"{row}.end")
+        self.text.configure(state=tk.DISABLED)
+
+    def _on_click(self, event):
+        self.text.focus_set()
+        row = int(self.text.index(f"@{event.x},{event.y}").split(".")[0])
+        line = self.window[0] + row - 1
+        if line >= len(self.store):
+            return
+        self.selected = line
+        self.text.tag_remove("selected", "1.0", tk.END)
+        self.text.tag_add("selected", f"{row}.0", f"{row}.end")
+
+    def selected_text(self):
+        # Subtree under the selected line, or the whole tree with nothing selected.
+        return self.store.subtree_text(self.selected if self.selected is not None else 0)
+
+
+class FileTreeManagerGUI:
+    def __init__(self, master):
+        _import_tk()
+        self.master = master
+        master.title("FileTree Manager")
+        master.geometry("900x800")
+        master.resizable(True, True)
+
+        # Dark mode state
+        self.dark_mode = False
+        self.bg_light = "SystemButtonFace"
+        self.fg_light = "#000000"
+        self.bg_dark = "#2e2e2e"
+        self.fg_dark = "#ffffff"
+
+        # Configure grid weights
+        master.grid_rowconfigure(0, weight=0)  # Menu bar
+        master.grid_rowconfigure(1, weight=0)  # Input frame
+        master.grid_rowconfigure(2, weight=0)  # Listbox label
+        master.grid_rowconfigure(3, weight=1)  # Listbox
+        master.grid_rowconfigure(4, weight=1)  # Tabbed interface
+        master.grid_rowconfigure(5, weight=0)  # Output label
+        master.grid_rowconfigure(6, weight=1)  # Output area
+        master.grid_rowconfigure(7, weight=0)  # Status bar
+        master.grid_columnconfigure(0, weight=1)
+        master.grid_columnconfigure(1, weight=0)
+
+        # Menu bar
+        self.menu_bar = tk.Menu(master)
+        master.config(menu=self.menu_bar)
+        self.presets_menu = tk.Menu(self.menu_bar, tearoff=0, postcommand=self._fill_presets_menu)
+        self._presets_menu_generation = None
+        self.menu_bar.add_cascade(label="Presets", menu=self.presets_menu)
+        self.menu_bar.add_command(label="Toggle Dark Mode", command=self._toggle_dark_mode)
+        self.menu_bar.add_command(label="Save Preset", command=self._save_preset)
+        self.menu_bar.add_command(label="Load Preset", command=self._load_preset_file)
+
+        # Input Frame (Directory Selection)
+        self.input_frame = tk.LabelFrame(master, text="Select Root Directory", padx=10, pady=10)
+        self.input_frame.grid(row=1, column=0, padx=10, pady=10, sticky="ew", columnspan=2)
+        self.input_frame.grid_columnconfigure(0, weight=1)
+        self.input_frame.grid_columnconfigure(1, weight=0)
+
+        self.directory_label = tk.Label(self.input_frame, text="Selected Directory:")
+        self.directory_label.grid(row=0, column=0, sticky="w", pady=5)
+        self.directory_entry = tk.Entry(self.input_frame, width=70)
+        self.directory_entry.grid(row=1, column=0, sticky="ew", padx=5, pady=5)
+        self.directory_entry.insert(0, os.path.expanduser("~") if os.name == 'posix' else os.getcwd())
+        self.browse_button = tk.Button(self.input_frame, text="Browse", command=self._browse_directory)
+        self.browse_button.grid(row=1, column=1, sticky="e", padx=5, pady=5)
+
+        # Items to Include Listbox
+        self.include_label = tk.Label(master, text="Items to Include (Select multiple with Ctrl/Shift):")
+        self.include_label.grid(row=2, column=0, sticky="nw", padx=10, pady=(0, 5))
+        self.file_listbox = tk.Listbox(master, selectmode=tk.MULTIPLE, height=10)
+        self.file_listbox.grid(row=3, column=0, sticky="nsew", padx=10, pady=(0, 10))
+        self.listbox_scrollbar = tk.Scrollbar(master, command=self.file_listbox.yview)
+        self.listbox_scrollbar.grid(row=3, column=1, sticky="ns", pady=(0, 10))
+        self.file_listbox['yscrollcommand'] = self.listbox_scrollbar.set
+
+        # Tabbed Interface
+        self.notebook = ttk.Notebook(master)
+        self.notebook.grid(row=4, column=0, columnspan=2, padx=10, pady=10, sticky="nsew")
+
+        # Tree Generation Tab
+        self.tree_tab = tk.Frame(self.notebook)
+        self.notebook.add(self.tree_tab, text="Generate Tree")
+        self.generate_button = tk.Button(self.tree_tab, text="Generate Tree Diagram", command=self._generate_tree)
+        self.generate_button.pack(pady=10)
+        self.scan_frame = tk.Frame(self.tree_tab)
+        self.scan_frame.pack(pady=(0, 10))
+        tk.Label(self.scan_frame, text="Export format:").grid(row=0, column=0, padx=5)
+        self.scan_format_var = tk.StringVar(value=SCAN_FORMATS[0])
+        ttk.Combobox(self.scan_frame, textvariable=self.scan_format_var, values=SCAN_FORMATS,
+                     state="readonly", width=8).grid(row=0, column=1, padx=5)
+        tk.Button(self.scan_frame, text="Export Scan", command=self._export_scan).grid(row=0, column=2, padx=5)
+        tk.Button(self.scan_frame, text="Generate to File...",
+                  command=self._generate_to_file).grid(row=0, column=3, padx=5)
+        self.show_sizes_var = tk.BooleanVar(value=False)
+        self.sort_by_size_var = tk.BooleanVar(value=False)
+        self.top_n_var = tk.IntVar(value=10)
+        tk.Checkbutton(self.scan_frame, text="Show sizes", variable=self.show_sizes_var).grid(row=1, column=0, padx=5)
+        tk.Checkbutton(self.scan_frame, text="Sort by size", variable=self.sort_by_size_var).grid(row=1, column=1, padx=5)
+        tk.Label(self.scan_frame, text="Top N:").grid(row=1, column=2, sticky="e", padx=5)
+        tk.Spinbox(self.scan_frame, from_=1, to=100, width=5, textvariable=self.top_n_var).grid(row=1, column=3, padx=5)
+        tk.Label(self.scan_frame, text="Fingerprint:").grid(row=2, column=0, padx=5)
+        self.fingerprint_mode_var = tk.StringVar(value=FINGERPRINT_MODES[0])
+        ttk.Combobox(self.scan_frame, textvariable=self.fingerprint_mode_var, values=FINGERPRINT_MODES,
+                     state="readonly", width=8).grid(row=2, column=1, padx=5)
+        tk.Button(self.scan_frame, text="Save Fingerprints",
+                  command=self._save_fingerprints).grid(row=2, column=2, padx=5)
+        tk.Button(self.scan_frame, text="Compare With...",
+                  command=self._compare_fingerprints).grid(row=2, column=3, padx=5)
+        tk.Label(self.scan_frame, text="Ignore:").grid(row=3, column=0, padx=5)
+        self.ignore_entry = tk.Entry(self.scan_frame, width=30)
+        self.ignore_entry.grid(row=3, column=1, columnspan=2, sticky="ew", padx=5)
+        self.max_depth_var = tk.IntVar(value=0)
+        tk.Label(self.scan_frame, text="Max depth (0 = all):").grid(row=3, column=3, padx=5)
+        tk.Spinbox(self.scan_frame, from_=0, to=999, width=5, textvariable=self.max_depth_var).grid(row=3, column=4, padx=5)
+        tk.Label(self.scan_frame, text="Symlinks:").grid(row=5, column=0, padx=5)
+        self.symlink_policy_var = tk.StringVar(value=SYMLINK_POLICIES[0])
+        ttk.Combobox(self.scan_frame, textvariable=self.symlink_policy_var, values=SYMLINK_POLICIES,
+                     state="readonly", width=8).grid(row=5, column=1, padx=5)
+        self.one_file_system_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.scan_frame, text="Stay on one file system",
+                       variable=self.one_file_system_var).grid(row=5, column=2, columnspan=2, padx=5)
+        tk.Label(self.scan_frame, text="Source:").grid(row=6, column=0, padx=5)
+        self.scan_source_var = tk.StringVar(value=SCAN_SOURCES[0])
+        ttk.Combobox(self.scan_frame, textvariable=self.scan_source_var, values=SCAN_SOURCES,
+                     state="readonly", width=12).grid(row=6, column=1, padx=5)
+        self.profile_scan_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.scan_frame, text="Profile scan (slowest directories)",
+                       variable=self.profile_scan_var).grid(row=6, column=2, columnspan=2, padx=5)
+        self.scan_concurrency_var = tk.IntVar(value=1)
+        tk.Label(self.scan_frame, text="Parallel listings:").grid(row=7, column=0, padx=5)
+        tk.Spinbox(self.scan_frame, from_=1, to=256, width=5,
+                   textvariable=self.scan_concurrency_var).grid(row=7, column=1, padx=5)
+        tk.Button(self.scan_frame, text="Save Snapshot", command=self._save_snapshot).grid(row=7, column=2, padx=5)
+        tk.Button(self.scan_frame, text="Diff With Last Snapshot",
+                  command=self._diff_last_snapshot).grid(row=7, column=3, padx=5)
+        self.async_loop = AsyncLoopThread()
+        tk.Label(self.scan_frame, text="Snapshot format:").grid(row=4, column=0, padx=5)
+        self.snapshot_format_var = tk.StringVar(value=ARCHIVE_FORMATS[0])
+        ttk.Combobox(self.scan_frame, textvariable=self.snapshot_format_var, values=ARCHIVE_FORMATS,
+                     state="readonly", width=8).grid(row=4, column=1, padx=5)
+        tk.Button(self.scan_frame, text="Archive Snapshot",
+                  command=self._export_snapshot).grid(row=4, column=2, padx=5)
+
+        # Generated tree viewer: only the visible window lives in the widget
+        self.tree_store = LineStore()
+        self._editor_store = self.tree_store
+        self.viewer_frame = tk.Frame(self.tree_tab)
+        self.viewer_frame.pack(fill=tk.X, padx=10)
+        tk.Button(self.viewer_frame, text="Copy Selection",
+                  command=self._copy_generated).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.viewer_frame, text="Open Selection in Editor",
+                  command=self._open_generated_in_editor).pack(side=tk.LEFT, padx=5)
+        self.load_editor_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.viewer_frame, text="Load generated tree into editor",
+                       variable=self.load_editor_var).pack(side=tk.LEFT, padx=5)
+        self.tree_view = VirtualTreeView(self.tree_tab, height=12)
+        self.tree_view.pack(fill=tk.BOTH, expand=True, padx=10, pady=(5, 10))
+
+        # Tree Editing/Building Tab: its widgets are created the first time it is needed
+        self.build_tab = tk.Frame(self.notebook)
+        self.notebook.add(self.build_tab, text="Edit & Build Tree")
+        self._build_tab_ready = False
+        self._editor_parse = None
+        self.notebook.bind("<<NotebookTabChanged>>", self._on_tab_changed)
+
+        # Output Area
+        self.output_label = tk.Label(master, text="Output Log:")
+        self.output_label.grid(row=5, column=0, sticky="nw", padx=10, pady=(10, 0))
+        self.output_text = scrolledtext.ScrolledText(master, wrap=tk.WORD, height=15, width=100)
+        self.output_text.grid(row=6, column=0, sticky="nsew", padx=10, pady=(5, 10), columnspan=2)
+        self.output_scrollbar = tk.Scrollbar(master, command=self.output_text.yview)
+        self.output_scrollbar.grid(row=6, column=2, sticky="ns", pady=(5, 10))
+        self.output_text['yscrollcommand'] = self.output_scrollbar.set
+
+        # Tree Filter
+        self.search_index = None
+        self._indexed_text = None
+        self._filter_job = None
+        self.filter_frame = tk.Frame(self.viewer_frame)
+        self.filter_frame.pack(side=tk.RIGHT)
+        tk.Label(self.filter_frame, text="Filter tree:").pack(side=tk.LEFT)
+        self.filter_entry = tk.Entry(self.filter_frame, width=30)
+        self.filter_entry.pack(side=tk.LEFT, padx=5)
+        self.filter_entry.bind("<KeyRelease>", self._schedule_filter)
+        self.filter_mode_var = tk.StringVar(value=SEARCH_MODES[0])
+        self.filter_mode_box = ttk.Combobox(self.filter_frame, textvariable=self.filter_mode_var, values=SEARCH_MODES,
+                                            state="readonly", width=10)
+        self.filter_mode_box.pack(side=tk.LEFT)
+        self.filter_mode_box.bind("<<ComboboxSelected>>", self._schedule_filter)
+
+        # Status Bar
+        self.status_var = tk.StringVar(value="Ready")
+        self.status_bar = tk.Label(master, textvariable=self.status_var, bd=1, relief=tk.SUNKEN, anchor="w")
+        self.status_bar.grid(row=7, column=0, columnspan=3, sticky="ew", padx=10, pady=5)
+
+        # Configure output text tags
+        self.output_text.tag_config("dir", foreground="blue", font=("TkDefaultFont", 9, "bold"))
+        self.output_text.tag_config("file", foreground="green")
+        self.output_text.tag_config("error", foreground="red", font=("TkDefaultFont", 9, "bold"))
+        self.output_text.tag_config("info", foreground="gray")
+
+        self._log_message("Welcome to FileTree Manager. Select a directory to load its contents.\n", "info")
+        if os.environ.get("FILETREE_STARTUP_BENCHMARK"):
+            self._startup_built = time.perf_counter()
+            master.after_idle(self._report_startup)
+
+    def _report_startup(self):
+        # Benchmark mode only: once the first frame is drawn, prints the startup
+        # breakdown and exits so startup can be timed from a script.
+        self.master.update_idletasks()
+        painted = time.perf_counter()
+        total_ms = (painted - _STARTUP_BEGIN) * 1000
+        verdict = "over" if total_ms > STARTUP_BUDGET_MS else "within"
+        print(f"startup {total_ms:.0f} ms ({verdict} the {STARTUP_BUDGET_MS} ms budget): "
+              f"imports {(_STARTUP_IMPORTED - _STARTUP_BEGIN) * 1000:.0f} ms, "
+              f"widgets {(self._startup_built - _STARTUP_IMPORTED) * 1000:.0f} ms, "
+              f"first paint {(painted - self._startup_built) * 1000:.0f} ms", file=sys.stderr)
+        self.master.after(0, self.master.destroy)
+
+    def _on_tab_changed(self, event=None):
+        if self.notebook.select() == str(self.build_tab):
+            self._ensure_build_tab()
+
+    def _ensure_build_tab(self):
+        if self._build_tab_ready:
+            return
+        self._build_tab_ready = True
+        self.build_tab.grid_rowconfigure(0, weight=0)
+        self.build_tab.grid_rowconfigure(1, weight=1)
+        self.build_tab.grid_rowconfigure(2, weight=0)
+        self.build_tab.grid_rowconfigure(3, weight=1)
+        self.build_tab.grid_rowconfigure(4, weight=0)
+        self.build_tab.grid_columnconfigure(0, weight=1)
+
+        tk.Label(self.build_tab, text="Edit Directory Tree:").grid(row=0, column=0, sticky="w", padx=5, pady=5)
+        self.text_input = scrolledtext.ScrolledText(self.build_tab, width=80, height=15, undo=True)
+        self.text_input.grid(row=1, column=0, padx=10, pady=5, sticky="nsew")
+        self.text_input.tag_config("dir", foreground="blue", font=("TkDefaultFont", 9, "bold"))
+        self.text_input.tag_config("file", foreground="green")
+        self.text_input.tag_config("problem", background="#ffd6d6")
+        self.text_input.bind("<KeyRelease>", lambda e: [self._update_preview(), self._highlight_tree_text()])
+
+        tk.Label(self.build_tab, text="Live Preview:").grid(row=2, column=0, sticky="w", padx=5, pady=5)
+        self.preview = scrolledtext.ScrolledText(self.build_tab, width=80, height=10, state="normal")
+        self.preview.grid(row=3, column=0, padx=10, pady=5, sticky="nsew")
+
+        self.btn_frame = tk.Frame(self.build_tab)
+        self.btn_frame.grid(row=4, column=0, pady=10)
+        tk.Button(self.btn_frame, text="Build Structure", command=self._build_structure).grid(row=0, column=0, padx=5)
+        tk.Button(self.btn_frame, text="Export Tree as Archive", command=self._export_archive).grid(row=0, column=1, padx=5)
+        tk.Button(self.btn_frame, text="Copy Tree", command=self._copy_tree).grid(row=0, column=2, padx=5)
+        tk.Button(self.btn_frame, text="Undo", command=self.text_input.edit_undo).grid(row=0, column=3, padx=5)
+        tk.Button(self.btn_frame, text="Redo", command=self.text_input.edit_redo).grid(row=0, column=4, padx=5)
+        tk.Button(self.btn_frame, text="Batch Build...", command=self._batch_build).grid(row=0, column=5, padx=5)
+        self.archive_format_var = tk.StringVar(value=ARCHIVE_FORMATS[0])
+        self.compress_level_var = tk.IntVar(value=6)
+        tk.Label(self.btn_frame, text="Archive format:").grid(row=1, column=0, padx=5, pady=(5, 0))
+        ttk.Combobox(self.btn_frame, textvariable=self.archive_format_var, values=ARCHIVE_FORMATS,
+                     state="readonly", width=8).grid(row=1, column=1, padx=5, pady=(5, 0))
+        tk.Label(self.btn_frame, text="Level:").grid(row=1, column=2, padx=5, pady=(5, 0))
+        tk.Spinbox(self.btn_frame, from_=0, to=9, width=3,
+                   textvariable=self.compress_level_var).grid(row=1, column=3, padx=5, pady=(5, 0))
+        self.build_cached_var = tk.BooleanVar(value=False)
+        self.build_hardlink_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.btn_frame, text="Clone from skeleton cache",
+                       variable=self.build_cached_var).grid(row=2, column=0, columnspan=2, padx=5, pady=(5, 0))
+        tk.Checkbutton(self.btn_frame, text="Allow hardlinks to cache",
+                       variable=self.build_hardlink_var).grid(row=2, column=2, columnspan=2, padx=5, pady=(5, 0))
+        if self.dark_mode:
+            self._apply_theme([self.build_tab, self.btn_frame, self.preview, self.text_input])
+
+    def _log_message(self, message, tag="normal"):
+        self.output_text.insert(tk.END, message, tag)
+        self.output_text.see(tk.END)
+
+    def _fill_presets_menu(self):
+        # Called each time the menu opens; rebuilt only when the registry rescanned the
+        # preset directory since the menu was last filled, whoever triggered the rescan.
+        PRESET_REGISTRY.refresh()
+        if PRESET_REGISTRY.generation == self._presets_menu_generation:
+            return
+        self._presets_menu_generation = PRESET_REGISTRY.generation
+        self.presets_menu.delete(0, tk.END)
+        user_names = PRESET_REGISTRY.user_names()
+        for preset_name in PRESET_REGISTRY.packaged_names():
+            if preset_name not in user_names:
+                self.presets_menu.add_command(
+                    label=preset_name,
+                    command=lambda name=preset_name: self._load_preset(name)
+                )
+        if user_names:
+            self.presets_menu.add_separator()
+        for preset_name in user_names:
+            self.presets_menu.add_command(
+                label=preset_name,
+                command=lambda name=preset_name: self._load_preset(name)
+            )
+
+    def _apply_theme(self, widgets):
+        bg = self.bg_dark if self.dark_mode else self.bg_light
+        fg = self.fg_dark if self.dark_mode else self.fg_light
+        for widget in widgets:
+            try:
+                widget.configure(bg=bg, fg=fg, insertbackground=fg)
+            except:
+                pass
+
+    def _toggle_dark_mode(self):
+        self.dark_mode = not self.dark_mode
+        self.master.configure(bg=self.bg_dark if self.dark_mode else self.bg_light)
+        widgets = [self.input_frame, self.directory_label, self.directory_entry, self.browse_button,
+                   self.include_label, self.file_listbox, self.output_label, self.output_text,
+                   self.generate_button, self.tree_tab, self.scan_frame, self.build_tab,
+                   self.viewer_frame, self.filter_frame, self.status_bar]
+        if self._build_tab_ready:
+            widgets += [self.btn_frame, self.preview, self.text_input]
+        self._apply_theme(widgets)
+        self.notebook.configure(style="TNotebook")
+        self.status_var.set("Dark mode " + ("enabled" if self.dark_mode else "disabled"))
+
+    def _highlight_tree_text(self):
+        self.text_input.tag_remove("dir", "1.0", tk.END)
+        self.text_input.tag_remove("file", "1.0", tk.END)
+        lines = self.text_input.get("1.0", tk.END).splitlines()
+        for i, line in enumerate(lines, 1):
+            clean = line.lstrip("│├└─ ")
+            if clean.endswith("/"):
+                self.text_input.tag_add("dir", f"{i}.0", f"{i}.end")
+            elif clean.strip():
+                self.text_input.tag_add("file", f"{i}.0", f"{i}.end")
+        self.status_var.set(f"Highlighted {len(lines)} lines in tree")
+
+    def _copy_tree(self):
+        tree_text = self.text_input.get("1.0", tk.END).strip()
+        self.master.clipboard_clear()
+        self.master.clipboard_append(tree_text)
+        self._log_message("Tree copied to clipboard.\n", "info")
+        self.status_var.set("Tree copied to clipboard")
+
+    def _browse_directory(self):
+        initial_dir = self.directory_entry.get() if os.path.isdir(self.directory_entry.get()) else os.getcwd()
+        selected_directory = filedialog.askdirectory(parent=self.master, initialdir=initial_dir, title="Select Directory")
+        if selected_directory:
+            self.directory_entry.delete(0, tk.END)
+            self.directory_entry.insert(0, selected_directory)
+            self._log_message(f"Selected root: {selected_directory}\n", "info")
+            self._populate_listbox(selected_directory)
+        else:
+            self._log_message("Directory selection cancelled.\n", "info")
+            self.status_var.set("Directory selection cancelled")
+
+    def _populate_listbox(self, directory_path):
+        self.file_listbox.delete(0, tk.END)
+        try:
+            items = sorted(os.listdir(directory_path))
+            for item in items:
+                full_path = os.path.join(directory_path, item)
+                self.file_listbox.insert(tk.END, f"{item}/" if os.path.isdir(full_path) else item)
+            for i in range(self.file_listbox.size()):
+                self.file_listbox.selection_set(i)
+            self._log_message(f"Loaded {len(items)} items from '{os.path.basename(directory_path)}'.\n", "info")
+            self.status_var.set(f"Loaded {len(items)} items")
+        except PermissionError:
+            self._log_message(f"ERROR: Permission denied to access '{directory_path}'.\n", "error")
+            messagebox.showerror("Permission Error", f"Permission denied to access '{directory_path}'.")
+            self.status_var.set("Permission error")
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to load directory contents: {e}\n", "error")
+            messagebox.showerror("Error", f"Failed to load directory contents: {e}")
+            self.status_var.set("Error loading directory")
+
+    def _generate_tree(self):
+        self.output_text.delete(1.0, tk.END)
+        directory_path = self.directory_entry.get().strip()
+        if not directory_path or not os.path.isdir(directory_path):
+            messagebox.showerror("Error", "Please select a valid root directory.")
+            self._log_message(f"ERROR: Invalid root directory: {directory_path}\n", "error")
+            self.status_var.set("Invalid directory")
+            return
+        selected_items = self._get_selected_items()
+        if not selected_items:
+            messagebox.showwarning("Warning", "No items selected. The tree will be empty except for the root.")
+            self._log_message("WARNING: No items selected for tree generation.\n", "info")
+            self.status_var.set("No items selected")
+        scan_options = self._scan_options()
+        profiler = None
+        if self.profile_scan_var.get():
+            if scan_options["source"] != "filesystem":
+                messagebox.showerror("Error", "Scan profiling needs the filesystem source.")
+                self._log_message("ERROR: Scan profiling needs the filesystem source.\n", "error")
+                self.status_var.set("Profiling unavailable")
+                return
+            profiler = scan_options["profiler"] = ScanProfiler()
+        concurrency = scan_options.pop("concurrency")
+        with_stat = self.show_sizes_var.get()
+        self._log_message(f"Generating tree for selected items in: {directory_path}\n", "info")
+        if concurrency > 1 and profiler is None and scan_options["source"] == "filesystem":
+            # Listings run on the asyncio thread; the window stays live until they are in.
+            del scan_options["source"]
+            entries = []
+            future = self.async_loop.submit(self._collect_scan(entries, directory_path, selected_items, with_stat,
+                                                               concurrency=concurrency, **scan_options))
+            self.generate_button.config(state=tk.DISABLED)
+            self._poll_scan(future, entries, directory_path, with_stat)
+            return
+        self._show_scan(directory_path, scan_entries(directory_path, selected_items, with_stat=with_stat,
+                                                     **scan_options), with_stat, profiler)
+
+    async def _collect_scan(self, entries, root_dir, selected_items, with_stat, **scan_options):
+        async for batch in scan_tree_batches(root_dir, selected_items, with_stat, **scan_options):
+            entries.extend(batch)
+
+    def _poll_scan(self, future, entries, directory_path, with_stat):
+        if not future.done():
+            self.status_var.set(f"Scanning... {len(entries)} entries")
+            self.master.after(50, self._poll_scan, future, entries, directory_path, with_stat)
+            return
+        self.generate_button.config(state=tk.NORMAL)
+        try:
+            future.result()
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to scan {directory_path}: {e}\n", "error")
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Scan error")
+            return
+        self._show_scan(directory_path, entries, with_stat)
+
+    def _show_scan(self, directory_path, entries, with_stat, profiler=None):
+        self.search_index = TreeSearchIndex(f"{os.path.basename(directory_path)}/")
+        if with_stat:
+            size_root = rollup_sizes(directory_path, entries)
+            sort_by_size = self.sort_by_size_var.get()
+            self.tree_store = LineStore(itertools.chain(
+                [f"{size_root.name}/{size_annotation(size_root)}"],
+                iter_tree_lines(iter_rollup_entries(size_root, sort_by_size), annotate=size_annotation)))
+            self._log_message(format_largest_report(size_root, self.top_n_var.get()) + "\n", "info")
+            # Same entries in the same order, so line numbers match the sized view.
+            self._editor_store = LineStore(itertools.chain(
+                [f"{size_root.name}/"],
+                iter_tree_lines(self.search_index.record(iter_rollup_entries(size_root, sort_by_size)))))
+        else:
+            self.tree_store = LineStore(itertools.chain([f"{os.path.basename(directory_path)}/"],
+                                                        iter_tree_lines(self.search_index.record(entries))))
+            self._editor_store = self.tree_store
+        self.filter_entry.delete(0, tk.END)
+        self.tree_view.set_store(self.tree_store)
+        if self.load_editor_var.get():
+            self._load_into_editor(self._editor_store.join())
+        if profiler is not None:
+            self._log_message(profiler.format_report() + "\n", "info")
+        self._log_message(f"Tree generation complete: {len(self.tree_store)} lines.\n", "info")
+        self.status_var.set("Tree generated")
+
+    def _load_into_editor(self, tree_text):
+        self._ensure_build_tab()
+        self.text_input.delete(1.0, tk.END)
+        self.text_input.insert(tk.END, tree_text)
+        self._update_preview()
+        self._highlight_tree_text()
+
+    def _copy_generated(self):
+        if not len(self._editor_store):
+            self.status_var.set("Nothing generated to copy")
+            return
+        tree_text = self.tree_view.store.subtree_text(self.tree_view.selected or 0)
+        self.master.clipboard_clear()
+        self.master.clipboard_append(tree_text)
+        self.status_var.set(f"Copied {tree_text.count(chr(10)) + 1} lines to clipboard")
+
+    def _open_generated_in_editor(self):
+        # The editor gets the plain tree even when the view shows sizes.
+        if not len(self._editor_store):
+            self.status_var.set("Nothing generated to open")
+            return
+        store = self._editor_store if self.tree_view.store is self.tree_store else self.tree_view.store
+        tree_text = store.subtree_text(self.tree_view.selected or 0)
+        self._load_into_editor(tree_text)
+        self.notebook.select(self.build_tab)
+        self.status_var.set(f"Opened {tree_text.count(chr(10)) + 1} lines in editor")
+
+    def _schedule_filter(self, event=None):
+        if self._filter_job is not None:
+            self.master.after_cancel(self._filter_job)
+        self._filter_job = self.master.after(150, self._apply_filter)
+
+    def _apply_filter(self):
+        self._filter_job = None
+        if self.search_index is None:
+            # Nothing generated yet: index the tree in the editor, re-parsing only when it changed.
+            self._ensure_build_tab()
+            tree_text = self.text_input.get("1.0", tk.END)
+            if tree_text != self._indexed_text:
+                self._indexed_text = tree_text
+                self._text_index = TreeSearchIndex.from_tree_text(tree_text)
+                self.tree_store = self._editor_store = LineStore.from_text(tree_text)
+            index = self._text_index
+        else:
+            index = self.search_index
+        query = self.filter_entry.get().strip()
+        if not query:
+            self.tree_view.set_store(self.tree_store)
+            self.status_var.set("Filter cleared")
+            return
+        try:
+            start = time.perf_counter()
+            filtered, hits = index.render_filtered(query, self.filter_mode_var.get(), SEARCH_DISPLAY_LIMIT)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        except re.error as e:
+            self.status_var.set(f"Invalid pattern: {e}")
+            return
+        self.tree_view.set_store(LineStore.from_text(filtered))
+        shown = f"first {hits}" if hits >= SEARCH_DISPLAY_LIMIT else str(hits)
+        self.status_var.set(f"{shown} of {len(index)} entries match ({elapsed_ms:.0f} ms)")
+
+    def _get_selected_items(self):
+        selected_indices = self.file_listbox.curselection()
+        return [self.file_listbox.get(i).strip('/') for i in selected_indices] if selected_indices else []
+
+    def _scan_options(self):
+        ignore = [p.strip() for p in self.ignore_entry.get().split(",") if p.strip()]
+        max_depth = self.max_depth_var.get()
+        return {"ignore": ignore or None, "max_depth": max_depth or None, "source": self.scan_source_var.get(),
+                "symlinks": self.symlink_policy_var.get(), "one_file_system": self.one_file_system_var.get(),
+                "concurrency": self.scan_concurrency_var.get()}
+
+    def _export_snapshot(self):
+        directory_path = self._get_scan_root()
+        if not directory_path:
+            return
+        fmt = self.snapshot_format_var.get()
+        archive_path = filedialog.asksaveasfilename(defaultextension=f".{fmt}",
+                                                    filetypes=[(f"{fmt} Archives", f"*.{fmt}")])
+        if not archive_path:
+            self.status_var.set("Snapshot cancelled")
+            return
+        try:
+            self.status_var.set("Archiving snapshot...")
+            self.master.update_idletasks()
+            start = time.perf_counter()
+            stats = export_directory_archive(directory_path, self._get_selected_items(), archive_path, fmt,
+                                             **self._scan_options())
+            elapsed = max(time.perf_counter() - start, 1e-6)
+            self._log_message(f"Snapshot archived to: {archive_path}\n"
+                              f"{stats.files} files written, {stats.reused} unchanged files reused, "
+                              f"{format_size(stats.bytes)} read ({format_size(stats.bytes / elapsed)}/s).\n", "info")
+            self.status_var.set(f"Snapshot archived as {fmt}")
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to archive snapshot: {e}\n", "error")
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Snapshot error")
+
+    def _export_scan(self):
+        directory_path = self._get_scan_root()
+        if not directory_path:
+            return
+        fmt = self.scan_format_var.get()
+        out_path = filedialog.asksaveasfilename(defaultextension=f".{fmt}",
+                                                filetypes=[(f"{fmt.upper()} Files", f"*.{fmt}")])
+        if not out_path:
+            self.status_var.set("Export cancelled")
+            return
+        try:
+            with open(out_path, "w", encoding="utf-8", newline="") as f:
+                count = write_scan(directory_path, self._get_selected_items(), f, fmt, **self._scan_options())
+            self._log_message(f"Exported {count} entries as {fmt} to: {out_path}\n", "info")
+            self.status_var.set(f"Scan exported as {fmt}")
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to export scan: {e}\n", "error")
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Export error")
+
+    def _generate_to_file(self):
+        # Large trees go straight to disk without passing through the viewer or editor.
+        directory_path = self._get_scan_root()
+        if not directory_path:
+            return
+        out_path = filedialog.asksaveasfilename(defaultextension=".tree",
+                                                filetypes=[("Tree Files", "*.tree"), ("Text Files", "*.txt")])
+        if not out_path:
+            self.status_var.set("Generate to file cancelled")
+            return
+        try:
+            start = time.perf_counter()
+            with open(out_path, "w", encoding="utf-8", newline="", buffering=TREE_WRITE_BUFFER) as f:
+                count = write_tree_text(directory_path, self._get_selected_items(), f, **self._scan_options())
+            elapsed = time.perf_counter() - start
+            self._log_message(f"Wrote {count} lines in {elapsed:.2f}s to: {out_path}\n", "info")
+            self.status_var.set(f"Tree written to {os.path.basename(out_path)}")
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to write tree: {e}\n", "error")
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Generate to file error")
+
+    def _get_scan_root(self):
+        directory_path = self.directory_entry.get().strip()
+        if not directory_path or not os.path.isdir(directory_path):
+            messagebox.showerror("Error", "Please select a valid root directory.")
+            self._log_message(f"ERROR: Invalid root directory: {directory_path}\n", "error")
+            self.status_var.set("Invalid directory")
+            return None
+        return directory_path
+
+    def _save_fingerprints(self):
+        directory_path = self._get_scan_root()
+        if not directory_path:
+            return
+        out_path = filedialog.asksaveasfilename(defaultextension=".ftfp",
+                                                filetypes=[("Fingerprint Snapshots", "*.ftfp")])
+        if not out_path:
+            self.status_var.set("Fingerprint save cancelled")
+            return
+        try:
+            mode = self.fingerprint_mode_var.get()
+            root = compute_fingerprints(directory_path, self._get_selected_items(), mode)
+            with open(out_path, "w", encoding="utf-8") as f:
+                save_fingerprints(root, mode, f)
+            self._log_message(f"Fingerprints ({mode}) saved to: {out_path}\nRoot digest: {root.digest}\n", "info")
+            self.status_var.set("Fingerprints saved")
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to save fingerprints: {e}\n", "error")
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Fingerprint error")
+
+    def _compare_fingerprints(self):
+        directory_path = self._get_scan_root()
+        if not directory_path:
+            return
+        other = filedialog.askopenfilename(filetypes=[("Snapshots and Trees", "*.ftfp *.tree"), ("All Files", "*")])
+        if not other:
+            self.status_var.set("Compare cancelled")
+            return
+        try:
+            other_root, mode = load_fingerprint_source(other)
+            root = compute_fingerprints(directory_path, self._get_selected_items(), mode)
+            changes = list(compare_fingerprints(other_root, root))
+            self._log_message(f"Comparing {directory_path} against {other} ({mode}):\n", "info")
+            markers = {"added": "+", "removed": "-", "changed": "~"}
+            for status, path in changes:
+                self._log_message(f"  {markers[status]} {path}\n", "error" if status == "removed" else "file")
+            self._log_message(f"{len(changes)} difference(s) found.\n", "info")
+            self.status_var.set(f"{len(changes)} difference(s)")
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to compare: {e}\n", "error")
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Compare error")
+
+    def _save_snapshot(self):
+        directory_path = self._get_scan_root()
+        if not directory_path:
+            return
+        try:
+            mode = self.fingerprint_mode_var.get()
+            root = compute_fingerprints(directory_path, self._get_selected_items(), mode)
+            with SnapshotStore() as store:
+                snapshot_id = store.save(root, directory_path, mode)
+            self._log_message(f"Snapshot {snapshot_id} ({mode}) of {directory_path} saved to: {SNAPSHOT_DB}\n", "info")
+            self.status_var.set(f"Snapshot {snapshot_id} saved")
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to save snapshot: {e}\n", "error")
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Snapshot error")
+
+    def _diff_last_snapshot(self):
+        directory_path = self._get_scan_root()
+        if not directory_path:
+            return
+        try:
+            with SnapshotStore() as store:
+                saved = store.snapshots(directory_path)
+                if not saved:
+                    messagebox.showinfo("No Snapshot", "Save a snapshot of this directory first.")
+                    self.status_var.set("No snapshot to diff against")
+                    return
+                old, info = store.load(saved[-1].id)
+            new = compute_fingerprints(directory_path, self._get_selected_items(), info.mode)
+            changes = diff_trees(old, new)
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to diff against snapshot: {e}\n", "error")
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Diff error")
+            return
+        created = time.strftime("%Y-%m-%d %H:%M", time.localtime(info.created))
+        counts = Counter(change.status for change in changes)
+        summary = ", ".join(f"{counts[status]} {status}" for status in DIFF_STATUSES if counts[status]) or "no changes"
+        self._log_message(f"Diff of {directory_path} against snapshot {info.id} ({created}, {info.mode}): "
+                          f"{summary}\n", "info")
+        self.filter_entry.delete(0, tk.END)
+        self.tree_view.set_store(LineStore(iter_diff_tree_lines(os.path.basename(directory_path), changes)))
+        self.status_var.set(f"{len(changes)} change(s) since snapshot {info.id}")
+
+    def _checked_tree(self, tree_text):
+        # (paths, problems) of the editor text, kept until it is edited. Text loaded
+        # from a preset arrives with both from the registry.
+        if self._editor_parse is None or self._editor_parse[0] != tree_text:
+            self._editor_parse = (tree_text, parse_tree(tree_text), validate_tree(tree_text))
+        return self._editor_parse[1], self._editor_parse[2]
+
+    def _parse_tree(self, tree_text):
+        return self._checked_tree(tree_text)[0]
+
+    def _set_editor_tree(self, tree_text, parsed):
+        self._ensure_build_tab()
+        self.text_input.delete("1.0", tk.END)
+        self.text_input.insert(tk.END, tree_text)
+        self._editor_parse = (self.text_input.get("1.0", tk.END),) + tuple(parsed)
+        self._update_preview()
+        self._highlight_tree_text()
+
+    def _update_preview(self, event=None):
+        tree_text = self.text_input.get("1.0", tk.END)
+        self.preview.delete("1.0", tk.END)
+        self.text_input.tag_remove("problem", "1.0", tk.END)
+        try:
+            paths, problems = self._checked_tree(tree_text)
+        except Exception as e:
+            self.preview.insert(tk.END, f"⚠️ Invalid tree format: {e}")
+            self.status_var.set("Invalid tree format")
+            return
+        if problems:
+            # Problems go first, so they are seen before the build is attempted.
+            self.preview.insert(tk.END, f"⚠️ {len(problems)} problem(s):\n{format_tree_problems(problems)}\n\n")
+            for line in {problem.line for problem in problems[:TREE_PROBLEM_REPORT_LIMIT]}:
+                self.text_input.tag_add("problem", f"{line}.0", f"{line}.end")
+        self.preview.insert(tk.END, "".join(f"{'[DIR]' if is_dir else '[FILE]'} {path}\n"
+                                            for path, is_dir in paths))
+        if problems:
+            self.status_var.set(f"Preview: {len(paths)} items, {len(problems)} problem(s)")
+        else:
+            self.status_var.set(f"Preview updated with {len(paths)} items")
+
+    def _build_structure(self):
+        tree_text = self.text_input.get("1.0", tk.END)
+        if not tree_text.strip():
+            messagebox.showwarning("Input Needed", "Please paste or generate a directory tree.")
+            self.status_var.set("No tree input")
+            return
+        problems = self._checked_tree(tree_text)[1]
+        if problems:
+            # Nothing is written until the whole tree is valid.
+            self._log_message(f"ERROR: Tree has {len(problems)} problem(s):\n{format_tree_problems(problems)}\n",
+                              "error")
+            messagebox.showerror("Invalid Tree", format_tree_problems(problems, 10))
+            self.status_var.set(f"Build blocked: {len(problems)} problem(s)")
+            return
+        dest_dir = filedialog.askdirectory(title="Choose Destination Folder")
+        if not dest_dir:
+            self.status_var.set("Build cancelled")
+            return
+        try:
+            if self.build_cached_var.get():
+                used = build_structure_cached(self._parse_tree(tree_text), dest_dir,
+                                              hardlink=self.build_hardlink_var.get())
+                self._log_message("Cloned from cache: " + ", ".join(f"{count} {method}" for method, count
+                                                                    in used.most_common()) + "\n", "info")
+            else:
+                build_structure(self._parse_tree(tree_text), dest_dir)
+            messagebox.showinfo("🎉 Success", "Structure created successfully!")
+            self._log_message("Structure created successfully.\n", "info")
+            self.status_var.set("Structure built successfully")
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to build structure: {e}\n", "error")
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Build error")
+
+    def _batch_build(self):
+        manifest_path = filedialog.askopenfilename(title="Choose Batch Manifest",
+                                                   filetypes=[("Manifest", "*.json *.ndjson"), ("All files", "*.*")])
+        if not manifest_path:
+            self.status_var.set("Batch build cancelled")
+            return
+
+        def report(done, total, job, error):
+            if error:
+                self._log_message(f"ERROR: {job.dest}: {error}\n", "error")
+            self.status_var.set(f"Batch build: {done}/{total} jobs")
+            self.master.update_idletasks()
+
+        try:
+            build_options = {"hardlink": self.build_hardlink_var.get()} if self.build_cached_var.get() else None
+            result = run_batch(load_manifest(manifest_path), progress=report, build_options=build_options)
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to run batch build: {e}\n", "error")
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Batch build error")
+            return
+        summary = (f"{result.jobs - result.failed}/{result.jobs} jobs built, {result.files} files "
+                   f"in {result.seconds:.2f}s ({result.files / max(result.seconds, 1e-6):.0f} files/s)")
+        self._log_message(summary + "\n", "error" if result.failed else "info")
+        self.status_var.set(summary)
+
+    def _export_archive(self):
+        tree_text = self.text_input.get("1.0", tk.END)
+        if not tree_text.strip():
+            messagebox.showwarning("Input Needed", "Please paste or generate a directory tree.")
+            self.status_var.set("No tree input")
+            return
+        fmt = self.archive_format_var.get()
+        archive_path = filedialog.asksaveasfilename(defaultextension=f".{fmt}",
+                                                    filetypes=[(f"{fmt} Archives", f"*.{fmt}")])
+        if not archive_path:
+            self.status_var.set("Export cancelled")
+            return
+        try:
+            export_tree_archive(self._parse_tree(tree_text), archive_path, fmt, self.compress_level_var.get())
+            messagebox.showinfo("📦 Exported", f"Tree structure archived to:\n{archive_path}")
+            self._log_message(f"Tree structure archived ({fmt}) to: {archive_path}\n", "info")
+            self.status_var.set(f"Tree exported as {fmt}")
+        except Exception as e:
+            self._log_message(f"ERROR: Failed to export archive: {e}\n", "error")
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Export error")
+
+    def _save_preset(self):
+        self._ensure_build_tab()
+        content = self.text_input.get("1.0", tk.END)
+        os.makedirs(PRESET_REGISTRY.preset_dir, exist_ok=True)
+        file = filedialog.asksaveasfilename(defaultextension=".tree", initialdir=PRESET_REGISTRY.preset_dir)
+        if file:
+            with open(file, "w", encoding="utf-8") as f:
+                f.write(content)
+            self._log_message(f"Preset saved to: {file}\n", "info")
+            self.status_var.set("Preset saved")
+
+    def _load_preset_file(self):
+        file = filedialog.askopenfilename(filetypes=[("Tree Files", "*.tree")],
+                                          initialdir=PRESET_REGISTRY.preset_dir)
+        if file:
+            with open(file, "r", encoding="utf-8") as f:
+                self._set_editor_tree(f.read(), PRESET_REGISTRY.file_parsed(file))
+            self._log_message(f"Preset loaded from: {file}\n", "info")
+            self.status_var.set("Preset loaded")
+
+    def _load_preset(self, preset_name):
+        tree_text = PRESET_REGISTRY.text(preset_name) if preset_name in PRESET_REGISTRY else ""
+        if tree_text:
+            self._set_editor_tree(tree_text, PRESET_REGISTRY.parsed(preset_name))
+            self._log_message(f"Loaded preset: {preset_name}\n", "info")
+            self.status_var.set(f"Loaded preset: {preset_name}")
+
+
+# --- Command Line ---
+def _default_items(root_dir):
+    return sorted(os.listdir(root_dir))
+
+
+def _cmd_scan(args):
+    if args.sizes and args.format != "text":
+        print(f"scan: --sizes renders a text tree and cannot be combined with --format {args.format}",
+              file=sys.stderr)
+        return 2
+    items = args.items or _default_items(args.root)
+    options = _scan_options(args)
+    profiler = None
+    if args.profile or args.profile_collapsed:
+        profiler = options["profiler"] = ScanProfiler()
+    out = (open(args.output, "w", encoding="utf-8", newline="", buffering=TREE_WRITE_BUFFER)
+           if args.output else sys.stdout)
+    try:
+        if args.sizes:
+            size_root = rollup_sizes(args.root, scan_entries(args.root, items, with_stat=True, **options))
+            out.write(render_sized_tree(size_root, args.sort_size) + "\n")
+            if args.top:
+                out.write("\n" + format_largest_report(size_root, args.top) + "\n")
+        elif args.format == "text":
+            write_tree_text(args.root, items, out, **options)
+        else:
+            write_scan(args.root, items, out, args.format, **options)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if profiler is not None:
+        print(profiler.format_report(args.profile or 20), file=sys.stderr)
+        if args.profile_collapsed:
+            with open(args.profile_collapsed, "w", encoding="utf-8") as f:
+                profiler.write_collapsed(f)
+    return 0
+
+
+def _cmd_fingerprint(args):
+    root = compute_fingerprints(args.root, _default_items(args.root), args.mode, args.workers)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            save_fingerprints(root, args.mode, f)
+    print(root.digest)
+    return 0
+
+
+def _cmd_compare(args):
+    markers = {"added": "+", "removed": "-", "changed": "~"}
+    found = 0
+    for status, path in compare_sources(args.old, args.new, args.mode, args.workers):
+        print(f"{markers[status]} {path}")
+        found += 1
+    return 1 if found else 0
+
+
+def _cmd_snapshot(args):
+    with SnapshotStore(args.db) as store:
+        if args.list:
+            for info in store.snapshots(args.root):
+                created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(info.created))
+                label = f"  {info.label}" if info.label else ""
+                print(f"{info.id:>5}  {created}  {info.mode:<7} {info.entries:>9} entries  {info.root}{label}")
+            return 0
+        if not args.root:
+            print("snapshot: a root directory is required unless --list is given", file=sys.stderr)
+            return 2
+        root = compute_fingerprints(args.root, _default_items(args.root), args.mode, args.workers)
+        snapshot_id = store.save(root, args.root, args.mode, args.label)
+    print(f"{snapshot_id} {root.digest}")
+    return 0
+
+
+def _cmd_diff(args):
+    root_name, changes = diff_sources(args.old, args.new, args.mode, args.workers, args.db)
+    if args.tree:
+        for line in iter_diff_tree_lines(root_name, changes):
+            print(line)
+    else:
+        for change in changes:
+            print(json.dumps(_diff_record(change), ensure_ascii=False))
+    return 1 if changes else 0
+
+
+def _cmd_export(args):
+    if os.path.isdir(args.source):
+        start = time.perf_counter()
+        stats = export_directory_archive(args.source, _default_items(args.source), args.output, args.format,
+                                         args.level, args.workers, **_scan_options(args))
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        print(f"{stats.files} files written, {stats.reused} reused, {format_size(stats.bytes)} read "
+              f"in {elapsed:.2f}s ({format_size(stats.bytes / elapsed)}/s)", file=sys.stderr)
+        return 0
+    paths = load_tree_paths(args.source)
+    export_tree_archive(paths, args.output, args.format, args.level, args.workers)
+    return 0
+
+
+def _cmd_batch(args):
+    def report(done, total, job, error):
+        status = f"failed: {error}" if error else "ok"
+        print(f"[{done}/{total}] {job.dest} {status}", file=sys.stderr)
+
+    result = run_batch(load_manifest(args.manifest), args.workers, None if args.quiet else report,
+                       _build_options(args))
+    seconds = max(result.seconds, 1e-6)
+    print(f"{result.jobs - result.failed}/{result.jobs} jobs built, {result.files} files and {result.dirs} "
+          f"directories in {seconds:.2f}s ({result.files / seconds:.0f} files/s)")
+    return 1 if result.failed else 0
+
+
+def _cmd_lint(args):
+    found = 0
+    for source in args.sources:
+        for problem in load_tree(source)[1]:
+            print(f"{source}:{problem.line}: {problem.message} [{problem.kind}]")
+            found += 1
+    return 1 if found else 0
+
+
+def _cmd_build(args):
+    variables = dict(pair.partition("=")[::2] for pair in args.var)
+    paths, problems = load_tree(args.source)
+    if problems:
+        print(format_tree_problems(problems), file=sys.stderr)
+        print(f"Not building: {len(problems)} problem(s) in {args.source}", file=sys.stderr)
+        return 1
+    start = time.perf_counter()
+    options = _build_options(args)
+    if options is None:
+        build_structure(paths, args.dest, variables)
+        methods = ""
+    else:
+        used = build_structure_cached(paths, args.dest, variables, **options)
+        methods = " (" + ", ".join(f"{count} {method}" for method, count in used.most_common()) + ")"
+    files = sum(1 for _, is_dir in paths if not is_dir)
+    print(f"{files} files and {len(paths) - files} directories in {time.perf_counter() - start:.2f}s{methods}",
+          file=sys.stderr)
+    return 0
+
+
+def _cmd_serve(args):
+    server = TreeServer(args.socket, args.workers, args.cache_size)
+    print(f"Listening on {args.socket}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _cmd_client(args):
+    params = {}
+    for pair in args.params:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            print(f"Expected KEY=VALUE, got: {pair}", file=sys.stderr)
+            return 2
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        # The server has its own working directory, so send local paths absolute.
+        if key in ("root", "dest", "output") or (key == "source" and os.path.exists(value)):
+            value = os.path.abspath(value)
+        params[key] = value
+    try:
+        result = call_server(args.method, params, args.socket)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"No server listening on {args.socket}; start one with the serve command.", file=sys.stderr)
+        return 1
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(result if isinstance(result, str) else json.dumps(result, indent=2))
+    return 0
+
+
+def _add_scan_filter_arguments(parser):
+    parser.add_argument("--ignore", nargs="*", metavar="PATTERN", help="Skip names matching these glob patterns")
+    parser.add_argument("--max-depth", type=int, help="Only descend this many levels below the root")
+    parser.add_argument("--symlinks", choices=SYMLINK_POLICIES, default="once",
+                        help="once: follow, listing each directory once; show: list without following; never: omit")
+    parser.add_argument("--one-file-system", action="store_true", help="Do not descend into other file systems")
+    parser.add_argument("--source", dest="scan_source", choices=SCAN_SOURCES, default="filesystem",
+                        help="Walk the filesystem, or list tracked files from .git/index (optionally plus untracked)")
+    parser.add_argument("--concurrency", type=int, default=1, metavar="N",
+                        help="List up to N directories at once; helps on high-latency mounts (default: 1, serial)")
+
+
+def _add_build_cache_arguments(parser):
+    parser.add_argument("--cached", action="store_true",
+                        help="Clone files from a cached copy of each tree (reflink, then copy_file_range, then copy)")
+    parser.add_argument("--hardlink", action="store_true",
+                        help="With --cached, hardlink files to the cache when reflinks are unavailable")
+    parser.add_argument("--cache-dir", help=f"Skeleton cache location (default: {SKELETON_CACHE_DIR})")
+
+
+def _build_options(args):
+    if not args.cached:
+        return None
+    return {"cache_dir": args.cache_dir, "hardlink": args.hardlink}
+
+
+def _scan_options(args):
+    return {"ignore": args.ignore, "max_depth": args.max_depth, "source": args.scan_source,
+            "symlinks": args.symlinks, "one_file_system": args.one_file_system, "concurrency": args.concurrency}
+
+
+def _build_arg_parser():
+    import argparse
+    parser = argparse.ArgumentParser(description="FileTree Manager command line. Run without arguments for the GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="Scan a directory and print its tree")
+    scan.add_argument("root", help="Root directory to scan")
+    scan.add_argument("--items", nargs="*", help="Top-level items to include (default: all)")
+    scan.add_argument("--format", choices=("text",) + SCAN_FORMATS, default="text")
+    scan.add_argument("-o", "--output", help="Write to this file instead of stdout")
+    _add_scan_filter_arguments(scan)
+    scan.add_argument("--sizes", action="store_true", help="Show rolled-up sizes and counts inline (text output)")
+    scan.add_argument("--sort-size", action="store_true", help="With --sizes, order siblings by size")
+    scan.add_argument("--top", type=int, default=0, metavar="N", help="With --sizes, report the N largest subtrees")
+    scan.add_argument("--profile", type=int, nargs="?", const=20, default=0, metavar="N",
+                      help="Time each directory's listing and stats; report the N slowest on stderr (default 20)")
+    scan.add_argument("--profile-collapsed", metavar="FILE",
+                      help="Write per-directory times as collapsed stacks for flame graph tools")
+    scan.set_defaults(func=_cmd_scan)
+
+    fingerprint = commands.add_parser("fingerprint", help="Compute Merkle fingerprints of a directory")
+    fingerprint.add_argument("root", help="Root directory to fingerprint")
+    fingerprint.add_argument("--mode", choices=FINGERPRINT_MODES, default="names")
+    fingerprint.add_argument("--workers", type=int, help="Hashing threads for --mode content")
+    fingerprint.add_argument("-o", "--output", help="Save the fingerprint snapshot to this file")
+    fingerprint.set_defaults(func=_cmd_fingerprint)
+
+    compare = commands.add_parser("compare", help="Compare two directories, snapshots or .tree files")
+    compare.add_argument("old", help="Directory, fingerprint snapshot or .tree file")
+    compare.add_argument("new", help="Directory, fingerprint snapshot or .tree file")
+    compare.add_argument("--mode", choices=FINGERPRINT_MODES, default="names")
+    compare.add_argument("--workers", type=int, help="Hashing threads for --mode content")
+    compare.set_defaults(func=_cmd_compare)
+
+    snapshot = commands.add_parser("snapshot", help="Store a directory's fingerprints in the snapshot database")
+    snapshot.add_argument("root", nargs="?", help="Root directory to snapshot (with --list, only its snapshots)")
+    snapshot.add_argument("--label", help="Name to refer to this snapshot by, e.g. a date or release")
+    snapshot.add_argument("--list", action="store_true", help="List stored snapshots instead of taking one")
+    snapshot.add_argument("--mode", choices=FINGERPRINT_MODES, default="names")
+    snapshot.add_argument("--workers", type=int, help="Hashing threads for --mode content")
+    snapshot.add_argument("--db", default=SNAPSHOT_DB, help=f"Snapshot database (default: {SNAPSHOT_DB})")
+    snapshot.set_defaults(func=_cmd_snapshot)
+
+    diff = commands.add_parser("diff", help="Structural diff of two snapshots, directories or .tree files as NDJSON")
+    diff.add_argument("old", help="Snapshot id or label, directory, fingerprint file or .tree file")
+    diff.add_argument("new", help="Snapshot id or label, directory, fingerprint file or .tree file")
+    diff.add_argument("--tree", action="store_true", help="Print an annotated tree instead of NDJSON")
+    diff.add_argument("--mode", choices=FINGERPRINT_MODES, default="names")
+    diff.add_argument("--workers", type=int, help="Hashing threads for --mode content")
+    diff.add_argument("--db", default=SNAPSHOT_DB, help=f"Snapshot database (default: {SNAPSHOT_DB})")
+    diff.set_defaults(func=_cmd_diff)
+
+    export = commands.add_parser("export", help="Export a directory, .tree file or preset as an archive")
+    export.add_argument("source", help="Directory to snapshot (real contents), .tree file or preset name")
+    export.add_argument("-o", "--output", required=True, help="Archive to write")
+    export.add_argument("--format", choices=ARCHIVE_FORMATS, default="zip")
+    export.add_argument("--level", type=int, default=6, choices=range(10), metavar="0-9")
+    export.add_argument("--workers", type=int, help="Compression threads (default: CPU count)")
+    _add_scan_filter_arguments(export)
+    export.set_defaults(func=_cmd_export)
+
+    lint = commands.add_parser("lint", help="Check .tree files or presets for problems that would break a build")
+    lint.add_argument("sources", nargs="+", help=".tree files or preset names")
+    lint.set_defaults(func=_cmd_lint)
+
+    build = commands.add_parser("build", help="Build a .tree file or preset into a directory")
+    build.add_argument("source", help=".tree file or preset name")
+    build.add_argument("dest", help="Destination directory")
+    build.add_argument("--var", action="append", default=[], metavar="NAME=VALUE",
+                       help="Fill {{NAME}} placeholders (repeatable)")
+    _add_build_cache_arguments(build)
+    build.set_defaults(func=_cmd_build)
+
+    batch = commands.add_parser("batch", help="Build many trees from a manifest in parallel")
+    batch.add_argument("manifest", help="JSON or NDJSON list of {tree, dest, variables} entries")
+    batch.add_argument("--workers", type=int, help="Build processes (default: CPU count)")
+    batch.add_argument("-q", "--quiet", action="store_true", help="Only print the summary")
+    _add_build_cache_arguments(batch)
+    batch.set_defaults(func=_cmd_batch)
+
+    serve = commands.add_parser("serve", help="Run a JSON-RPC server with warm caches on a Unix socket")
+    serve.add_argument("--socket", default=SERVER_SOCKET, help=f"Socket path (default: {SERVER_SOCKET})")
+    serve.add_argument("--workers", type=int, help="Concurrent request threads")
+    serve.add_argument("--cache-size", type=int, default=32, help="Scan results kept in memory")
+    serve.set_defaults(func=_cmd_serve)
+
+    client = commands.add_parser("client", help="Send one request to a running server")
+    client.add_argument("method", help="generate, parse, lint, build, export, stats or shutdown")
+    client.add_argument("params", nargs="*", metavar="KEY=VALUE", help="Parameters; values are parsed as JSON "
+                        "when possible, e.g. root=. max_depth=2 ignore='[\".git\"]'")
+    client.add_argument("--socket", default=SERVER_SOCKET, help=f"Socket path (default: {SERVER_SOCKET})")
+    client.set_defaults(func=_cmd_client)
+    return parser
+
+
+def main(argv=None):
+    args = _build_arg_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (OSError, ValueError, KeyError) as e:
+        # Missing files, bad trees and unknown names are user errors, not crashes.
+        message = e.args[0] if isinstance(e, KeyError) and e.args else e
+        print(f"{args.command}: {message}", file=sys.stderr)
+        return 2
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    _import_tk()
     root = tk.Tk()
     app = FileTreeManagerGUI(root)
     root.mainloop()
\ No newline at end of file
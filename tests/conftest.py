@@ -0,0 +1,17 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+MODULE_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "src", "FileTreeManagerv1.2.py")
+
+
+@pytest.fixture(scope="session")
+def ftm():
+    # The module name has a dot in it, so it is loaded from its path.
+    spec = importlib.util.spec_from_file_location("FileTreeManager", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
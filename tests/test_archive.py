@@ -0,0 +1,129 @@
+import gzip
+import io
+import lzma
+import os
+import random
+import tarfile
+import zipfile
+
+import pytest
+
+
+def make_source(ftm, root):
+    # Empty, small, compressible and incompressible files, the larger ones
+    # spanning several COMPRESS_CHUNK_SIZE blocks.
+    rng = random.Random(1)
+    chunk = ftm.COMPRESS_CHUNK_SIZE
+    files = {
+        "empty.txt": b"",
+        "small.py": b"print('hello')\n",
+        "docs/text.md": b"".join(b"line %d of a very repetitive file\n" % i for i in range(200000)),
+        "data/random.bin": rng.randbytes(2 * chunk + 12345),
+        "data/deep/nested/exact.bin": rng.randbytes(chunk),
+    }
+    for rel, data in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    (root / "empty_dir").mkdir()
+    return files
+
+
+def snapshot(root):
+    # rel -> bytes for files, ("link", target) for links, None for directories.
+    found = {}
+    for current, dirs, files in os.walk(root):
+        for name in dirs + files:
+            path = os.path.join(current, name)
+            rel = os.path.relpath(path, root).replace(os.sep, "/")
+            if os.path.islink(path):
+                found[rel] = ("link", os.readlink(path))
+            elif os.path.isdir(path):
+                found[rel] = None
+            else:
+                with open(path, "rb") as f:
+                    found[rel] = f.read()
+    return found
+
+
+@pytest.fixture
+def source(ftm, tmp_path):
+    root = tmp_path / "project"
+    make_source(ftm, root)
+    if hasattr(os, "symlink"):
+        (root / "docs" / "latest.md").symlink_to("text.md")
+    return root
+
+
+def export(ftm, source, out_path, fmt, **options):
+    return ftm.export_directory_archive(str(source), sorted(os.listdir(source)), str(out_path), fmt,
+                                        workers=4, **options)
+
+
+def test_zip_round_trip(ftm, source, tmp_path):
+    out = tmp_path / "out.zip"
+    export(ftm, source, out, "zip")
+    with zipfile.ZipFile(out) as zf:
+        assert zf.testzip() is None
+        zf.extractall(tmp_path / "x")
+        links = {info.filename for info in zf.infolist() if (info.external_attr >> 16) & 0o170000 == 0o120000}
+    extracted = snapshot(tmp_path / "x" / "project")
+    expected = snapshot(source)
+    for rel in links:
+        # zipfile extracts links as files holding their target.
+        rel = rel.split("/", 1)[1]
+        expected[rel] = expected[rel][1].encode("utf-8")
+    assert extracted == expected
+
+
+@pytest.mark.parametrize("fmt", ["tar", "tar.gz", "tar.xz"])
+def test_tar_round_trip(ftm, source, tmp_path, fmt):
+    out = tmp_path / f"out.{fmt}"
+    export(ftm, source, out, fmt)
+    with tarfile.open(out) as tf:
+        tf.extractall(tmp_path / "x", filter="tar")
+    assert snapshot(tmp_path / "x" / "project") == snapshot(source)
+
+
+@pytest.mark.parametrize("codec, decompress", [("gz", gzip.decompress), ("xz", lzma.decompress)])
+def test_parallel_stream_matches_input(ftm, codec, decompress):
+    rng = random.Random(2)
+    data = rng.randbytes(3 * ftm.COMPRESS_CHUNK_SIZE) + b"abc" * 1000000
+    raw = io.BytesIO()
+    stream = ftm.ParallelCompressedStream(raw, codec, level=1, workers=4)
+    pos = 0
+    while pos < len(data):
+        step = rng.randrange(1, 3 * ftm.COMPRESS_CHUNK_SIZE // 2)
+        stream.write(data[pos:pos + step])
+        pos += step
+    stream.close()
+    assert decompress(raw.getvalue()) == data
+
+
+@pytest.mark.parametrize("codec, decompress", [("gz", gzip.decompress), ("xz", lzma.decompress)])
+def test_parallel_stream_of_nothing(ftm, codec, decompress):
+    raw = io.BytesIO()
+    stream = ftm.ParallelCompressedStream(raw, codec)
+    stream.close()
+    assert decompress(raw.getvalue()) == b""
+
+
+def test_zip_update_reuses_unchanged_members(ftm, source, tmp_path):
+    out = tmp_path / "out.zip"
+    first = export(ftm, source, out, "zip")
+    assert first.reused == 0
+
+    (source / "small.py").write_bytes(b"print('changed, and longer')\n")
+    (source / "added.txt").write_bytes(b"new file\n")
+    (source / "data" / "random.bin").unlink()
+    second = export(ftm, source, out, "zip")
+    assert (second.files, second.reused) == (2, first.files - 2)
+
+    with zipfile.ZipFile(out) as zf:
+        assert zf.testzip() is None
+        names = zf.namelist()
+        assert "project/data/random.bin" not in names
+        assert zf.read("project/small.py") == b"print('changed, and longer')\n"
+        assert zf.read("project/added.txt") == b"new file\n"
+        assert zf.read("project/docs/text.md") == (source / "docs" / "text.md").read_bytes()
+    assert len(names) == len(set(names))
@@ -0,0 +1,29 @@
+import io
+import os
+
+import pytest
+
+
+@pytest.mark.skipif(not hasattr(os, "symlink"), reason="needs symlinks")
+def test_saved_diagram_matches_unchanged_directory(ftm, tmp_path):
+    root = tmp_path / "t"
+    (root / "c").mkdir(parents=True)
+    (root / "c" / "x.txt").touch()
+    (root / "c" / "alink").symlink_to(os.pardir)
+    items = sorted(os.listdir(root))
+    out = io.StringIO()
+    ftm.write_tree_text(str(root), items, out)
+    assert "<Already listed>" in out.getvalue()
+
+    from_text = ftm.fingerprints_from_tree_text(out.getvalue())
+    from_disk = ftm.compute_fingerprints(str(root), items)
+    assert list(ftm.compare_fingerprints(from_text, from_disk)) == []
+    assert from_text.children["c"].children["alink"].error == "Already listed"
+
+
+def test_note_with_slashes_stays_on_its_directory(ftm):
+    text = "r/\n├── a/\n├──     <Error: [Errno 5] Input/output error: '/x/y'>\n└── b.txt\n"
+    root = ftm.fingerprints_from_tree_text(text)
+    assert sorted(root.children) == ["a", "b.txt"]
+    assert root.children["a"].error == "Error: [Errno 5] Input/output error: '/x/y'"
+    assert root.children["a"].children == {}
@@ -0,0 +1,79 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+
+FILES = [
+    "README.md",
+    "src/app/__init__.py",
+    "src/app/core/logic.py",
+    "src/app/core/logic_test.py",
+    "src/app/core/utils.py",
+    "src/application.py",
+    "docs/guide/intro.md",
+    "docs/guide/intro.rst",
+    "données/été.txt",
+    "z" * 120 + "/long.txt",
+]
+
+
+def git(repo, *args):
+    return subprocess.run(["git", "-C", str(repo), *args], check=True, capture_output=True).stdout
+
+
+def make_repo(tmp_path, version, object_format):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    try:
+        git(repo, "init", "-q", f"--object-format={object_format}")
+    except subprocess.CalledProcessError:
+        pytest.skip(f"git cannot create {object_format} repositories")
+    for i, rel in enumerate(FILES):
+        path = repo / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * i)
+    if hasattr(os, "symlink"):
+        (repo / "link").symlink_to("README.md")
+    git(repo, "add", "-A")
+    if version >= 3:
+        # Entries with extended flags, which version 2 cannot store.
+        (repo / "later.txt").write_text("later\n", encoding="utf-8")
+        git(repo, "add", "--intent-to-add", "later.txt")
+        git(repo, "update-index", "--skip-worktree", "src/app/core/utils.py")
+    git(repo, "update-index", "--index-version", str(version))
+    return repo
+
+
+@pytest.mark.parametrize("object_format", ["sha1", "sha256"])
+@pytest.mark.parametrize("version", [2, 3, 4])
+def test_read_git_index_matches_git(ftm, tmp_path, version, object_format):
+    repo = make_repo(tmp_path, version, object_format)
+    with open(repo / ".git" / "index", "rb") as f:
+        assert int.from_bytes(f.read(8)[4:], "big") == version
+
+    expected = {}
+    for record in git(repo, "ls-files", "-s", "-z").split(b"\0"):
+        if record:
+            info, path = record.split(b"\t", 1)
+            expected[path.decode("utf-8")] = int(info.split()[0], 8)
+    entries = ftm.read_git_index(str(repo / ".git"))
+    assert [path for path, _, _, _ in entries] == list(expected)
+    for path, mode, size, mtime in entries:
+        assert mode == expected[path]
+        if path != "later.txt":  # intent-to-add entries carry no stat data
+            st = os.lstat(repo / path)
+            assert size == st.st_size
+            assert int(mtime) == int(st.st_mtime)
+
+
+def test_git_source_lists_tracked_files(ftm, tmp_path):
+    repo = make_repo(tmp_path, 4, "sha1")
+    (repo / "untracked.txt").touch()
+    items = sorted(os.listdir(repo))
+    tracked = {entry.rel for entry in ftm.scan_entries(str(repo), items, source="git") if not entry.is_dir}
+    assert tracked == set(git(repo, "ls-files", "-z").decode("utf-8").split("\0")) - {""}
+    with_untracked = {entry.rel for entry in ftm.scan_entries(str(repo), items, source="git+untracked")}
+    assert "untracked.txt" in with_untracked
@@ -0,0 +1,32 @@
+def make_registry(ftm, tmp_path, **options):
+    return ftm.PresetRegistry(str(tmp_path / "presets"), str(tmp_path / "cache"), **options)
+
+
+def test_parsed_trees_in_memory_are_bounded(ftm, tmp_path):
+    registry = make_registry(ftm, tmp_path, memory_size=4)
+    sources = []
+    for i in range(10):
+        source = tmp_path / f"t{i}.tree"
+        source.write_text(f"t{i}/\n└── main.py\n", encoding="utf-8")
+        sources.append(str(source))
+    for source in sources:
+        registry.file_paths(source)
+    assert len(registry._parsed) == 4
+    # Evicted trees come back from the disk cache, the recent ones from memory.
+    assert registry.file_paths(sources[0]) == [("t0", True), ("t0/main.py", False)]
+    assert registry.file_paths(sources[-1]) == [("t9", True), ("t9/main.py", False)]
+    assert len(registry._parsed) == 4
+
+
+def test_problems_are_cached_with_the_paths(ftm, tmp_path, monkeypatch):
+    source = tmp_path / "bad.tree"
+    source.write_text("p/\n├── a.py\n└── a.py\n", encoding="utf-8")
+    paths, problems = make_registry(ftm, tmp_path).file_parsed(str(source))
+    assert [problem.kind for problem in problems] == ["duplicate"]
+
+    def unexpected(tree_text):
+        raise AssertionError("the cached tree was read again")
+
+    monkeypatch.setattr(ftm, "parse_tree", unexpected)
+    monkeypatch.setattr(ftm, "validate_tree", unexpected)
+    assert make_registry(ftm, tmp_path).file_parsed(str(source)) == (paths, problems)
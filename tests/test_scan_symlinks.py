@@ -0,0 +1,77 @@
+import io
+import os
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "symlink"), reason="needs symlinks")
+
+
+def render(ftm, root, **scan_options):
+    out = io.StringIO()
+    ftm.write_tree_text(str(root), sorted(os.listdir(root)), out, **scan_options)
+    return out.getvalue().splitlines()
+
+
+def note_after(lines, name):
+    # The line following a directory's own line, where a cut-off note is shown.
+    index = next(i for i, line in enumerate(lines) if line.endswith(f"── {name}/"))
+    return lines[index + 1].strip("│├└─ ")
+
+
+def test_symlink_cycle_is_listed_once(ftm, tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "a" / "b" / "up").symlink_to(os.path.join(os.pardir, os.pardir))
+    lines = render(ftm, tmp_path)
+    assert note_after(lines, "up") == "<Already listed>"
+    assert sum(line.endswith("── b/") for line in lines) == 1
+
+
+def test_link_inside_root_defers_to_real_directory(ftm, tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "d").mkdir()
+    (tmp_path / "d" / "f.txt").touch()
+    (tmp_path / "a" / "dlink").symlink_to(os.path.join(os.pardir, "d"))
+    lines = render(ftm, tmp_path)
+    assert note_after(lines, "dlink") == "<Already listed>"
+    assert note_after(lines, "d") == "f.txt"
+    assert sum(line.endswith("── f.txt") for line in lines) == 1
+
+
+def test_duplicate_link_to_outside_directory(ftm, tmp_path):
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "x.txt").touch()
+    root = tmp_path / "root"
+    root.mkdir()
+    (root / "first").symlink_to(outside)
+    (root / "second").symlink_to(outside)
+    lines = render(ftm, root)
+    assert note_after(lines, "first") == "x.txt"
+    assert note_after(lines, "second") == "<Already listed>"
+
+
+def test_one_file_system_stops_at_other_device(ftm, tmp_path, monkeypatch):
+    (tmp_path / "local" / "sub").mkdir(parents=True)
+    (tmp_path / "mnt" / "sub").mkdir(parents=True)
+    real_identity = ftm._dir_identity
+    mount = str(tmp_path / "mnt")
+
+    def identity(path, dir_entry=None):
+        dev, ino = real_identity(path, dir_entry)
+        return (dev + 1 if path == mount else dev), ino
+
+    monkeypatch.setattr(ftm, "_dir_identity", identity)
+    lines = render(ftm, tmp_path, one_file_system=True)
+    assert note_after(lines, "mnt") == "<Other file system>"
+    assert note_after(lines, "local") == "sub/"
+    assert note_after(render(ftm, tmp_path), "mnt") == "sub/"
+
+
+def test_sized_tree_keeps_cut_off_directory_lines(ftm, tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "loop").symlink_to(os.pardir)
+    items = sorted(os.listdir(tmp_path))
+    size_root = ftm.rollup_sizes(str(tmp_path), ftm.scan_entries(str(tmp_path), items, with_stat=True))
+    lines = ftm.render_sized_tree(size_root).splitlines()
+    index = next(i for i, line in enumerate(lines) if "── loop/" in line)
+    assert lines[index + 1].strip("│├└─ ") == "<Already listed>"
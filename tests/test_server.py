@@ -0,0 +1,59 @@
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def server(ftm, tmp_path):
+    return ftm.TreeServer(str(tmp_path / "s.sock"), workers=2)
+
+
+def handle(server, message):
+    return server.handle_message(json.dumps(message).encode("utf-8"))
+
+
+def test_empty_batch_is_an_invalid_request(ftm, server):
+    response = handle(server, [])
+    assert response["id"] is None
+    assert response["error"]["code"] == ftm.JSONRPC_INVALID_REQUEST
+
+
+def test_notifications_get_no_reply(server):
+    assert handle(server, {"jsonrpc": "2.0", "method": "stats"}) is None
+    assert handle(server, {"jsonrpc": "2.0", "method": "no-such-method"}) is None
+    assert handle(server, {"jsonrpc": "2.0", "method": "parse", "params": {"bogus": 1}}) is None
+    assert handle(server, {"jsonrpc": "2.0", "method": "build", "params": {"dest": "x", "tree": "../x"}}) is None
+    batch = [{"jsonrpc": "2.0", "method": "no-such-method"}, {"jsonrpc": "2.0", "id": 7, "method": "stats"}]
+    assert [response["id"] for response in handle(server, batch)] == [7]
+    assert handle(server, [{"jsonrpc": "2.0", "method": "stats"}]) is None
+
+
+def test_errors_still_answer_requests_with_an_id(ftm, server):
+    response = handle(server, {"jsonrpc": "2.0", "id": 3, "method": "no-such-method"})
+    assert response["id"] == 3
+    assert response["error"]["code"] == ftm.JSONRPC_METHOD_NOT_FOUND
+    assert handle(server, 5)["error"]["code"] == ftm.JSONRPC_INVALID_REQUEST
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix-domain sockets")
+def test_empty_batch_over_the_socket_does_not_hang(ftm, server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        for _ in range(100):
+            if os.path.exists(server.socket_path):
+                break
+            threading.Event().wait(0.05)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(5)
+            sock.connect(server.socket_path)
+            sock.sendall(b"[]\n")
+            with sock.makefile("rb") as reader:
+                response = json.loads(reader.readline())
+        assert response["error"]["code"] == ftm.JSONRPC_INVALID_REQUEST
+    finally:
+        server.shutdown()
+        thread.join(5)
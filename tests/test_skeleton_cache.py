@@ -0,0 +1,34 @@
+import os
+
+
+def read_tree(root):
+    contents = {}
+    for current, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(current, name)
+            with open(path, "rb") as f:
+                contents[os.path.relpath(path, root)] = f.read()
+    return contents
+
+
+def test_copy_over_hardlinked_build_keeps_cache(ftm, tmp_path):
+    paths = ftm.parse_tree(ftm.PRESETS["Standard CLI Project"])
+    cache_dir = str(tmp_path / "cache")
+    plain = tmp_path / "plain"
+    ftm.build_structure(paths, str(plain))
+    expected = read_tree(plain)
+    assert any(expected.values())
+
+    dest = str(tmp_path / "dest")
+    skeleton = ftm.materialize_skeleton(paths, cache_dir)
+    cli = os.path.join("my_cli_app_project", "src", "my_cli_app", "cli.py")
+    assert ftm.build_structure_cached(paths, dest, cache_dir=cache_dir, hardlink=True)["hardlink"]
+    assert not ftm.build_structure_cached(paths, dest, cache_dir=cache_dir)["hardlink"]
+    assert read_tree(skeleton) == expected
+    assert read_tree(dest) == expected
+    assert not os.path.samefile(os.path.join(skeleton, cli), os.path.join(dest, cli))
+
+    ftm.build_structure_cached(paths, dest, cache_dir=cache_dir, hardlink=True)
+    ftm.build_structure(paths, dest)
+    assert not os.path.samefile(os.path.join(skeleton, cli), os.path.join(dest, cli))
+    assert read_tree(skeleton) == expected
@@ -0,0 +1,60 @@
+import os
+import resource
+import sys
+
+import pytest
+
+TOP_DIRS = 10
+MAX_RSS_GROWTH_KB = 64 * 1024
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # bytes there, kilobytes on Linux
+
+
+@pytest.fixture
+def synthetic_root(ftm, tmp_path, monkeypatch):
+    # Real top-level directories, expanded by a patched _list_children into
+    # fanouts[0] directories of fanouts[1] directories ... of fanouts[-1] files.
+    root = tmp_path / "root"
+    for i in range(TOP_DIRS):
+        (root / f"top{i}").mkdir(parents=True)
+    base_depth = str(root).count(os.sep) + 1
+
+    def expand(*fanouts):
+        def synthetic_children(dir_path, ignore=None, symlinks="once"):
+            level = dir_path.count(os.sep) - base_depth
+            if level < len(fanouts) - 1:
+                return [(f"{dir_path}{os.sep}d{i:04d}", f"d{i:04d}", True, None) for i in range(fanouts[level])]
+            return [(f"{dir_path}{os.sep}file_{i:04d}.py", f"file_{i:04d}.py", False, None)
+                    for i in range(fanouts[-1])]
+
+        monkeypatch.setattr(ftm, "_list_children", synthetic_children)
+        monkeypatch.setattr(ftm, "_dir_identity", lambda path, dir_entry=None: None)
+        return str(root)
+
+    return expand
+
+
+def write_to_devnull(ftm, root, **scan_options):
+    before = peak_rss_kb()
+    with open(os.devnull, "w", encoding="utf-8") as out:
+        lines = ftm.write_tree_text(root, sorted(os.listdir(root)), out, **scan_options)
+    return lines, peak_rss_kb() - before
+
+
+def test_write_tree_text_memory_stays_flat(ftm, synthetic_root):
+    # About ten million lines, which would take gigabytes if the diagram were
+    # joined in memory.
+    lines, growth = write_to_devnull(ftm, synthetic_root(100, 100, 100))
+    assert lines == 1 + TOP_DIRS * (1 + 100 + 100 ** 2 + 100 ** 3)
+    assert growth < MAX_RSS_GROWTH_KB
+
+
+def test_concurrent_scan_memory_stays_flat(ftm, synthetic_root):
+    # 1500 directories of 1000 files: listings fetched ahead of the walk must
+    # not pile up while it works through the ones before them.
+    lines, growth = write_to_devnull(ftm, synthetic_root(150, 1000), concurrency=8)
+    assert lines == 1 + TOP_DIRS * (1 + 150 + 150 * 1000)
+    assert growth < MAX_RSS_GROWTH_KB